@@ -4,6 +4,8 @@ import logging
 from flask import Flask
 from .config import Settings
 from .extensions import init_extensions
+from .services.http import init_http
+from .services.media_cache import init_media_cache
 
 # Configurar logging
 logging.basicConfig(
@@ -16,9 +18,6 @@ logger = logging.getLogger(__name__)
 def create_app():
     logger.info("Iniciando criação da aplicação Flask")
 
-    os.makedirs(Settings.MEDIA_CACHE_DIR, exist_ok=True)
-    logger.info(f"Diretório de cache criado/verificado: {Settings.MEDIA_CACHE_DIR}")
-
     app = Flask(__name__, static_folder='static')
     app.config.from_object(Settings)
 
@@ -30,6 +29,12 @@ def create_app():
     init_extensions(app)
     logger.info("Extensões inicializadas (CORS)")
 
+    init_http(app)
+    logger.info(f"Cliente HTTP inicializado (pool por host: {Settings.HTTP_POOL_MAXSIZE})")
+
+    init_media_cache(app)
+    logger.info(f"Diretório de cache criado/verificado: {Settings.MEDIA_CACHE_DIR}")
+
     # imports LAZY (aqui dentro)
     logger.info("Importando blueprints")
     from .routes.instagram import bp as instagram_bp
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -12,11 +13,97 @@ class Settings:
         raise RuntimeError("Env var API_BASE_URL não definida")
 
     CACHE_DURATION_SECONDS = int(os.getenv('CACHE_DURATION_SECONDS', '3600'))
+    # Stale-while-revalidate: depois de CACHE_DURATION_SECONDS (soft) o valor antigo ainda é
+    # servido enquanto uma thread atualiza; depois de CACHE_HARD_TTL_SECONDS o fetch é síncrono
+    CACHE_HARD_TTL_SECONDS = int(os.getenv('CACHE_HARD_TTL_SECONDS', str(CACHE_DURATION_SECONDS * 2)))
+    CACHE_REFRESH_WORKERS = int(os.getenv('CACHE_REFRESH_WORKERS', '2'))
+    # XFetch: fator beta da expiração antecipada probabilística (0 desliga; >1 antecipa mais)
+    CACHE_XFETCH_BETA = float(os.getenv('CACHE_XFETCH_BETA', '1.0'))
+    # Limite (bytes aproximados de payload) do cache em memória de perfil/posts
+    CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+    # Backend do cache de perfil/posts: memory (por worker), sqlite (workers do mesmo pod)
+    # ou redis (todos os pods; qualquer servidor que fale o protocolo Redis)
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+    CACHE_SQLITE_PATH = os.getenv('CACHE_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'ig-api-cache.sqlite3'))
+    CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://127.0.0.1:6379/0')
+    CACHE_KEY_PREFIX = os.getenv('CACHE_KEY_PREFIX', 'igapi:')
     PLACE_ID = os.getenv('GOOGLE_PLACE_ID', '')
     GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY', '')
 
+    # Processos e threads do gunicorn (iguais a -w/--threads em k8s/deployment.yaml)
+    GUNICORN_WORKERS = int(os.getenv('GUNICORN_WORKERS', '2'))
+    GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', '1'))
+    GUNICORN_TIMEOUT = int(os.getenv('GUNICORN_TIMEOUT', '30'))  # --timeout (padrão do gunicorn)
+
     MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', os.path.join(os.getcwd(), 'cache', 'instagram'))
     MEDIA_CACHE_TTL_SECONDS = int(os.getenv('MEDIA_CACHE_TTL_SECONDS', '3600'))
     MEDIA_CACHE_MAX_BYTES = int(os.getenv('MEDIA_CACHE_MAX_BYTES', str(25 * 1024 * 1024)))
+    # Orçamento total do diretório, downloads em andamento incluídos (o emptyDir do k8s tem
+    # sizeLimit de 100Mi); 0 desliga
+    MEDIA_CACHE_DISK_BUDGET_BYTES = int(os.getenv('MEDIA_CACHE_DISK_BUDGET_BYTES', str(90 * 1024 * 1024)))
+    # Downloads simultâneos no pod (um por thread de request); cada um reserva MEDIA_CACHE_MAX_BYTES
+    # do orçamento para o seu .tmp, e a evicção mantém o resto abaixo de orçamento - reserva
+    MEDIA_CACHE_DOWNLOAD_SLOTS = int(os.getenv('MEDIA_CACHE_DOWNLOAD_SLOTS', str(GUNICORN_WORKERS * GUNICORN_THREADS)))
+    MEDIA_CACHE_EVICTION_POLICY = os.getenv('MEDIA_CACHE_EVICTION_POLICY', 'tinylfu').lower()  # lru | tinylfu
+    MEDIA_CACHE_EVICTION_TARGET_RATIO = float(os.getenv('MEDIA_CACHE_EVICTION_TARGET_RATIO', '0.9'))
+    MEDIA_CACHE_EVICTION_INTERVAL_SECONDS = float(os.getenv('MEDIA_CACHE_EVICTION_INTERVAL_SECONDS', '60'))
+    # Espera máxima pela trava de download de outro worker/thread da mesma mídia; bem abaixo do
+    # --timeout do gunicorn, senão o arbiter mata o worker antes de ele desistir da espera
+    MEDIA_DOWNLOAD_LOCK_TIMEOUT_SECONDS = float(os.getenv('MEDIA_DOWNLOAD_LOCK_TIMEOUT_SECONDS',
+                                                          str(GUNICORN_TIMEOUT / 3)))
+    # Miss no media_proxy repassa os bytes do CDN ao cliente enquanto grava (TTFB sem esperar o download)
+    MEDIA_TEE_ENABLED = os.getenv('MEDIA_TEE_ENABLED', '1') == '1'
+    # Seek em vídeo grande (Range fora do byte 0) baixa só os trechos pedidos, alinhados em CHUNK_BYTES
+    MEDIA_SPARSE_ENABLED = os.getenv('MEDIA_SPARSE_ENABLED', '1') == '1'
+    MEDIA_SPARSE_CHUNK_BYTES = int(os.getenv('MEDIA_SPARSE_CHUNK_BYTES', str(1024 * 1024)))
+    MEDIA_SPARSE_MIN_BYTES = int(os.getenv('MEDIA_SPARSE_MIN_BYTES', str(4 * 1024 * 1024)))
+    # Derivados responsivos (media_proxy?w=): imagens reduzidas em AVIF/WebP (JPEG sem suporte), precisa de Pillow
+    MEDIA_DERIVATIVES_ENABLED = os.getenv('MEDIA_DERIVATIVES_ENABLED', '1') == '1'
+    MEDIA_DERIVATIVE_WIDTHS = os.getenv('MEDIA_DERIVATIVE_WIDTHS', '320,640,1080')
+    MEDIA_DERIVATIVE_FORMATS = os.getenv('MEDIA_DERIVATIVE_FORMATS', 'avif,webp')  # ordem de preferência
+    MEDIA_DERIVATIVE_QUALITY = int(os.getenv('MEDIA_DERIVATIVE_QUALITY', '70'))
+    MEDIA_DERIVATIVE_WORKERS = int(os.getenv('MEDIA_DERIVATIVE_WORKERS', '1'))  # processos por worker gunicorn
+    MEDIA_DERIVATIVE_TIMEOUT_SECONDS = float(os.getenv('MEDIA_DERIVATIVE_TIMEOUT_SECONDS', '15'))
+    # Placeholder (LQIP em data URI + cor dominante) calculado ao cachear cada imagem, enviado inline no /posts
+    MEDIA_PLACEHOLDERS_ENABLED = os.getenv('MEDIA_PLACEHOLDERS_ENABLED', '1') == '1'
+    MEDIA_PLACEHOLDER_WIDTH = int(os.getenv('MEDIA_PLACEHOLDER_WIDTH', '16'))
+    # Camada quente em memória (por worker) para objetos pequenos, como as thumbnails do grid; 0 desliga
+    MEDIA_HOT_MAX_BYTES = int(os.getenv('MEDIA_HOT_MAX_BYTES', str(16 * 1024 * 1024)))
+    MEDIA_HOT_MAX_OBJECT_BYTES = int(os.getenv('MEDIA_HOT_MAX_OBJECT_BYTES', str(200 * 1024)))
     WARMUP_TOKEN = os.getenv('WARMUP_TOKEN', '')
     WARMUP_SLEEP_SECONDS = float(os.getenv('WARMUP_SLEEP_SECONDS', '0.25'))
+    # Validade das URLs de mídia (media_url/thumbnail_url) guardadas a partir de /posts
+    MEDIA_URL_INDEX_TTL_SECONDS = int(os.getenv('MEDIA_URL_INDEX_TTL_SECONDS', '3600'))
+
+    # Cliente HTTP compartilhado (pool keep-alive por host + retry com backoff)
+    # Workers gunicorn sync atendem 1 request por vez; o pool por host acompanha as threads
+    HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', '8'))
+    HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', str(max(4, GUNICORN_THREADS * 2))))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05'))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+    HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '2'))
+    HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', '0.3'))
+    HTTP_BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', '10'))
+    HTTP_WARM_CONNECTIONS = os.getenv('HTTP_WARM_CONNECTIONS', '1') == '1'
+    # Hosts extras aquecidos no boot; os hosts de CDN (scontent-<pop>.cdninstagram.com)
+    # são aquecidos sob demanda, a partir das URLs de mídia que o Graph devolve
+    HTTP_WARM_HOSTS = os.getenv('HTTP_WARM_HOSTS', '')
+
+    # Throttle adaptativo do Graph (headers X-App-Usage / X-Business-Use-Case-Usage)
+    GRAPH_USAGE_SLOWDOWN_PCT = float(os.getenv('GRAPH_USAGE_SLOWDOWN_PCT', '75'))
+    GRAPH_USAGE_PAUSE_PCT = float(os.getenv('GRAPH_USAGE_PAUSE_PCT', '95'))
+    GRAPH_MAX_THROTTLE_DELAY_SECONDS = float(os.getenv('GRAPH_MAX_THROTTLE_DELAY_SECONDS', '2'))
+    GRAPH_RATE_LIMIT_PAUSE_SECONDS = float(os.getenv('GRAPH_RATE_LIMIT_PAUSE_SECONDS', '300'))
+    GRAPH_MAX_WAIT_SECONDS = float(os.getenv('GRAPH_MAX_WAIT_SECONDS', '5'))
+
+    # Circuit breaker por upstream (graph / cdn) + servir cache expirado em falhas
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+    CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', '30'))
+    CACHE_STALE_IF_ERROR_SECONDS = int(os.getenv('CACHE_STALE_IF_ERROR_SECONDS', '86400'))
+
+    # Cache negativo de mídias/ids com falha (TTL por classe de erro; 0 desliga a classe)
+    NEGATIVE_TTL_NOT_FOUND = int(os.getenv('NEGATIVE_TTL_NOT_FOUND', '600'))
+    NEGATIVE_TTL_PERMISSION = int(os.getenv('NEGATIVE_TTL_PERMISSION', '300'))
+    NEGATIVE_TTL_OVERSIZE = int(os.getenv('NEGATIVE_TTL_OVERSIZE', '3600'))
+    NEGATIVE_TTL_TIMEOUT = int(os.getenv('NEGATIVE_TTL_TIMEOUT', '30'))
+    NEGATIVE_CACHE_MAX_ENTRIES = int(os.getenv('NEGATIVE_CACHE_MAX_ENTRIES', '10000'))
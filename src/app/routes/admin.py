@@ -1,7 +1,11 @@
 # src/app/routes/admin.py
 from flask import Blueprint, jsonify, request, current_app
-from ..services.cache import clear_memory_cache
-from ..services.media_cache import clear_media_cache_all, drop_media_cache
+from ..services.cache import clear_memory_cache, cache_stats
+from ..services.media_cache import clear_media_cache_all, drop_media_cache, media_cache_stats
+from ..services.instagram import singleflight_stats
+from ..services.http import circuit_stats
+from ..services.ratelimit import graph_governor
+from ..services.negative_cache import negative_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,19 +13,11 @@ logger = logging.getLogger(__name__)
 bp = Blueprint("admin", __name__)
 
 
-@bp.post("/api/admin/clear_cache")
-def clear_cache_route():
-    """
-    Endpoint para limpar cache
-    Parâmetros:
-    - token: Token de autorização
-    - what: 'all', 'memory', ou 'media'
-    """
+def _check_auth():
+    """Retorna uma resposta de erro se o chamador não estiver autorizado, senão None."""
     token = request.headers.get("X-Warmup-Token") or request.args.get("token", "")
     cfg = current_app.config
 
-    logger.info(f"clear_cache_route chamado")
-
     # Validar token
     if cfg.get("WARMUP_TOKEN"):
         if token != cfg["WARMUP_TOKEN"]:
@@ -33,6 +29,22 @@ def clear_cache_route():
         if not (remote.startswith('127.') or remote == '::1'):
             logger.warning(f"Acesso negado de {remote}")
             return jsonify({"error": "forbidden"}), 403
+    return None
+
+
+@bp.post("/api/admin/clear_cache")
+def clear_cache_route():
+    """
+    Endpoint para limpar cache
+    Parâmetros:
+    - token: Token de autorização
+    - what: 'all', 'memory', ou 'media'
+    """
+    logger.info(f"clear_cache_route chamado")
+
+    denied = _check_auth()
+    if denied:
+        return denied
 
     what = (request.args.get("what") or (request.json.get("what") if request.is_json else "all")).lower()
     media_id = (request.args.get("media_id") or (request.json.get("media_id") if request.is_json else "")).strip()
@@ -62,4 +74,25 @@ def clear_cache_route():
         logger.error(f"Parâmetro 'what' inválido: {what}")
         return jsonify({"error": "invalid 'what' (use all|memory|media|media_id)"}), 400
 
-    return jsonify({"code": 200, "payload": result})
\ No newline at end of file
+    return jsonify({"code": 200, "payload": result})
+
+
+@bp.get("/api/admin/stats")
+def stats_route():
+    """
+    Contadores do processo atual (cada worker gunicorn tem os seus):
+    cache em memória, single-flight do Graph, circuit breakers, throttle do Graph
+    e cache negativo.
+    """
+    denied = _check_auth()
+    if denied:
+        return denied
+
+    return jsonify({"code": 200, "payload": {
+        "memory_cache": cache_stats(),
+        "media_cache": media_cache_stats(),
+        "singleflight": singleflight_stats(),
+        "circuits": circuit_stats(),
+        "graph_rate": graph_governor.stats(),
+        "negative_cache": negative_cache.stats(),
+    }})
@@ -1,7 +1,13 @@
 from flask import Blueprint, jsonify, request, current_app, Response
-from ..services.instagram import fetch_user_profile, ig_get
-from ..services.cache import get_from_cache, set_in_cache, clear_memory_cache
-from ..services.media_cache import ensure_media_cached, serve_file_with_range, clear_media_cache_all, drop_media_cache
+from ..services.instagram import fetch_user_profile, ig_get, get_media_info, remember_media_urls
+from ..services.cache import get_or_revalidate, clear_memory_cache, get_stale_from_cache
+from ..services.circuit import CircuitOpenError
+from ..services.ratelimit import GraphRateLimited
+from ..services.compression import encode_json_variants, negotiated_json_response
+from ..services.media_cache import (media_response, derivative_response, clear_media_cache_all,
+                                    drop_media_cache, media_failure, media_placeholders)
+from ..services import media_derivatives
+from ..services.negative_cache import KnownFailure, NOT_FOUND, TIMEOUT
 from ..services.warmup import warmup
 import logging
 import re
@@ -44,7 +50,9 @@ def extract_images_from_media(media_items):
         media_items: Array de media items com {type, url, cover, id}
 
     Returns:
-        Array de imagens: [{url, fallbackUrl, mediaId, width, height}, ...]
+        Array de imagens: [{url, fallbackUrl, srcset, placeholder, dominantColor, mediaId, width, height}, ...]
+        (srcset: derivados reduzidos do media_proxy, um por MEDIA_DERIVATIVE_WIDTHS;
+         placeholder/dominantColor: LQIP em data URI e cor, None enquanto a mídia não foi cacheada)
 
     Example:
         media_items = [
@@ -59,6 +67,7 @@ def extract_images_from_media(media_items):
         # Result: [{
         #   "url": "https://scontent-lax3-1.cdninstagram.com/...",
         #   "fallbackUrl": "https://api.../media_proxy?id=17886774234352278&thumb=1",
+        #   "srcset": "https://api.../media_proxy?id=17886774234352278&thumb=1&w=320 320w, ...",
         #   "mediaId": "17886774234352278",
         #   "width": 1080,
         #   "height": 1920
@@ -66,11 +75,19 @@ def extract_images_from_media(media_items):
     """
     images = []
     api_base = current_app.config['API_BASE_URL'].rstrip('/')
+    widths = [w.strip() for w in current_app.config['MEDIA_DERIVATIVE_WIDTHS'].split(",") if w.strip().isdigit()]
+
+    def make_srcset(media_id):
+        """Derivados reduzidos do media_proxy (?w=), um por largura configurada."""
+        if not media_derivatives.enabled():
+            return None  # sem Pillow o ?w= serve o original: um srcset só multiplicaria o mesmo arquivo
+        return ", ".join(f"{api_base}/api/instagram/media_proxy?id={media_id}&thumb=1&w={w} {w}w" for w in widths) or None
 
     for media in media_items:
         try:
             media_type = media.get("type", "").lower()
             media_id = media.get("id", "")  # ✅ Pegar ID para fallback
+            cover_thumb = (media.get("cover") or {}).get("thumbnail") or {}
 
             if not media_id:
                 logger.warning("Media item sem ID")
@@ -97,6 +114,9 @@ def extract_images_from_media(media_items):
                     images.append({
                         "url": primary_url,
                         "fallbackUrl": fallback_url,
+                        "srcset": make_srcset(media_id),
+                        "placeholder": cover_thumb.get("placeholder"),
+                        "dominantColor": cover_thumb.get("dominantColor"),
                         "mediaId": media_id,
                         "width": 1080,
                         "height": 1920
@@ -112,6 +132,9 @@ def extract_images_from_media(media_items):
                     images.append({
                         "url": thumb.get("url"),
                         "fallbackUrl": fallback_url,
+                        "srcset": make_srcset(media_id),
+                        "placeholder": thumb.get("placeholder"),
+                        "dominantColor": thumb.get("dominantColor"),
                         "mediaId": media_id,
                         "width": thumb.get("width", 1080),
                         "height": thumb.get("height", 1920)
@@ -143,6 +166,15 @@ def user_profile():
         return jsonify({"error": str(e)}), 500
 
 
+def _known_failure_response(error_class: str):
+    """Resposta para mídia no cache negativo: sem tocar no Graph nem no CDN."""
+    status = {NOT_FOUND: 404, TIMEOUT: 504}.get(error_class, 502)
+    resp = Response(f'Media unavailable ({error_class})', status=status)
+    # deixa o browser/CDN segurar a falha um pouco, em vez de repetir em loop
+    resp.headers["Cache-Control"] = "public, max-age=60"
+    return resp
+
+
 @bp.get("/media_proxy")
 def media_proxy():
     """
@@ -171,32 +203,32 @@ def media_proxy():
 
     variant = 'thumb' if prefer_thumb else 'media'
 
+    # Largura pedida (srcset): serve derivado reduzido em AVIF/WebP conforme o Accept
+    width_param = clean_param(request.args.get('w'), 'w')
+    width = int(width_param) if width_param and width_param.isdigit() else 0
+
     try:
         # Se não é refresh, tenta usar cache
         if not refresh:
-            file_path, ct = ensure_media_cached(media_id, variant=variant)
-
-            # ✅ IMPORTANTE: Validar que arquivo existe e tem tamanho > 0
-            if file_path and os.path.exists(file_path):
-                file_size = os.path.getsize(file_path)
-                logger.info(f"Servindo do cache: {file_path} ({file_size} bytes)")
-
-                # ✅ NÃO servir arquivos muito pequenos (provavelmente são .meta)
-                if file_size > 100:  # Arquivos úteis têm pelo menos 100 bytes
-                    return serve_file_with_range(file_path, ct)
-                else:
-                    logger.warning(f"Arquivo muito pequeno, provavelmente .meta: {file_path} ({file_size} bytes)")
-                    # Remover arquivo inválido e tentar novamente
-                    try:
-                        os.remove(file_path)
-                    except:
-                        pass
-            else:
-                logger.info(f"Cache não disponível ou expirado para {media_id}")
+            if width:
+                resp = derivative_response(media_id, variant, width)
+                if resp is not None:
+                    return resp
+
+            # cache (streaming + Range) ou, num miss, tee direto do CDN
+            resp = media_response(media_id, variant=variant)
+            if resp is not None:
+                return resp
+            logger.info(f"Cache não disponível ou expirado para {media_id}")
+
+            failure = media_failure(media_id, variant)
+            if failure:
+                logger.info(f"media_proxy: {media_id} no cache negativo ({failure['error_class']})")
+                return _known_failure_response(failure["error_class"])
 
         # Busca informações do Instagram
         logger.info(f"Buscando informações do Instagram para {media_id}")
-        info = ig_get(media_id, fields="media_type,media_url,thumbnail_url")
+        info = get_media_info(media_id)
         logger.info(f"Info recebida: {info}")
 
         # Decide qual URL usar
@@ -212,40 +244,37 @@ def media_proxy():
         logger.info(f"URL selecionada: {src[:80]}...")
 
         # Faz cache e serve
-        file_path, ct = ensure_media_cached(media_id, variant=variant, explicit_src=src)
-
-        if file_path and os.path.exists(file_path):
-            file_size = os.path.getsize(file_path)
-            logger.info(f"Mídia cacheada e sendo servida: {file_path} ({file_size} bytes)")
-
-            # ✅ Verificar que arquivo é válido (não é .meta)
-            if file_size > 100:
-                return serve_file_with_range(file_path, ct)
-            else:
-                logger.error(f"Arquivo cacheado muito pequeno: {file_path} ({file_size} bytes)")
-                # Limpar arquivo inválido
-                try:
-                    drop_media_cache(media_id)
-                except:
-                    pass
-                return Response('Unable to cache media properly', status=502)
-        else:
-            logger.error(f"Falha ao cachear mídia: {media_id}")
-            return Response('Unable to cache media', status=502)
-
+        resp = media_response(media_id, variant=variant, explicit_src=src)
+        if resp is not None:
+            return resp
+
+        logger.error(f"Falha ao cachear mídia: {media_id}")
+        failure = media_failure(media_id, variant)
+        if failure:
+            return _known_failure_response(failure["error_class"])
+        return Response('Unable to cache media', status=502)
+
+    except KnownFailure as e:
+        logger.info(f"media_proxy: {e}")
+        return _known_failure_response(e.error_class)
+    except (CircuitOpenError, GraphRateLimited) as e:
+        # falha transitória do upstream: sem cache negativo, o cliente tenta de novo depois
+        logger.warning(f"media_proxy: {e}")
+        resp = Response('Upstream unavailable', status=503)
+        resp.headers["Retry-After"] = str(int(e.retry_in) + 1)
+        return resp
     except Exception as e:
         logger.error(f"Erro no media_proxy: {e}", exc_info=True)
         return Response(f'Error: {e}', status=500)
 
 
-@bp.get("/posts")
-def posts():
-    username = request.args.get('username', 'me')
-    ttl = current_app.config['CACHE_DURATION_SECONDS']
+def _build_posts_payload():
+    """
+    Busca perfil + posts no Graph e monta o payload de /posts no formato do widget.
+    Roda tanto no request quanto na atualização em background do cache.
+    """
     api_base = current_app.config['API_BASE_URL'].rstrip('/')
 
-    logger.info(f"posts chamado: username={username}")
-
     def build_proxy_url(path: str) -> str:
         """
         Garante que sempre geramos URLs absolutas para o widget.
@@ -266,130 +295,157 @@ def posts():
         logger.debug(f"URL construída: {url}")
         return url
 
-    cache_key = f"posts_{username}"
-    cached = get_from_cache(cache_key, ttl)
-    if cached:
-        logger.info(f"Retornando posts do cache: {cache_key}")
-        return jsonify(cached)
-
     if not current_app.config['ACCESS_TOKEN']:
         logger.error("Access Token não configurado")
-        return jsonify({"error": "Access Token não configurado no backend"}), 500
-
-    try:
-        logger.info(f"Buscando perfil do usuário")
-        user_info = fetch_user_profile()
-
-        logger.info(f"Buscando posts do usuário {current_app.config['USER_ID']}")
-        fields = "id,caption,media_type,permalink,timestamp,username,children{id,media_type},comments_count,like_count"
-        api_data = ig_get(f"{current_app.config['USER_ID']}/media", fields)
-
-        logger.info(f"Posts recebidos: {len(api_data.get('data', []))}")
-
-        width, height = 1080.0, 1920.0
-
-        def make_cover(mid: str):
-            """Cria URL de thumbnail para a capa"""
-            # Certificar que mid não tem caracteres inválidos
-            mid_clean = clean_param(mid, 'media_id_cover')
-            if not mid_clean:
-                logger.warning(f"Media ID inválido para cover: {mid}")
-                return {
-                    "thumbnail": {
-                        "url": "",
-                        "width": width, "height": height
-                    },
-                    "standard": None, "original": None
-                }
-
-            thumb_path = f"/api/instagram/media_proxy?id={mid_clean}&thumb=1"
+        raise RuntimeError("Access Token não configurado no backend")
+
+    logger.info(f"Buscando perfil do usuário")
+    user_info = fetch_user_profile()
+
+    logger.info(f"Buscando posts do usuário {current_app.config['USER_ID']}")
+    fields = ("id,caption,media_type,media_url,thumbnail_url,permalink,timestamp,username,"
+              "children{id,media_type,media_url,thumbnail_url},comments_count,like_count")
+    api_data = ig_get(f"{current_app.config['USER_ID']}/media", fields)
+
+    logger.info(f"Posts recebidos: {len(api_data.get('data', []))}")
+    # media_proxy/ensure_media_cached leem as URLs daqui em vez de um ig_get por mídia
+    remember_media_urls(api_data.get("data", []))
+
+    # placeholders (LQIP + cor) das mídias já em cache: primeiro paint sem nenhum request de mídia
+    post_ids = []
+    for post in api_data.get("data", []):
+        post_ids.append(post.get("id"))
+        post_ids.extend(child.get("id") for child in (post.get("children") or {}).get("data", []))
+    placeholders = media_placeholders([mid for mid in post_ids if mid])
+
+    width, height = 1080.0, 1920.0
+
+    def make_cover(mid: str):
+        """Cria URL de thumbnail para a capa"""
+        # Certificar que mid não tem caracteres inválidos
+        mid_clean = clean_param(mid, 'media_id_cover')
+        if not mid_clean:
+            logger.warning(f"Media ID inválido para cover: {mid}")
             return {
                 "thumbnail": {
-                    "url": build_proxy_url(thumb_path),
-                    "width": width, "height": height
+                    "url": "",
+                    "width": width, "height": height,
+                    "placeholder": None, "dominantColor": None
                 },
                 "standard": None, "original": None
             }
 
-        formatted = []
-        for post in api_data.get("data", []):
-            ptype = (post.get("media_type") or "").upper()
-            media_items = []
+        thumb_path = f"/api/instagram/media_proxy?id={mid_clean}&thumb=1"
+        return {
+            "thumbnail": {
+                "url": build_proxy_url(thumb_path),
+                "width": width, "height": height,
+                "placeholder": None, "dominantColor": None,
+                **placeholders.get(mid_clean, {})
+            },
+            "standard": None, "original": None
+        }
+
+    formatted = []
+    for post in api_data.get("data", []):
+        ptype = (post.get("media_type") or "").upper()
+        media_items = []
+
+        if ptype in ("IMAGE", "VIDEO"):
+            mid = post.get("id")
+            # Limpar media ID
+            mid_clean = clean_param(mid, 'post_media_id')
+            if not mid_clean:
+                logger.warning(f"Pulando post com media_id inválido: {mid}")
+                continue
+
+            media_items.append({
+                "type": ptype.lower(),
+                "url": build_proxy_url(f"/api/instagram/media_proxy?id={mid_clean}"),
+                "cover": make_cover(mid_clean),
+                "id": mid_clean
+            })
+        elif ptype == "CAROUSEL_ALBUM":
+            for child in (post.get("children") or {}).get("data", []):
+                ctype = (child.get("media_type") or "").upper()
+                mid = child.get("id")
 
-            if ptype in ("IMAGE", "VIDEO"):
-                mid = post.get("id")
                 # Limpar media ID
-                mid_clean = clean_param(mid, 'post_media_id')
+                mid_clean = clean_param(mid, 'carousel_media_id')
                 if not mid_clean:
-                    logger.warning(f"Pulando post com media_id inválido: {mid}")
+                    logger.warning(f"Pulando item carousel com media_id inválido: {mid}")
                     continue
 
                 media_items.append({
-                    "type": ptype.lower(),
+                    "type": ctype.lower(),
                     "url": build_proxy_url(f"/api/instagram/media_proxy?id={mid_clean}"),
                     "cover": make_cover(mid_clean),
                     "id": mid_clean
                 })
-            elif ptype == "CAROUSEL_ALBUM":
-                for child in (post.get("children") or {}).get("data", []):
-                    ctype = (child.get("media_type") or "").upper()
-                    mid = child.get("id")
-
-                    # Limpar media ID
-                    mid_clean = clean_param(mid, 'carousel_media_id')
-                    if not mid_clean:
-                        logger.warning(f"Pulando item carousel com media_id inválido: {mid}")
-                        continue
-
-                    media_items.append({
-                        "type": ctype.lower(),
-                        "url": build_proxy_url(f"/api/instagram/media_proxy?id={mid_clean}"),
-                        "cover": make_cover(mid_clean),
-                        "id": mid_clean
-                    })
 
-            if not media_items:
-                logger.warning(f"Post {post.get('id')} sem media items válidos")
-                continue
+        if not media_items:
+            logger.warning(f"Post {post.get('id')} sem media items válidos")
+            continue
 
-            author = {
-                "username": user_info.get("username"),
-                "url": None,
-                "profilePictureUrl": user_info.get("profilePictureUrl"),
-                "isVerifiedProfile": user_info.get("isVerified"),
-                "name": user_info.get("fullName"),
-                "biography": user_info.get("biography"),
-                "postsCount": user_info.get("postsCount"),
-                "followersCount": user_info.get("followersCount"),
-                "followingCount": user_info.get("followingCount")
-            }
+        author = {
+            "username": user_info.get("username"),
+            "url": None,
+            "profilePictureUrl": user_info.get("profilePictureUrl"),
+            "isVerifiedProfile": user_info.get("isVerified"),
+            "name": user_info.get("fullName"),
+            "biography": user_info.get("biography"),
+            "postsCount": user_info.get("postsCount"),
+            "followersCount": user_info.get("followersCount"),
+            "followingCount": user_info.get("followingCount")
+        }
+
+        # ✅ NOVO: Extrair images do media para compatibilidade com widget
+        # ✅ NOVO: Com fallbackUrl e mediaId para recuperação de erros
+        images = extract_images_from_media(media_items)
+        logger.info(f"Post {post.get('id')}: extraídas {len(images)} imagens de {len(media_items)} media items")
 
-            # ✅ NOVO: Extrair images do media para compatibilidade com widget
-            # ✅ NOVO: Com fallbackUrl e mediaId para recuperação de erros
-            images = extract_images_from_media(media_items)
-            logger.info(f"Post {post.get('id')}: extraídas {len(images)} imagens de {len(media_items)} media items")
-
-            formatted.append({
-                "vendorId": post.get("id"),
-                "type": (post.get("media_type") or "").lower().replace("_album", ""),
-                "link": post.get("permalink"),
-                "publishedAt": post.get("timestamp"),
-                "author": author,
-                "media": media_items,
-                "images": images,
-                "comments": [],
-                "caption": post.get("caption"),
-                "commentsCount": post.get("comments_count", 0),
-                "likesCount": post.get("like_count", 0),
-                "extra": {"platform": "instagram"},
-                "isPinned": None
-            })
+        formatted.append({
+            "vendorId": post.get("id"),
+            "type": (post.get("media_type") or "").lower().replace("_album", ""),
+            "link": post.get("permalink"),
+            "publishedAt": post.get("timestamp"),
+            "author": author,
+            "media": media_items,
+            "images": images,
+            "comments": [],
+            "caption": post.get("caption"),
+            "commentsCount": post.get("comments_count", 0),
+            "likesCount": post.get("like_count", 0),
+            "extra": {"platform": "instagram"},
+            "isPinned": None
+        })
+
+    logger.info(f"Posts formatados: {len(formatted)} posts com images")
+    return {"code": 200, "payload": formatted}
 
-        final_resp = {"code": 200, "payload": formatted}
-        set_in_cache(cache_key, final_resp)
-        logger.info(f"Posts formatados e cacheados: {len(formatted)} posts com images")
-        return jsonify(final_resp)
+
+def _build_posts_variants():
+    # o cache guarda os bytes finais (json + gzip/br + ETag), não o dict
+    return encode_json_variants(_build_posts_payload())
+
+
+@bp.get("/posts")
+def posts():
+    username = request.args.get('username', 'me')
+    cfg = current_app.config
+
+    logger.info(f"posts chamado: username={username}")
+
+    cache_key = f"posts_json_{username}"  # valor = variantes codificadas (ver encode_json_variants)
+    try:
+        variants = get_or_revalidate(cache_key, cfg['CACHE_DURATION_SECONDS'],
+                                     cfg['CACHE_HARD_TTL_SECONDS'], _build_posts_variants)
+        return negotiated_json_response(variants)
     except Exception as e:
+        stale = get_stale_from_cache(cache_key, cfg['CACHE_STALE_IF_ERROR_SECONDS'])
+        if stale:
+            logger.warning(f"Erro ao buscar posts ({e}), servindo cache expirado: {cache_key}")
+            return negotiated_json_response(stale)
         logger.error(f"Erro ao buscar posts: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
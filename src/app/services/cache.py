@@ -1,19 +1,141 @@
+import math
 import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from .cache_backends import create_cache_backend
 
-_api_cache = {}  # key -> {"data":..., "ts":...}
+logger = logging.getLogger(__name__)
 
-def get_from_cache(key, ttl_seconds):
-    item = _api_cache.get(key)
-    if not item:
+
+_store = None
+_store_lock = threading.Lock()
+
+# Atualizações em background do stale-while-revalidate (uma por chave)
+_refresh_executor = None
+_refreshing: set[str] = set()
+_refresh_lock = threading.Lock()
+
+
+def _get_store():
+    """Backend configurado em CACHE_BACKEND (memory | sqlite | redis), criado no primeiro uso."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_cache_backend(current_app.config)
+    return _store
+
+
+def _xfetch_due(item, ttl_seconds, beta) -> bool:
+    """
+    Expiração antecipada probabilística (XFetch): quanto mais perto do fim do
+    TTL e mais caro o recálculo (delta), maior a chance de recalcular agora.
+    Espalha as atualizações entre workers/pods em vez de todos expirarem juntos.
+    """
+    delta = item.get("delta") or 0.0
+    if beta <= 0 or delta <= 0:
+        return False
+    expiry = item["ts"] + ttl_seconds
+    return time.time() - delta * beta * math.log(1.0 - random.random()) >= expiry
+
+
+def get_from_cache(key, ttl_seconds, beta=None):
+    store = _get_store()
+    item = store.get(key)
+    if not item or (time.time() - item["ts"]) > ttl_seconds:
+        # expirado, mas mantido até o fim da retenção para get_stale_from_cache (stale-if-error)
+        store.record(hit=False)
         return None
-    if (time.time() - item["ts"]) > ttl_seconds:
-        _api_cache.pop(key, None)
+    beta = current_app.config['CACHE_XFETCH_BETA'] if beta is None else beta
+    if _xfetch_due(item, ttl_seconds, beta):
+        logger.info(f"XFetch: recálculo antecipado de {key}")
+        store.record(hit=False)
         return None
+    store.record(hit=True)
     return item["data"]
 
-def set_in_cache(key, data):
-    _api_cache[key] = {"data": data, "ts": time.time()}
+def get_stale_from_cache(key, max_age_seconds):
+    """Retorna o valor mesmo expirado, desde que mais novo que max_age_seconds."""
+    item = _get_store().get(key)
+    if not item or (time.time() - item["ts"]) > max_age_seconds:
+        return None
+    return item["data"]
+
+def set_in_cache(key, data, ttl_seconds=None, compute_seconds=0.0):
+    cfg = current_app.config
+    ttl = cfg['CACHE_DURATION_SECONDS'] if ttl_seconds is None else ttl_seconds
+    # retém além do TTL pelo período de stale-if-error; a varredura remove depois disso
+    _get_store().set(key, data, ttl + cfg['CACHE_STALE_IF_ERROR_SECONDS'], delta=compute_seconds)
 
 def clear_memory_cache():
-    _api_cache.clear()
-    return True
\ No newline at end of file
+    _get_store().clear()
+    return True
+
+def cache_stats():
+    return _get_store().stats()
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _refresh_executor
+    with _refresh_lock:
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(
+                max_workers=current_app.config['CACHE_REFRESH_WORKERS'],
+                thread_name_prefix="cache-refresh",
+            )
+        return _refresh_executor
+
+def _schedule_refresh(key, loader, ttl_seconds):
+    with _refresh_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    app = current_app._get_current_object()
+
+    def run():
+        try:
+            with app.app_context():
+                started = time.monotonic()
+                data = loader()
+                set_in_cache(key, data, ttl_seconds, compute_seconds=time.monotonic() - started)
+                logger.info(f"Cache atualizado em background: {key}")
+        except Exception as e:
+            logger.warning(f"Falha ao atualizar {key} em background: {e}")
+        finally:
+            with _refresh_lock:
+                _refreshing.discard(key)
+
+    try:
+        _get_executor().submit(run)
+    except RuntimeError:
+        with _refresh_lock:
+            _refreshing.discard(key)
+
+def get_or_revalidate(key, soft_ttl, hard_ttl, loader):
+    """
+    Stale-while-revalidate: até soft_ttl devolve o valor em cache; entre
+    soft_ttl e hard_ttl devolve o valor antigo na hora e agenda uma única
+    atualização em background; depois de hard_ttl (ou sem valor) chama
+    loader() de forma síncrona.
+    """
+    store = _get_store()
+    item = store.get(key)
+    if item:
+        age = time.time() - item["ts"]
+        if age <= soft_ttl:
+            store.record(hit=True)
+            # XFetch antecipa a atualização em background antes do soft TTL
+            if _xfetch_due(item, soft_ttl, current_app.config['CACHE_XFETCH_BETA']):
+                _schedule_refresh(key, loader, hard_ttl)
+            return item["data"]
+        if age <= hard_ttl:
+            store.record(hit=True)
+            _schedule_refresh(key, loader, hard_ttl)
+            return item["data"]
+    store.record(hit=False)
+    started = time.monotonic()
+    data = loader()
+    set_in_cache(key, data, hard_ttl, compute_seconds=time.monotonic() - started)
+    return data
@@ -0,0 +1,448 @@
+import os
+import time
+import zlib
+import socket
+import marshal
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Todos os backends expõem a mesma interface usada por services/cache.py:
+#   get(key) -> {"data", "ts", "delta"} | None
+#   set(key, data, retention_seconds, delta=0.0)   (delta = segundos gastos para calcular o valor)
+#   delete(key), clear(), record(hit), stats()
+
+
+def _approx_size(obj) -> int:
+    """Estimativa barata do tamanho do payload em bytes (não é sys.getsizeof)."""
+    if obj is None or isinstance(obj, bool):
+        return 8
+    if isinstance(obj, (int, float)):
+        return 16
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, str):
+        return len(obj) + 8
+    if isinstance(obj, dict):
+        return 64 + sum(_approx_size(k) + _approx_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return 56 + sum(_approx_size(v) for v in obj)
+    return 64
+
+
+# ---------- serialização compacta (backends compartilhados) ----------
+# marshal lida com dict/list/str/bytes/números sem executar código ao ler;
+# o header guarda a versão do formato para que workers de outra versão vejam miss.
+_FMT_RAW, _FMT_ZLIB = 0, 1
+_COMPRESS_MIN_BYTES = 1024
+
+
+def _dumps(entry: dict) -> bytes:
+    raw = marshal.dumps(entry)
+    if len(raw) >= _COMPRESS_MIN_BYTES:
+        return bytes([marshal.version, _FMT_ZLIB]) + zlib.compress(raw, 6)
+    return bytes([marshal.version, _FMT_RAW]) + raw
+
+
+def _loads(blob: bytes) -> dict | None:
+    if not blob or len(blob) < 2 or blob[0] != marshal.version:
+        return None
+    try:
+        body = zlib.decompress(blob[2:]) if blob[1] == _FMT_ZLIB else blob[2:]
+        entry = marshal.loads(body)
+    except Exception as e:
+        logger.warning(f"Entrada de cache ilegível, ignorada: {e}")
+        return None
+    return entry if isinstance(entry, dict) else None
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class MemoryCache:
+    """
+    Cache em processo com limite de memória (bytes aproximados do payload),
+    despejo LRU, TTL por entrada e varredura periódica dos expirados.
+    Seguro para workers com threads.
+    """
+
+    backend = "memory"
+
+    def __init__(self, max_bytes: int, sweep_interval: float = 30.0):
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._lock = threading.RLock()
+        self._entries: OrderedDict[str, dict] = OrderedDict()  # key -> {"data", "ts", "delta", "expires", "size"}
+        self._bytes = 0
+        self._last_sweep = time.time()
+        self._counters = _Counters()
+        self._evictions = 0
+        self._expirations = 0
+
+    def _remove(self, key: str):
+        item = self._entries.pop(key, None)
+        if item:
+            self._bytes -= item["size"]
+
+    def _sweep(self, now: float):
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        expired = [k for k, item in self._entries.items() if item["expires"] <= now]
+        for k in expired:
+            self._remove(k)
+        self._expirations += len(expired)
+
+    def get(self, key: str) -> dict | None:
+        """Retorna a entrada ({"data", "ts", ...}) ainda dentro do prazo de retenção."""
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item["expires"] <= now:
+                self._remove(key)
+                self._expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return item
+
+    def set(self, key: str, data, retention_seconds: float, delta: float = 0.0):
+        size = _approx_size(data) + len(key)
+        now = time.time()
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                logger.warning(f"Entrada de cache maior que o limite, ignorada: {key} ({size} bytes)")
+                return
+            self._entries[key] = {"data": data, "ts": now, "delta": delta,
+                                  "expires": now + retention_seconds, "size": size}
+            self._bytes += size
+            self._sweep(now)
+            while self._bytes > self.max_bytes and self._entries:
+                old_key, old_item = self._entries.popitem(last=False)
+                self._bytes -= old_item["size"]
+                self._evictions += 1
+                logger.info(f"Cache LRU: removido {old_key} (limite de {self.max_bytes} bytes)")
+
+    def delete(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def record(self, hit: bool):
+        self._counters.record(hit)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "backend": self.backend,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+        stats.update(self._counters.stats())
+        return stats
+
+
+class SqliteCache:
+    """
+    Cache em um arquivo SQLite compartilhado pelos workers do mesmo nó/pod
+    (ex.: emptyDir ou /dev/shm). WAL permite leituras concorrentes entre
+    processos; o limite de bytes é aplicado por LRU (coluna atime).
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, max_bytes: int, sweep_interval: float = 30.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        self._counters = _Counters()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, ts REAL NOT NULL,"
+            " expires REAL NOT NULL, atime REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_atime ON cache(atime)")
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache(expires)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _sweep(self, conn, now: float):
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        conn.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total > self.max_bytes:
+            # remove os menos usados até voltar ao limite
+            excess = total - self.max_bytes
+            rows = conn.execute("SELECT key, size FROM cache ORDER BY atime").fetchall()
+            victims = []
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                victims.append((key,))
+                excess -= size
+            conn.executemany("DELETE FROM cache WHERE key = ?", victims)
+            logger.info(f"Cache SQLite: {len(victims)} entradas removidas por limite de bytes")
+
+    def get(self, key: str) -> dict | None:
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE cache SET atime = ? WHERE key = ?", (now, key))
+            return _loads(row[0])
+        except sqlite3.Error as e:
+            logger.warning(f"Cache SQLite indisponível em get({key}): {e}")
+            return None
+
+    def set(self, key: str, data, retention_seconds: float, delta: float = 0.0):
+        now = time.time()
+        blob = _dumps({"data": data, "ts": now, "delta": delta})
+        if len(blob) > self.max_bytes:
+            logger.warning(f"Entrada de cache maior que o limite, ignorada: {key} ({len(blob)} bytes)")
+            return
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, ts, expires, atime, size) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, blob, now, now + retention_seconds, now, len(blob)),
+            )
+            self._sweep(conn, now)
+        except sqlite3.Error as e:
+            logger.warning(f"Cache SQLite indisponível em set({key}): {e}")
+
+    def delete(self, key: str):
+        try:
+            self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logger.warning(f"Cache SQLite indisponível em delete({key}): {e}")
+
+    def record(self, hit: bool):
+        self._counters.record(hit)
+
+    def clear(self):
+        try:
+            self._conn().execute("DELETE FROM cache")
+        except sqlite3.Error as e:
+            logger.warning(f"Cache SQLite indisponível em clear(): {e}")
+
+    def stats(self) -> dict:
+        stats = {"backend": self.backend, "path": self.path, "max_bytes": self.max_bytes}
+        try:
+            count, total = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+            stats.update({"entries": count, "bytes": total})
+        except sqlite3.Error as e:
+            stats["error"] = str(e)
+        stats.update(self._counters.stats())
+        return stats
+
+
+class _RespClient:
+    """Cliente mínimo do protocolo Redis (RESP2) sobre um socket, protegido por lock."""
+
+    def __init__(self, url: str, timeout: float = 1.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 6379
+        self.password = parts.password
+        self.db = int((parts.path or "/0").lstrip("/") or 0)
+        self.timeout = timeout
+        self._sock = None
+        self._buf = b""
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._buf = b""
+        if self.password:
+            self._call_locked("AUTH", self.password)
+        if self.db:
+            self._call_locked("SELECT", str(self.db))
+
+    def _readline(self) -> bytes:
+        while b"\r\n" not in self._buf:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("conexão fechada pelo servidor")
+            self._buf += chunk
+        line, self._buf = self._buf.split(b"\r\n", 1)
+        return line
+
+    def _readexact(self, n: int) -> bytes:
+        while len(self._buf) < n + 2:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("conexão fechada pelo servidor")
+            self._buf += chunk
+        data, self._buf = self._buf[:n], self._buf[n + 2:]
+        return data
+
+    def _read_reply(self):
+        line = self._readline()
+        kind, rest = line[:1], line[1:]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            return None if n < 0 else self._readexact(n)
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [self._read_reply() for _ in range(n)]
+        raise ConnectionError(f"resposta RESP inválida: {line[:20]!r}")
+
+    def _call_locked(self, *args):
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            a = a if isinstance(a, bytes) else str(a).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(a), a))
+        self._sock.sendall(b"".join(out))
+        return self._read_reply()
+
+    def call(self, *args):
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._call_locked(*args)
+                except (OSError, ConnectionError):
+                    self.close_locked()
+                    if attempt == 2:
+                        raise
+
+    def close_locked(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._buf = b""
+
+
+class RedisCache:
+    """
+    Backend em rede compatível com o protocolo Redis, compartilhado entre pods.
+    Expiração via PX do próprio servidor; limite de memória fica a cargo do
+    maxmemory-policy do servidor. Falhas de rede viram miss, nunca erro 500.
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str, prefix: str = "igapi:", timeout: float = 1.0):
+        self.url = url
+        self.prefix = prefix
+        self._client = _RespClient(url, timeout=timeout)
+        self._counters = _Counters()
+
+    def _k(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def get(self, key: str) -> dict | None:
+        try:
+            return _loads(self._client.call("GET", self._k(key)))
+        except Exception as e:
+            logger.warning(f"Cache Redis indisponível em get({key}): {e}")
+            return None
+
+    def set(self, key: str, data, retention_seconds: float, delta: float = 0.0):
+        blob = _dumps({"data": data, "ts": time.time(), "delta": delta})
+        try:
+            self._client.call("SET", self._k(key), blob, "PX", str(max(int(retention_seconds * 1000), 1)))
+        except Exception as e:
+            logger.warning(f"Cache Redis indisponível em set({key}): {e}")
+
+    def delete(self, key: str):
+        try:
+            self._client.call("DEL", self._k(key))
+        except Exception as e:
+            logger.warning(f"Cache Redis indisponível em delete({key}): {e}")
+
+    def record(self, hit: bool):
+        self._counters.record(hit)
+
+    def clear(self):
+        # remove só as chaves deste app (prefixo), nunca FLUSHDB
+        cursor = b"0"
+        try:
+            while True:
+                cursor, keys = self._client.call("SCAN", cursor, "MATCH", f"{self.prefix}*", "COUNT", "500")
+                if keys:
+                    self._client.call("DEL", *keys)
+                if cursor in (b"0", "0"):
+                    break
+        except Exception as e:
+            logger.warning(f"Cache Redis indisponível em clear(): {e}")
+
+    def stats(self) -> dict:
+        stats = {"backend": self.backend, "prefix": self.prefix}
+        stats.update(self._counters.stats())
+        return stats
+
+
+def create_cache_backend(cfg):
+    backend = (cfg['CACHE_BACKEND'] or 'memory').lower()
+    if backend == 'sqlite':
+        logger.info(f"Cache backend: SQLite em {cfg['CACHE_SQLITE_PATH']}")
+        return SqliteCache(cfg['CACHE_SQLITE_PATH'], cfg['CACHE_MAX_BYTES'])
+    if backend == 'redis':
+        logger.info(f"Cache backend: Redis ({urlsplit(cfg['CACHE_REDIS_URL']).hostname})")
+        return RedisCache(cfg['CACHE_REDIS_URL'], prefix=cfg['CACHE_KEY_PREFIX'])
+    if backend != 'memory':
+        logger.warning(f"CACHE_BACKEND desconhecido '{backend}', usando memória")
+    return MemoryCache(cfg['CACHE_MAX_BYTES'])
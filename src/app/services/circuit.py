@@ -0,0 +1,92 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Upstream com circuito aberto: a chamada falha na hora, sem rede."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"Circuito '{name}' aberto (nova tentativa em {retry_in:.0f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por upstream.
+    closed -> open depois de N falhas seguidas; open -> half_open depois de
+    reset_timeout, liberando uma única chamada de teste; o resultado dela
+    fecha o circuito ou o reabre. Chamada de teste sem resultado depois de
+    probe_timeout (worker morto no meio, exceção não registrada) é dada como
+    perdida e outra é liberada.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 probe_timeout: float | None = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = reset_timeout if probe_timeout is None else probe_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self._rejected = 0
+
+    def before_call(self):
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            now = time.time()
+            if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+                logger.info(f"Circuito '{self.name}' half-open, liberando chamada de teste")
+            if self._state == HALF_OPEN and self._probe_in_flight and now - self._probe_started >= self.probe_timeout:
+                logger.warning(f"Circuito '{self.name}': chamada de teste sem resultado, liberando outra")
+                self._probe_in_flight = False
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                self._probe_started = now
+                return
+            self._rejected += 1
+            retry_in = max(self.reset_timeout - (now - self._opened_at), 0.0)
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info(f"Circuito '{self.name}' fechado, upstream recuperado")
+            self._state = CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """A chamada terminou sem dizer nada sobre o upstream (erro local): libera o teste sem mudar o estado."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    logger.warning(f"Circuito '{self.name}' aberto após {self._failures} falhas")
+                self._state = OPEN
+                self._opened_at = time.time()
+                self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "rejected_calls": self._rejected,
+            }
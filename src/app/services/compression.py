@@ -0,0 +1,83 @@
+import gzip
+import hashlib
+import logging
+from flask import Response, request, current_app
+
+try:
+    import brotli  # opcional: sem o pacote, só gzip/identity são oferecidos
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+def encode_json_variants(payload) -> dict:
+    """
+    Serializa o payload uma única vez e guarda as variantes prontas para servir:
+    {"body": bytes, "gzip": bytes, "br": bytes | None, "etag": str}.
+    O ETag é forte, derivado do conteúdo (igual em todos os workers/pods); cada
+    Content-Encoding servido ganha um sufixo nele (ver _encoded_etag).
+    """
+    body = current_app.json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    variants = {
+        "body": body,
+        "gzip": gzip.compress(body, compresslevel=6, mtime=0),
+        "br": brotli.compress(body, quality=9) if brotli is not None else None,
+        "etag": f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+    }
+    logger.info(f"JSON codificado: {len(body)} bytes, gzip={len(variants['gzip'])}, "
+                f"br={len(variants['br']) if variants['br'] else '-'}")
+    return variants
+
+
+def _accepts(encoding: str) -> bool:
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip().lower() in (encoding, "*"):
+            try:
+                q = float(params.split("q=", 1)[1]) if "q=" in params else 1.0
+            except ValueError:
+                q = 1.0
+            return q > 0
+    return False
+
+
+def _encoded_etag(etag: str, encoding: str | None) -> str:
+    """Cada codificação é outra representação (RFC 9110 8.8.3): "<hash>" identity, "<hash>-gzip", "<hash>-br"."""
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+def _etag_matches(etag: str) -> bool:
+    """If-None-Match com o ETag de qualquer codificação do mesmo conteúdo (o corpo descomprimido é o mesmo)."""
+    header = request.headers.get("If-None-Match", "")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # ignora o prefixo W/ (comparação fraca é o que If-None-Match usa)
+    candidates = {c.strip().removeprefix("W/") for c in header.split(",")}
+    return any(_encoded_etag(etag, encoding) in candidates for encoding in (None, "gzip", "br"))
+
+
+def _negotiate(variants: dict) -> tuple[bytes, str | None]:
+    if variants.get("br") and _accepts("br"):
+        return variants["br"], "br"
+    if _accepts("gzip"):
+        return variants["gzip"], "gzip"
+    return variants["body"], None
+
+
+def negotiated_json_response(variants: dict, cache_control: str = "no-cache") -> Response:
+    """Resposta 200/304 a partir das variantes pré-codificadas, sem reserializar nem recomprimir."""
+    data, encoding = _negotiate(variants)
+    if _etag_matches(variants["etag"]):
+        resp = Response(status=304)
+    else:
+        resp = Response(data, status=200, mimetype="application/json")
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+        resp.headers["Content-Length"] = str(len(data))
+    resp.headers["ETag"] = _encoded_etag(variants["etag"], encoding)
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Cache-Control"] = cache_control
+    return resp
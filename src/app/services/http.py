@@ -1,8 +1,219 @@
+import logging
+import threading
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .circuit import CircuitBreaker
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_TIMEOUT = 10
 
-def get(url, *, params=None, timeout=DEFAULT_TIMEOUT, stream=False):
-    r = requests.get(url, params=params, timeout=timeout, stream=stream)
+# Valores padrão; sobrescritos por init_http(app) a partir da config
+_settings = {
+    "pool_connections": 8,
+    "pool_maxsize": 4,
+    "connect_timeout": 3.05,
+    "read_timeout": DEFAULT_TIMEOUT,
+    "retries": 2,
+    "backoff_factor": 0.3,
+    "backoff_max": 10.0,
+    "backoff_jitter": 0.5,
+    "circuit_failure_threshold": 5,
+    "circuit_reset_seconds": 30.0,
+    "graph_host": "graph.instagram.com",
+    "warm_connections": False,
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+# Origens já aquecidas neste processo (o warm-up de hosts de CDN roda sob demanda)
+_warmed_origins: set[str] = set()
+_warmed_lock = threading.Lock()
+
+# Um circuit breaker por upstream: "graph" (API) e "cdn" (mídia)
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+class _CappedRetry(Retry):
+    """
+    Retry-After limitado a backoff_max: o urllib3 dorme o valor inteiro do header
+    (minutos, num rate limit do Graph), bloqueando o worker além do timeout do gunicorn.
+    429 não é repetido aqui: volta na hora para o governor do Graph decidir a pausa.
+    """
+
+    RETRY_AFTER_STATUS_CODES = frozenset({503})
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, _settings["backoff_max"])
+
+
+def _build_session() -> requests.Session:
+    retry = _CappedRetry(
+        total=_settings["retries"],
+        connect=_settings["retries"],
+        read=_settings["retries"],
+        status=_settings["retries"],
+        backoff_factor=_settings["backoff_factor"],
+        backoff_max=_settings["backoff_max"],
+        backoff_jitter=_settings["backoff_jitter"],
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    # pool_connections = quantos hosts mantêm pool; pool_maxsize = conexões keep-alive por host
+    adapter = HTTPAdapter(
+        pool_connections=_settings["pool_connections"],
+        pool_maxsize=_settings["pool_maxsize"],
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def _resolve_timeout(timeout):
+    """
+    Aceita número (tempo de leitura), tupla (connect, read) ou None (padrão).
+    O connect timeout fica sempre separado do read timeout.
+    """
+    if timeout is None:
+        return _settings["connect_timeout"], _settings["read_timeout"]
+    if isinstance(timeout, (tuple, list)):
+        return tuple(timeout)
+    return min(_settings["connect_timeout"], timeout), timeout
+
+
+def upstream_for(url: str) -> str:
+    host = urlsplit(url).hostname or ""
+    return "graph" if host == _settings["graph_host"] else "cdn"
+
+
+def breaker_for(upstream: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(upstream)
+        if breaker is None:
+            breaker = _breakers[upstream] = CircuitBreaker(
+                upstream,
+                failure_threshold=_settings["circuit_failure_threshold"],
+                reset_timeout=_settings["circuit_reset_seconds"],
+            )
+        return breaker
+
+
+def circuit_stats() -> dict:
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: b.stats() for name, b in breakers.items()}
+
+
+def get(url, *, params=None, timeout=None, stream=False, headers=None):
+    breaker = breaker_for(upstream_for(url))
+    breaker.before_call()  # CircuitOpenError se o upstream estiver fora
+    try:
+        r = get_session().get(url, params=params, timeout=_resolve_timeout(timeout), stream=stream, headers=headers)
+    except requests.RequestException:
+        # conexão, timeout, corpo truncado/corrompido, redirect em loop: falha do upstream
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release_probe()  # erro local (ou o worker abortado no meio): não prende o half-open
+        raise
+    # 4xx é erro do pedido (id apagado, token, rate limit), não do upstream
+    if r.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
     r.raise_for_status()
     return r
+
+
+def warm_connections(urls):
+    """
+    Abre (e devolve ao pool) uma conexão TLS para cada host informado,
+    para que as primeiras chamadas reais não paguem o handshake.
+    """
+    warmed = []
+    for origin in _origins(urls):
+        try:
+            r = get_session().head(f"{origin}/", timeout=(_settings["connect_timeout"], 5), allow_redirects=False)
+            r.close()
+            warmed.append(origin)
+            with _warmed_lock:
+                _warmed_origins.add(origin)
+            logger.info(f"Conexão aquecida: {origin} (status {r.status_code})")
+        except Exception as e:
+            logger.warning(f"Falha ao aquecer conexão com {origin}: {e}")
+    return warmed
+
+
+def _origins(urls) -> list[str]:
+    origins = []
+    for url in urls:
+        parts = urlsplit(url if "://" in url else f"https://{url}")
+        origin = f"{parts.scheme}://{parts.netloc}"
+        if parts.netloc and origin not in origins:
+            origins.append(origin)
+    return origins
+
+
+def warm_new_hosts(urls):
+    """
+    Aquece em background as origens ainda não aquecidas. Usado com as URLs de mídia
+    vindas do Graph: o CDN muda de host por região (scontent-<pop>.cdninstagram.com).
+    """
+    if not _settings["warm_connections"]:
+        return
+    with _warmed_lock:
+        new = [o for o in _origins(urls) if o not in _warmed_origins]
+        # marca já: requests seguidos do /posts não disparam o mesmo aquecimento
+        _warmed_origins.update(new)
+    if new:
+        threading.Thread(target=warm_connections, args=(new,), daemon=True).start()
+
+
+def init_http(app):
+    global _session
+    cfg = app.config
+    _settings.update({
+        "pool_connections": cfg['HTTP_POOL_CONNECTIONS'],
+        "pool_maxsize": cfg['HTTP_POOL_MAXSIZE'],
+        "connect_timeout": cfg['HTTP_CONNECT_TIMEOUT'],
+        "read_timeout": cfg['HTTP_READ_TIMEOUT'],
+        "retries": cfg['HTTP_RETRIES'],
+        "backoff_factor": cfg['HTTP_BACKOFF_FACTOR'],
+        "backoff_max": cfg['HTTP_BACKOFF_MAX'],
+        "circuit_failure_threshold": cfg['CIRCUIT_FAILURE_THRESHOLD'],
+        "circuit_reset_seconds": cfg['CIRCUIT_RESET_SECONDS'],
+        "graph_host": urlsplit(cfg['GRAPH_API_URL']).hostname or _settings["graph_host"],
+        "warm_connections": cfg['HTTP_WARM_CONNECTIONS'],
+    })
+    with _breakers_lock:
+        _breakers.clear()
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = _build_session()
+
+    if cfg['HTTP_WARM_CONNECTIONS']:
+        hosts = [cfg['GRAPH_API_URL']] + [h.strip() for h in cfg['HTTP_WARM_HOSTS'].split(',') if h.strip()]
+        # em background para não atrasar o boot do worker
+        threading.Thread(target=warm_connections, args=(hosts,), daemon=True).start()
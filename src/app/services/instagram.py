@@ -1,28 +1,287 @@
+import time
+import logging
+import threading
+import requests
 from flask import current_app
-from .http import get
-from .cache import get_from_cache, set_in_cache
+from .http import get, warm_new_hosts
+from .cache import get_or_revalidate, get_stale_from_cache
+from .ratelimit import graph_governor
+from .negative_cache import negative_cache, classify_error, KnownFailure, NOT_FOUND
 
-def ig_get(path_or_id: str, fields: str, extra: dict | None = None):
+logger = logging.getLogger(__name__)
+
+MEDIA_INFO_FIELDS = "media_type,media_url,thumbnail_url"
+GRAPH_BATCH_MAX_IDS = 50          # limite do Graph para ?ids=
+_BATCH_RESULT_TTL_SECONDS = 120   # resultados não consumidos são descartados depois disso
+
+# Lookups enfileirados aguardando o próximo flush: fields -> ids
+_pending_lookups: dict[str, list[str]] = {}
+# Resultados de lotes já resolvidos: (fields, id) -> (ts, data | Exception)
+_batch_results: dict[tuple[str, str], tuple[float, object]] = {}
+_batch_lock = threading.Lock()
+
+# Índice id -> URLs de mídia, alimentado pelo field expansion de /posts e do warmup
+_media_url_index: dict[str, tuple[float, dict]] = {}
+_media_url_lock = threading.Lock()
+
+# Single-flight: chamadas idênticas em andamento compartilham um único fetch
+_inflight: dict[tuple, "_Flight"] = {}
+_inflight_lock = threading.Lock()
+_singleflight_counters = {"calls": 0, "fetches": 0, "collapsed": 0}
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _graph_url(path_or_id: str) -> str:
+    s = current_app.config
+    return f"{s['GRAPH_API_URL'].rstrip('/')}/{path_or_id.lstrip('/')}"
+
+
+def _graph_get(url: str, params: dict | None = None):
+    """GET no Graph passando pelo governor de rate limit (antes e depois da chamada)."""
+    graph_governor.before_call()
+    try:
+        r = get(url, params=params)
+    except requests.HTTPError as e:
+        graph_governor.observe(e.response)
+        raise
+    graph_governor.observe(r)
+    return r.json()
+
+
+def _single_flight(key: tuple, fn):
+    """
+    Executa fn uma única vez por key entre as threads do processo: quem
+    chega enquanto o fetch está em andamento espera e recebe o mesmo
+    resultado (ou a mesma exceção).
+    """
+    with _inflight_lock:
+        _singleflight_counters["calls"] += 1
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = _Flight()
+            _singleflight_counters["fetches"] += 1
+        else:
+            _singleflight_counters["collapsed"] += 1
+
+    if not leader:
+        logger.debug("Single-flight: aguardando fetch em andamento")
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = fn()
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        flight.done.set()
+
+
+def singleflight_stats() -> dict:
+    with _inflight_lock:
+        stats = dict(_singleflight_counters)
+        stats["in_flight"] = len(_inflight)
+    return stats
+
+
+def _ig_request(path_or_id: str, fields: str, extra: dict | None = None):
     s = current_app.config
-    url = f"{s['GRAPH_API_URL'].rstrip('/')}/{path_or_id.lstrip('/')}"
     params = {"fields": fields, "access_token": s['ACCESS_TOKEN']}
     if extra:
         params.update(extra)
-    return get(url, params=params).json()
+    key = (path_or_id, fields, tuple(sorted((extra or {}).items())))
+    return _single_flight(key, lambda: _graph_get(_graph_url(path_or_id), params=params))
 
-def ig_get_url(full_url: str):
-    return get(full_url).json()
 
-def fetch_user_profile():
-    s = current_app.config
-    cache_key = f"profile_{s['USER_ID']}"
-    cached = get_from_cache(cache_key, s['CACHE_DURATION_SECONDS'])
-    if cached:
-        return cached
+def _fetch_batch(ids: list[str], fields: str) -> dict:
+    """
+    Resolve ids com uma chamada multi-id (?ids=a,b,c).
+    Se o lote falhar por causa de um objeto (id apagado/inválido invalida o
+    lote inteiro), divide ao meio e tenta cada metade; um id isolado que falhar
+    recebe a exceção. Token, permissão e rate limit valem para o lote todo.
+    """
+    if len(ids) == 1:
+        try:
+            return {ids[0]: _ig_request(ids[0], fields)}
+        except Exception as e:
+            logger.warning(f"Lookup falhou para {ids[0]}: {e}")
+            return {ids[0]: e}
+
+    try:
+        data = _ig_request("", fields, {"ids": ",".join(ids)})
+        logger.info(f"Lote Graph resolvido: {len(ids)} ids em 1 chamada")
+    except requests.HTTPError as e:
+        if classify_error(e) != NOT_FOUND:
+            # token, permissão, rate limit (400/403 com code 4/17/32/613) ou 5xx:
+            # dividir só multiplicaria as chamadas
+            return {mid: e for mid in ids}
+        logger.warning(f"Lote de {len(ids)} ids falhou ({e}), dividindo")
+        mid = len(ids) // 2
+        result = _fetch_batch(ids[:mid], fields)
+        result.update(_fetch_batch(ids[mid:], fields))
+        return result
+
+    result = {}
+    for mid in ids:
+        result[mid] = data.get(mid) if isinstance(data.get(mid), dict) else LookupError(f"{mid} ausente na resposta do lote")
+    return result
 
+
+def ig_get_many(ids: list[str], fields: str = MEDIA_INFO_FIELDS) -> dict:
+    """
+    Resolve vários ids em lotes de até GRAPH_BATCH_MAX_IDS.
+    Retorna {id: dict | Exception}.
+    """
+    uniq = list(dict.fromkeys(i for i in ids if i))
+    result = {}
+    for i in range(0, len(uniq), GRAPH_BATCH_MAX_IDS):
+        result.update(_fetch_batch(uniq[i:i + GRAPH_BATCH_MAX_IDS], fields))
+    return result
+
+
+def queue_lookups(ids: list[str], fields: str = MEDIA_INFO_FIELDS):
+    """
+    Enfileira ids para serem resolvidos juntos no primeiro ig_get que pedir
+    qualquer um deles com os mesmos fields.
+    """
+    with _batch_lock:
+        pending = _pending_lookups.setdefault(fields, [])
+        for mid in ids:
+            if mid and mid not in pending:
+                pending.append(mid)
+    logger.info(f"{len(ids)} lookups enfileirados (fields={fields})")
+
+
+def _flush_lookups(fields: str):
+    with _batch_lock:
+        ids = _pending_lookups.pop(fields, [])
+    if not ids:
+        return
+    results = ig_get_many(ids, fields)
+    now = time.time()
+    with _batch_lock:
+        for key, (ts, _) in list(_batch_results.items()):
+            if now - ts > _BATCH_RESULT_TTL_SECONDS:
+                _batch_results.pop(key, None)
+        for mid, data in results.items():
+            _batch_results[(fields, mid)] = (now, data)
+
+
+def _take_batched(path_or_id: str, fields: str):
+    with _batch_lock:
+        queued = path_or_id in _pending_lookups.get(fields, ())
+    if queued:
+        _flush_lookups(fields)
+    with _batch_lock:
+        return _batch_results.pop((fields, path_or_id), None)
+
+
+def ig_get(path_or_id: str, fields: str, extra: dict | None = None):
+    if not extra:
+        batched = _take_batched(path_or_id, fields)
+        if batched is not None:
+            _, data = batched
+            if isinstance(data, Exception):
+                raise data
+            return data
+    return _ig_request(path_or_id, fields, extra)
+
+def remember_media_urls(items: list[dict]):
+    """
+    Guarda media_type/media_url/thumbnail_url de posts (e filhos de carrossel)
+    que já vieram na resposta do Graph, evitando um ig_get por mídia depois.
+    """
+    ttl = current_app.config['MEDIA_URL_INDEX_TTL_SECONDS']
+    expires = time.time() + ttl
+    added = 0
+    urls = []
+    with _media_url_lock:
+        stack = list(items or [])
+        while stack:
+            item = stack.pop()
+            if not isinstance(item, dict):
+                continue
+            stack.extend((item.get("children") or {}).get("data", []))
+            mid = item.get("id")
+            if mid and (item.get("media_url") or item.get("thumbnail_url")):
+                _media_url_index[mid] = (expires, {
+                    "id": mid,
+                    "media_type": item.get("media_type"),
+                    "media_url": item.get("media_url"),
+                    "thumbnail_url": item.get("thumbnail_url"),
+                })
+                added += 1
+                urls.extend(u for u in (item.get("media_url"), item.get("thumbnail_url")) if u)
+        now = time.time()
+        for mid, (exp, _) in list(_media_url_index.items()):
+            if exp < now:
+                _media_url_index.pop(mid, None)
+    logger.info(f"Índice de URLs de mídia: {added} entradas atualizadas ({len(_media_url_index)} no total)")
+    warm_new_hosts(urls)
+
+
+def lookup_media_urls(media_id: str) -> dict | None:
+    with _media_url_lock:
+        entry = _media_url_index.get(media_id)
+        if not entry:
+            return None
+        if entry[0] < time.time():
+            _media_url_index.pop(media_id, None)
+            return None
+        return entry[1]
+
+
+def forget_media_urls(media_id: str):
+    with _media_url_lock:
+        _media_url_index.pop(media_id, None)
+
+
+def get_media_info(media_id: str) -> dict:
+    """media_type/media_url/thumbnail_url de uma mídia: índice primeiro, Graph depois."""
+    info = lookup_media_urls(media_id)
+    if info:
+        logger.info(f"URLs de {media_id} vindas do índice")
+        return info
+
+    failure = negative_cache.lookup("graph", media_id)
+    if failure:
+        raise KnownFailure(failure["error_class"], failure["detail"])
+    try:
+        info = ig_get(media_id, fields=MEDIA_INFO_FIELDS)
+    except Exception as e:
+        error_class = classify_error(e)
+        if error_class:
+            negative_cache.remember("graph", media_id, error_class, str(e))
+        raise
+
+    if info.get("media_url") or info.get("thumbnail_url"):
+        remember_media_urls([info])
+    else:
+        negative_cache.remember("graph", media_id, NOT_FOUND, "sem media_url/thumbnail_url")
+    return info
+
+
+def ig_get_url(full_url: str):
+    return _single_flight((full_url,), lambda: _graph_get(full_url))
+
+def _load_user_profile():
     fields = "id,username,biography,followers_count,follows_count,media_count,account_type"
     data = ig_get("me", fields)
-    payload = {
+    return {
         "username": data.get("username"),
         "profilePictureUrl": None,
         "fullName": None,
@@ -32,5 +291,16 @@ def fetch_user_profile():
         "followersCount": data.get("followers_count"),
         "followingCount": data.get("follows_count"),
     }
-    set_in_cache(cache_key, payload)
-    return payload
+
+def fetch_user_profile():
+    s = current_app.config
+    cache_key = f"profile_{s['USER_ID']}"
+    try:
+        return get_or_revalidate(cache_key, s['CACHE_DURATION_SECONDS'],
+                                 s['CACHE_HARD_TTL_SECONDS'], _load_user_profile)
+    except Exception as e:
+        stale = get_stale_from_cache(cache_key, s['CACHE_STALE_IF_ERROR_SECONDS'])
+        if stale:
+            logger.warning(f"Graph indisponível ({e}), servindo perfil expirado do cache")
+            return stale
+        raise
@@ -1,11 +1,22 @@
 # services/media_cache.py
-import os, time, mimetypes, re, logging
-from flask import Response, request, current_app, abort, send_file
+import io, os, time, mimetypes, re, logging, json, tempfile, uuid, itertools, hashlib, threading
+from flask import Response, request, current_app, abort, send_file, stream_with_context
+from werkzeug.wsgi import wrap_file
 from .http import get
-from .instagram import ig_get
+from .circuit import CircuitOpenError
+from .instagram import get_media_info, forget_media_urls
+from .negative_cache import negative_cache, classify_error, MediaTooLarge, NOT_FOUND, PERMISSION, OVERSIZE, TIMEOUT
+from .media_index import (media_index, shard_dir, parse_cache_name, partial_path, chunk_count, has_chunk,
+                          url_expiry, lock_path, try_lock, unlock, INDEX_DB_NAME, BLOBS_DIR)
+from .media_eviction import media_evictor
+from . import media_derivatives
+from .media_hot import hot_media
 
 logger = logging.getLogger(__name__)
 
+# downloads que esperaram a trava / foram resolvidos pelo fetcher que a tinha / leram o .tmp de um tee
+_download_stats = {"waited": 0, "coalesced": 0, "lock_timeouts": 0, "followed": 0}
+
 # ---------- helpers de content-type/extension ----------
 _MP4_FTYP = b"ftyp"
 _JPEG = b"\xFF\xD8\xFF"
@@ -24,14 +35,7 @@ def _ext_from_content_type(ct: str) -> str:
     return mimetypes.guess_extension(ct) or ''
 
 
-def _sniff_ext_ct(path: str, ct_header: str | None) -> tuple[str, str]:
-    ct = (ct_header or '').lower()
-    if ct and ct != 'application/octet-stream':
-        return _ext_from_content_type(ct), ct
-
-    with open(path, 'rb') as f:
-        head = f.read(32)  # Aumentado de 16 para detectar melhor MP4
-
+def _sniff_head(head: bytes) -> tuple[str, str] | None:
     # MP4: 'ftyp' costuma aparecer em 4..12
     if len(head) >= 12 and _MP4_FTYP in head[4:12]:
         return '.mp4', 'video/mp4'
@@ -43,6 +47,20 @@ def _sniff_ext_ct(path: str, ct_header: str | None) -> tuple[str, str]:
         return '.gif', 'image/gif'
     if head.startswith(_WEBP) and b'WEBP' in head[8:16]:
         return '.webp', 'image/webp'
+    return None
+
+
+def _sniff_ext_ct(path: str, ct_header: str | None) -> tuple[str, str]:
+    ct = (ct_header or '').lower()
+    if ct and ct != 'application/octet-stream':
+        return _ext_from_content_type(ct), ct
+
+    with open(path, 'rb') as f:
+        head = f.read(32)  # Aumentado de 16 para detectar melhor MP4
+
+    sniffed = _sniff_head(head)
+    if sniffed:
+        return sniffed
 
     guessed = mimetypes.guess_type(path)[0]
     if guessed:
@@ -50,87 +68,97 @@ def _sniff_ext_ct(path: str, ct_header: str | None) -> tuple[str, str]:
     return '', 'application/octet-stream'
 
 
-def _ensure_correct_extension(path: str, desired_ext: str) -> str:
-    if not desired_ext:
-        return path
-    base, current_ext = os.path.splitext(path)
-    if current_ext.lower() == desired_ext.lower():
-        return path
-    new_path = base + desired_ext
-    if os.path.exists(new_path):
-        os.remove(new_path)
-    os.rename(path, new_path)
-    return new_path
-
-
 # ---------- cache paths ----------
-def _cache_paths(media_id: str, variant: str = "media", content_type: str | None = None):
-    d = current_app.config['MEDIA_CACHE_DIR']
-    base = f"{media_id}.{variant}"
-    for name in os.listdir(d):
-        if name.startswith(base + "."):
-            p = os.path.join(d, name)
-            meta = os.path.join(d, f"{base}.meta")
-            return p, meta
+def _cache_path(media_id: str, variant: str = "media", content_type: str | None = None) -> str:
+    """Caminho da mídia dentro do subdiretório do hash do media_id."""
+    d = shard_dir(current_app.config['MEDIA_CACHE_DIR'], media_id)
     ext = _ext_from_content_type(content_type) if content_type else '.bin'
-    return (os.path.join(d, f"{base}{ext}"),
-            os.path.join(d, f"{base}.meta"))
-
-
-def _write_meta(meta_path: str, content_type: str):
-    try:
-        with open(meta_path, 'w') as f:
-            f.write(content_type or 'application/octet-stream')
-    except Exception as e:
-        logger.error(f"Erro ao escrever meta {meta_path}: {e}")
+    return os.path.join(d, f"{media_id}.{variant}{ext}")
 
 
-def _read_meta(meta_path: str) -> str:
+def _read_legacy_meta(meta_path: str) -> dict:
+    """.meta de versões anteriores (JSON ou só o content-type em texto), lido na migração."""
+    meta = {"content_type": 'application/octet-stream', "etag": None,
+            "last_modified": None, "source_url": None}
     try:
         with open(meta_path, 'r') as f:
-            return f.read().strip()
+            raw = f.read().strip()
     except Exception:
-        return 'application/octet-stream'
+        return meta
+    if raw.startswith('{'):
+        try:
+            meta.update(json.loads(raw))
+        except ValueError:
+            pass
+    elif raw:
+        # formato antigo: apenas o content-type em texto puro
+        meta["content_type"] = raw
+    return meta
+
+
+def _conditional_headers(meta: dict) -> dict:
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+
+def _lookup_entry(media_id: str, variant: str) -> dict | None:
+    """Uma leitura pela chave primária no índice (compartilhado entre os workers)."""
+    return media_index.get(media_id, variant)
 
 
-def _is_cache_fresh(path: str) -> bool:
-    if not os.path.exists(path):
-        return False
-    age = time.time() - os.path.getmtime(path)
+def _is_cache_fresh(entry: dict) -> bool:
+    age = time.time() - entry["validated_at"]
     return age <= current_app.config['MEDIA_CACHE_TTL_SECONDS']
 
 
-def _save_stream_to_file(resp, dst_path: str, max_bytes: int) -> str:
-    tmp_path = dst_path + ".tmp"
+def _save_stream_to_file(resp, dst_path: str, max_bytes: int) -> tuple[str, str]:
+    """
+    Grava o stream num .tmp de nome único ao lado de dst_path e devolve (.tmp, sha256);
+    quem chama promove com os.replace (leitores nunca veem arquivo parcial).
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst_path),
+                                    prefix=os.path.basename(dst_path) + ".", suffix=".tmp")
     total = 0
+    digest = hashlib.sha256()
     try:
-        with open(tmp_path, 'wb') as f:
+        with os.fdopen(fd, 'wb') as f:
             for chunk in resp.iter_content(chunk_size=1024 * 64):
                 if chunk:
                     total += len(chunk)
                     if total > max_bytes:
                         f.close()
+                        resp.close()
                         os.remove(tmp_path)
                         logger.warning(f"Arquivo excedeu tamanho máximo: {dst_path} ({total} > {max_bytes})")
-                        return ''
+                        raise MediaTooLarge(f"{total} > {max_bytes} bytes")
                     f.write(chunk)
-        if os.path.exists(dst_path):
-            os.remove(dst_path)
-        os.rename(tmp_path, dst_path)
-        logger.info(f"Arquivo salvo: {dst_path} ({total} bytes)")
-        return dst_path
+                    digest.update(chunk)
+        logger.info(f"Arquivo baixado: {tmp_path} ({total} bytes)")
+        return tmp_path, digest.hexdigest()
+    except MediaTooLarge:
+        raise
     except Exception as e:
         logger.error(f"Erro ao salvar stream: {e}")
         if os.path.exists(tmp_path):
             os.remove(tmp_path)
-        return ''
+        return '', ''
 
 
 def drop_media_cache(media_id: str):
-    d = current_app.config['MEDIA_CACHE_DIR']
+    d = shard_dir(current_app.config['MEDIA_CACHE_DIR'], media_id)
+    negative_cache.forget("media", prefix=f"{media_id}:")
+    negative_cache.forget("graph", key=media_id)
+    hot_media.forget(media_id)
+    media_index.remove(media_id, invalidate=True)  # e nos outros workers, pela geração
+    if not os.path.isdir(d):
+        return
     try:
         for name in os.listdir(d):
-            if name.startswith(media_id + "."):
+            if name.startswith(media_id + ".") and not name.endswith(".lock"):
                 try:
                     os.remove(os.path.join(d, name))
                     logger.info(f"Removido: {name}")
@@ -141,61 +169,1005 @@ def drop_media_cache(media_id: str):
 
 
 # ---------- download + normalização ----------
+def _check_declared_size(cdn, max_bytes: int):
+    declared = cdn.headers.get('Content-Length')
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        cdn.close()
+        raise MediaTooLarge(f"Content-Length {declared} > {max_bytes} bytes")
+
+
+def _store_download(media_id: str, variant: str, cdn, src: str) -> tuple[str, str]:
+    ct_header = cdn.headers.get('Content-Type', 'application/octet-stream')
+    logger.info(f"Content-Type recebido: {ct_header}")
+
+    max_bytes = current_app.config['MEDIA_CACHE_MAX_BYTES']
+    _check_declared_size(cdn, max_bytes)
+
+    file_path = _cache_path(media_id, variant, ct_header)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path, content_hash = _save_stream_to_file(cdn, file_path, max_bytes)
+
+    if not tmp_path:
+        logger.error(f"Falha ao salvar: {file_path}")
+        return '', ''
+    return _publish_download(media_id, variant, tmp_path, ct_header, cdn.headers, src, content_hash)
+
+
+def _publish_download(media_id: str, variant: str, tmp_path: str, ct_header: str,
+                      cdn_headers, src: str, content_hash: str) -> tuple[str, str]:
+    """
+    Liga o .tmp completo ao blob do seu sha256 (extensão pelo conteúdo) e registra
+    no índice; se outra chave já tem os mesmos bytes, o .tmp é descartado.
+    """
+    # Sniff + corrigir extensão e Content-Type
+    desired_ext, sniff_ct = _sniff_ext_ct(tmp_path, ct_header)
+    logger.info(f"Detectado: ext={desired_ext}, ct={sniff_ct}")
+    final_ct = sniff_ct or ct_header or 'application/octet-stream'
+
+    entry = media_index.put(media_id, variant,
+                            src_path=tmp_path,
+                            ext=desired_ext or '.bin',
+                            content_hash=content_hash,
+                            content_type=final_ct,
+                            etag=cdn_headers.get('ETag'),
+                            last_modified=cdn_headers.get('Last-Modified'),
+                            source_url=src)
+    media_index.remove_partial(media_id, variant)  # download inteiro substitui trechos de um seek anterior
+    hot_media.forget(media_id, variant)
+    media_evictor.record_write(media_id, variant)
+    logger.info(f"Mídia cacheada com sucesso: {media_id}/{variant} -> {entry['path']}")
+    if final_ct.startswith("image/"):
+        _store_placeholder(entry)
+    return entry["path"], final_ct
+
+
+def _store_placeholder(entry: dict):
+    """LQIP + cor dominante do blob, uma vez por conteúdo (chaves deduplicadas reaproveitam)."""
+    if not media_derivatives.placeholders_enabled() or media_index.get_placeholder(entry["content_hash"]):
+        return
+    try:
+        placeholder, color = media_derivatives.placeholder(entry["path"])
+        media_index.set_placeholder(entry["content_hash"], placeholder, color)
+        logger.info(f"Placeholder calculado: {entry['media_id']}/{entry['variant']} "
+                    f"({len(placeholder)} chars, cor {color})")
+    except Exception as e:
+        logger.warning(f"Falha ao calcular placeholder de {entry['media_id']}: {e}")
+
+
+def backfill_placeholder(media_id: str, variant: str = "media"):
+    """Imagem cacheada antes dos placeholders (ou cujo cálculo falhou): calcula agora (usado pelo warmup)."""
+    entry = _lookup_entry(media_id, variant)
+    if entry and entry["content_type"].startswith("image/"):
+        _store_placeholder(entry)
+
+
+def media_placeholders(media_ids: list[str]) -> dict[str, dict]:
+    """media_id -> {"placeholder", "dominantColor"} para o /posts (thumb primeiro, senão a mídia)."""
+    found = media_index.placeholders(media_ids)
+    result = {}
+    for mid in media_ids:
+        hit = found.get((mid, "thumb")) or found.get((mid, "media"))
+        if hit:
+            result[mid] = {"placeholder": hit[0], "dominantColor": hit[1]}
+    return result
+
+
+class _TeeDownload:
+    """
+    Download em modo tee: cada chunk do CDN vai para o cliente assim que chega e
+    para um .tmp exclusivo. O arquivo só é publicado (os.replace + índice) se o
+    download terminar completo e dentro de MEDIA_CACHE_MAX_BYTES; truncado ou
+    grande demais, o .tmp é descartado. Se o cliente desconecta no meio, o
+    download continua em background até o fim.
+    Enquanto grava, o .tmp fica registrado no índice: outros requests da mesma
+    chave leem dele (_FollowDownload) em vez de esperar a trava ou baixar de novo.
+    """
+
+    def __init__(self, media_id: str, variant: str, cdn, src: str):
+        self.media_id, self.variant, self.cdn, self.src = media_id, variant, cdn, src
+        self.max_bytes = current_app.config['MEDIA_CACHE_MAX_BYTES']
+        _check_declared_size(cdn, self.max_bytes)
+
+        self.ct_header = cdn.headers.get('Content-Type', 'application/octet-stream')
+        declared = cdn.headers.get('Content-Length')
+        # requests descomprime Content-Encoding: aí o que chega não bate com o declarado
+        self.length = (int(declared) if declared and declared.isdigit()
+                       and not cdn.headers.get('Content-Encoding') else None)
+        self.file_path = _cache_path(media_id, variant, self.ct_header)
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+
+        # primeiro chunk já aqui: erro de conexão ainda vira resposta de erro normal
+        self._chunks = cdn.iter_content(chunk_size=_STREAM_CHUNK)
+        try:
+            self._first = next(self._chunks, b"")
+        except Exception:
+            cdn.close()
+            raise
+        ct = (self.ct_header or '').lower()
+        if ct and ct != 'application/octet-stream':
+            self.content_type = ct
+        else:
+            sniffed = _sniff_head(self._first[:32])
+            self.content_type = sniffed[1] if sniffed else 'application/octet-stream'
+        self._closed = False
+        self._stream = itertools.chain([self._first], self._chunks)
+        self._total = 0
+        self._digest = hashlib.sha256()
+        self._app = current_app._get_current_object()  # close() pode rodar fora do contexto do request
+
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.file_path),
+                                             prefix=os.path.basename(self.file_path) + ".", suffix=".tmp")
+        self._file = os.fdopen(fd, 'wb')
+        try:
+            media_index.begin_download(media_id, variant, path=self.tmp_path, length=self.length,
+                                       content_type=self.content_type)
+        except Exception:
+            self._closed = True
+            cdn.close()
+            self._finish(None)
+            raise
+
+    def close(self):
+        """
+        Idempotente: o gerador chama no fim; a resposta chama de novo (ou só ela, se
+        nunca iterou). Com o download pela metade (cliente desconectou, como o
+        <video preload="metadata"> faz depois de ler os metadados), o resto do CDN
+        segue para o .tmp numa thread e é publicado ao terminar.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self.tmp_path is None:
+            self.cdn.close()
+            return
+        threading.Thread(target=self._drain, name=f"tee-drain-{self.media_id}", daemon=True).start()
+
+    def _drain(self):
+        with self._app.app_context():
+            try:
+                for chunk in self._stream:
+                    self._write(chunk)
+                self._complete()
+                logger.info(f"Download tee de {self.media_id}/{self.variant} concluído sem o cliente "
+                            f"({self._total} bytes)")
+            except Exception as e:
+                logger.warning(f"Download tee de {self.media_id}/{self.variant} interrompido sem o cliente: {e}")
+                self._finish(None)
+            finally:
+                self.cdn.close()
+
+    def _write(self, chunk: bytes):
+        if not chunk:
+            return
+        self._total += len(chunk)
+        if self._total > self.max_bytes:
+            negative_cache.remember("media", f"{self.media_id}:{self.variant}", OVERSIZE,
+                                    f"{self._total} > {self.max_bytes} bytes")
+            # aborta a conexão: o cliente não pode achar que recebeu a mídia inteira
+            raise MediaTooLarge(f"{self._total} > {self.max_bytes} bytes")
+        self._file.write(chunk)
+        self._file.flush()  # quem acompanha o .tmp só vê o que já saiu do buffer
+        self._digest.update(chunk)
+
+    def _complete(self):
+        """Fim do stream do CDN: publica se chegou tudo, senão (truncado) descarta."""
+        if self.length is None or self._total == self.length:
+            self._finish(self._digest.hexdigest())
+        else:
+            logger.warning(f"Download truncado ({self._total}/{self.length} bytes), não publicado: {self.file_path}")
+            self._finish(None)
+
+    def _finish(self, content_hash: str | None):
+        """Publica o .tmp (hash do download completo) ou o descarta; depois tira o registro de em andamento."""
+        tmp_path, self.tmp_path = self.tmp_path, None
+        if tmp_path is None:
+            return
+        try:
+            self._file.close()
+            if content_hash:
+                _publish_download(self.media_id, self.variant, tmp_path, self.ct_header,
+                                  self.cdn.headers, self.src, content_hash)
+            else:
+                os.remove(tmp_path)
+        except Exception as e:
+            logger.error(f"Erro ao finalizar download tee de {self.media_id}: {e}")
+        finally:
+            # depois de publicar: quem lê o .tmp vê o registro sumir já com a entrada no índice
+            media_index.end_download(self.media_id, self.variant, tmp_path)
+
+    def _iter(self):
+        try:
+            for chunk in self._stream:
+                self._write(chunk)
+                if chunk:
+                    yield chunk
+            self._complete()
+        except GeneratorExit:
+            raise  # cliente desconectou: close() (no finally) termina o download em background
+        except BaseException:
+            self._finish(None)  # erro do CDN (corpo truncado) ou grande demais
+            raise
+        finally:
+            self.close()
+
+    def response(self) -> Response:
+        resp = _streamed_response(self._iter(), self.content_type, self.length)
+        resp.call_on_close(self.close)
+        logger.info(f"Servindo em modo tee: {self.media_id}/{self.variant} ({self.length or '?'} bytes)")
+        return resp
+
+
+# .tmp do líder sem crescer por mais que isso: download travado (ou worker morto), quem acompanha desiste
+_FOLLOW_STALL_SECONDS = 15.0
+_FOLLOW_POLL_SECONDS = 0.05
+
+
+class _FollowDownload:
+    """
+    Request que chegou durante o download tee de outro: serve o .tmp do líder
+    conforme ele cresce. Se o líder abortar (ou parar de gravar), a conexão é
+    cortada, como no tee: o cliente não pode achar que recebeu a mídia inteira.
+    """
+
+    def __init__(self, media_id: str, variant: str, download: dict):
+        self.media_id, self.variant = media_id, variant
+        self.path, self.length = download["path"], download["length"]
+        self.content_type = download["content_type"]
+        self._f = open(self.path, 'rb')  # segue legível mesmo depois de publicado/descartado
+
+    def _leader_done(self) -> bool:
+        current = media_index.get_download(self.media_id, self.variant)
+        return current is None or current["path"] != self.path
+
+    def _iter(self):
+        total = 0
+        idle_since = time.monotonic()
+        try:
+            while self.length is None or total < self.length:
+                chunk = self._f.read(_STREAM_CHUNK)
+                if chunk:
+                    total += len(chunk)
+                    idle_since = time.monotonic()
+                    yield chunk
+                    continue
+                if self._leader_done():
+                    # o líder já publicou (ou descartou): o que falta está no arquivo ou não vem mais
+                    while chunk := self._f.read(_STREAM_CHUNK):
+                        total += len(chunk)
+                        yield chunk
+                    entry = _lookup_entry(self.media_id, self.variant)
+                    if (self.length is None and entry and entry["size"] == total) or total == self.length:
+                        break
+                    raise IOError(f"Download de {self.media_id}/{self.variant} abortado pelo líder "
+                                  f"({total}/{self.length or '?'} bytes)")
+                if time.monotonic() - idle_since > _FOLLOW_STALL_SECONDS:
+                    raise IOError(f"Download de {self.media_id}/{self.variant} parado há "
+                                  f"{_FOLLOW_STALL_SECONDS:.0f}s ({total} bytes)")
+                time.sleep(_FOLLOW_POLL_SECONDS)
+        finally:
+            self._f.close()
+
+    def response(self) -> Response:
+        resp = _streamed_response(self._iter(), self.content_type, self.length)
+        resp.call_on_close(self._f.close)
+        logger.info(f"Acompanhando download em andamento: {self.media_id}/{self.variant} "
+                    f"({self.length or '?'} bytes)")
+        return resp
+
+
+def _streamed_response(body, content_type: str, length: int | None) -> Response:
+    resp = Response(stream_with_context(body), status=200, mimetype=content_type, direct_passthrough=True)
+    if length is not None:
+        resp.headers["Content-Length"] = str(length)
+        if request.headers.get("Range") and length:
+            # só chega aqui com "bytes=0-": o corpo inteiro é o intervalo pedido
+            resp.status_code = 206
+            resp.headers["Content-Range"] = f"bytes 0-{length - 1}/{length}"
+    resp.headers["Accept-Ranges"] = "bytes"
+    resp.headers["Cache-Control"] = "public, max-age=3600"
+    return resp
+
+
+def _live_download(media_id: str, variant: str) -> dict | None:
+    """Download tee em andamento da chave (registro no índice e .tmp ainda crescendo), ou None."""
+    download = media_index.get_download(media_id, variant)
+    if download is None:
+        return None
+    try:
+        idle = time.time() - os.stat(download["path"]).st_mtime
+    except FileNotFoundError:
+        idle = None
+    if idle is None or idle > _FOLLOW_STALL_SECONDS:
+        # sobra de worker morto no meio do download: o registro não vale mais
+        media_index.end_download(media_id, variant, download["path"])
+        return None
+    return download
+
+
+def _wait_download(media_id: str, variant: str, deadline: float):
+    """Quem não tem cliente para repassar bytes (warmup, derivados) espera o tee em andamento publicar."""
+    if _live_download(media_id, variant) is None:
+        return
+    _download_stats["waited"] += 1
+    while _live_download(media_id, variant) is not None:
+        if time.monotonic() >= deadline:
+            logger.warning(f"Timeout esperando download tee de {media_id}/{variant}, baixando de novo")
+            _download_stats["lock_timeouts"] += 1
+            return
+        time.sleep(_FOLLOW_POLL_SECONDS)
+
+
+# ---------- cache esparso (seek em vídeo grande) ----------
+_CONTENT_RANGE = re.compile(r"^\s*bytes\s+(\d+)-(\d+)/(\d+)\s*$")
+
+
+def _content_range(cdn) -> tuple[int, int, int] | None:
+    m = _CONTENT_RANGE.match(cdn.headers.get('Content-Range', ''))
+    return (int(m.group(1)), int(m.group(2)), int(m.group(3))) if m else None
+
+
+def _first_range_start(header: str) -> int | None:
+    """Início do primeiro intervalo do header Range (None para sufixo bytes=-N ou inválido)."""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    m = _RANGE_SPEC.match(spec.split(",")[0])
+    return int(m.group(1)) if m and m.group(1) else None
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view, offset = view[written:], offset + written
+
+
+class _SparseMedia:
+    """
+    Download parcial de um vídeo grande. Cada request lê do arquivo esparso os
+    trechos (MEDIA_SPARSE_CHUNK_BYTES) já marcados no bitmap e busca no CDN, com
+    um Range alinhado por lacuna, só os que faltam: grava, marca e repassa ao
+    cliente ao mesmo tempo. Sem trava: trechos são idempotentes, então dois
+    workers no mesmo trecho só gravam os mesmos bytes. Com todos os trechos
+    presentes, o arquivo é promovido a blob completo.
+    """
+
+    def __init__(self, media_id: str, variant: str, partial: dict, pending=None):
+        self.media_id, self.variant, self.partial = media_id, variant, partial
+        self.size, self.chunk = partial["size"], partial["chunk_size"]
+        self.bitmap = partial["bitmap"]
+        self.content_type = partial["content_type"]
+        # resposta do CDN que criou o parcial (primeiro trecho), consumida pelo primeiro _walk
+        self._pending = pending
+
+    def _present(self, i: int) -> bool:
+        if has_chunk(self.bitmap, i):
+            return True
+        partial = media_index.get_partial(self.media_id, self.variant)  # outro worker pode ter gravado
+        if partial:
+            self.bitmap = partial["bitmap"]
+        return has_chunk(self.bitmap, i)
+
+    def _get_range(self, start: int, end: int):
+        headers = {"Range": f"bytes={start}-{end}"}
+        validator = self.partial["etag"] or self.partial["last_modified"]
+        if validator:
+            headers["If-Range"] = validator  # conteúdo trocado na origem vem 200, não trechos misturados
+        src = self.partial["source_url"]
+        if (url_expiry(src) or float("inf")) <= time.time():
+            src = self._renew_source_url()
+        try:
+            cdn = get(src, timeout=20, stream=True, headers=headers)
+        except Exception as e:
+            if classify_error(e) not in (NOT_FOUND, PERMISSION):
+                raise
+            # assinatura da URL expirou antes do "oe": busca URL nova uma vez
+            cdn = get(self._renew_source_url(), timeout=20, stream=True, headers=headers)
+        if cdn.status_code != 206 or _content_range(cdn) != (start, end, self.size):
+            cdn.close()
+            media_index.remove_partial(self.media_id, self.variant)
+            raise IOError(f"Trechos de {self.media_id}/{self.variant} descartados: "
+                          f"a origem mudou ou ignorou o Range (status {cdn.status_code})")
+        return cdn
+
+    def _renew_source_url(self) -> str:
+        forget_media_urls(self.media_id)
+        src = _source_url(get_media_info(self.media_id), self.variant)
+        if not src:
+            raise IOError(f"Nenhuma URL disponível para {self.media_id}")
+        media_index.touch_partial(self.media_id, self.variant, source_url=src)
+        self.partial["source_url"] = src
+        return src
+
+    def _fetch(self, first: int, last: int, wfd: int, cdn=None):
+        """Busca os trechos first..last num Range só, gravando e marcando cada trecho completo; gera (offset, bytes)."""
+        start, end = first * self.chunk, min((last + 1) * self.chunk, self.size) - 1
+        cdn = cdn or self._get_range(start, end)
+        pos, marked = start, first
+        try:
+            for data in cdn.iter_content(chunk_size=_STREAM_CHUNK):
+                data = data[:end + 1 - pos]
+                if not data:
+                    continue
+                _pwrite_all(wfd, data, pos)
+                offset, pos = pos, pos + len(data)
+                done = last if pos > end else pos // self.chunk - 1
+                if done >= marked:
+                    self.bitmap = media_index.mark_chunks(self.media_id, self.variant, marked, done) or self.bitmap
+                    marked = done + 1
+                yield offset, data
+                if pos > end:
+                    break
+        finally:
+            cdn.close()
+        if pos <= end:
+            raise IOError(f"Trecho truncado do CDN ({pos - start}/{end - start + 1} bytes): {self.media_id}")
+
+    def _walk(self, start: int, end: int, wfd: int):
+        """Percorre start..end: ("file", pos, stop) para trechos em disco, ("data", bytes) para o que veio do CDN."""
+        pos = start
+        last_needed = end // self.chunk
+        while pos <= end:
+            i = pos // self.chunk
+            if self._present(i):
+                stop = min((i + 1) * self.chunk, end + 1)
+                yield "file", pos, stop
+                pos = stop
+                continue
+            cdn, j = None, i
+            pending, self._pending = self._pending, None
+            if pending is not None and _content_range(pending)[0] == i * self.chunk:
+                cdn, j = pending, _content_range(pending)[1] // self.chunk
+            else:
+                if pending is not None:
+                    pending.close()
+                while j < last_needed and not has_chunk(self.bitmap, j + 1):
+                    j += 1
+            for offset, data in self._fetch(i, j, wfd, cdn):
+                piece = data[max(pos - offset, 0):max(end + 1 - offset, 0)]
+                if piece:
+                    pos += len(piece)
+                    yield "data", piece
+            pos = max(pos, min((j + 1) * self.chunk, end + 1))
+
+    def _iter(self, start: int, end: int, f, wfd: int):
+        try:
+            for item in self._walk(start, end, wfd):
+                if item[0] == "file":
+                    yield from _read_chunks(f, item[1], item[2] - item[1])
+                else:
+                    yield item[1]
+        finally:
+            self._finish(f, wfd)
+
+    def _finish(self, f, wfd: int):
+        f.close()
+        os.close(wfd)
+        if self._pending is not None:
+            self._pending.close()
+            self._pending = None
+        if all(has_chunk(self.bitmap, i) for i in range(chunk_count(self.size, self.chunk))):
+            try:
+                _promote_partial(self.media_id, self.variant)
+            except Exception as e:
+                logger.error(f"Erro ao promover download parcial de {self.media_id}: {e}")
+
+    def response(self) -> Response | None:
+        """None se o parcial sumiu (promovido ou descartado por outro worker) antes de abrir."""
+        # o ETag do conteúdo completo ainda não existe: com If-Range não dá para confirmar, vai inteiro
+        range_header = "" if request.headers.get("If-Range") else request.headers.get("Range", "")
+        ranges = _parse_ranges(range_header, self.size) if range_header else [(0, self.size - 1)]
+        if not ranges:
+            if self._pending is not None:
+                self._pending.close()
+            return _range_not_satisfiable(self.size)
+        if len(ranges) > _MAX_RANGES:
+            ranges = [(ranges[0][0], ranges[-1][1])]  # une tudo num intervalo (permitido pela RFC 7233)
+        try:
+            f = open(self.partial["path"], "rb")
+            wfd = os.open(self.partial["path"], os.O_WRONLY)
+        except FileNotFoundError:
+            if self._pending is not None:
+                self._pending.close()
+            return None
+        media_index.touch_partial(self.media_id, self.variant)
+
+        if len(ranges) > 1:
+            # multipart: completa as lacunas antes e serve do arquivo como um hit
+            try:
+                for start, end in ranges:
+                    for _ in self._walk(start, end, wfd):
+                        pass
+            except BaseException:
+                self._finish(f, wfd)
+                raise
+            os.close(wfd)
+            return _serve_open_file(f, self.partial["path"], self.content_type)
+
+        start, end = ranges[0]
+        length = end - start + 1
+        resp = Response(stream_with_context(self._iter(start, end, f, wfd)),
+                        status=206 if range_header else 200,
+                        mimetype=_guess_content_type(self.partial["path"], self.content_type),
+                        direct_passthrough=True)
+        if range_header:
+            resp.headers["Content-Range"] = f"bytes {start}-{end}/{self.size}"
+        resp.headers["Content-Length"] = str(length)
+        resp.headers["Accept-Ranges"] = "bytes"
+        resp.headers["Cache-Control"] = "public, max-age=3600"
+        logger.info(f"Servindo parcial: {self.media_id}/{self.variant} bytes {start}-{end}/{self.size}")
+        return resp
+
+
+def _start_sparse(media_id: str, variant: str, src: str):
+    """
+    Miss com seek: pede ao CDN o trecho alinhado que contém o início do Range.
+    O 206 dá o tamanho total; vídeo grande vira download parcial (arquivo esparso
+    + bitmap) e o trecho segue para o cliente. Arquivo pequeno ou CDN sem
+    suporte a Range caem no download inteiro.
+    """
+    cfg = current_app.config
+    chunk = cfg['MEDIA_SPARSE_CHUNK_BYTES']
+    first = (_first_range_start(request.headers.get("Range", "")) or 0) // chunk * chunk
+    logger.info(f"Baixando trecho: {src[:50]}... (bytes {first}+{chunk})")
+    cdn = get(src, timeout=20, stream=True, headers={"Range": f"bytes={first}-{first + chunk - 1}"})
+    content_range = _content_range(cdn)
+    if cdn.status_code != 206 or not content_range:
+        logger.info(f"CDN ignorou o Range, baixando inteiro: {media_id}/{variant}")
+        return _store_download(media_id, variant, cdn, src)
+    size = content_range[2]
+    max_bytes = cfg['MEDIA_CACHE_MAX_BYTES']
+    if size > max_bytes:
+        cdn.close()
+        raise MediaTooLarge(f"Content-Range {size} > {max_bytes} bytes")
+    if size < cfg['MEDIA_SPARSE_MIN_BYTES'] or content_range[0] != first:
+        cdn.close()
+        return _download_whole(media_id, variant, src)
+
+    path = partial_path(cfg['MEDIA_CACHE_DIR'], media_id, variant)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ct = cdn.headers.get('Content-Type') or 'application/octet-stream'
+    partial = media_index.put_partial(media_id, variant, path=path, size=size, chunk_size=chunk,
+                                      content_type=ct, etag=cdn.headers.get('ETag'),
+                                      last_modified=cdn.headers.get('Last-Modified'), source_url=src)
+    fd = os.open(path, os.O_CREAT | os.O_WRONLY, 0o644)
+    try:
+        if os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)  # esparso: só os trechos gravados ocupam disco
+    finally:
+        os.close(fd)
+    if partial["size"] != size or partial["chunk_size"] != chunk:
+        cdn.close()  # outro worker registrou com outra versão/config: segue com a dele, sem o trecho
+        return _SparseMedia(media_id, variant, partial), partial["content_type"]
+    media_evictor.record_write(media_id, variant)
+    logger.info(f"Download parcial iniciado: {media_id}/{variant} ({size} bytes, trechos de {chunk})")
+    return _SparseMedia(media_id, variant, partial, pending=cdn), partial["content_type"]
+
+
+def _download_whole(media_id: str, variant: str, src: str) -> tuple[str, str]:
+    """Download inteiro sob a trava da chave (single-flight com tee/warmup em andamento)."""
+    deadline = _lock_deadline()
+    _wait_download(media_id, variant, deadline)
+    fd, lock = _acquire_download_lock(media_id, variant, deadline)
+    try:
+        entry = _lookup_entry(media_id, variant)
+        if entry and _is_cache_fresh(entry):
+            _download_stats["coalesced"] += 1
+            return entry["path"], entry["content_type"]
+        return _store_download(media_id, variant, get(src, timeout=20, stream=True), src)
+    finally:
+        _release_download_lock(fd, lock)
+
+
+def _promote_partial(media_id: str, variant: str):
+    """Todos os trechos gravados: o arquivo esparso vira blob e linha em media, como um download completo."""
+    lock = lock_path(media_index.cache_dir, media_id, variant)
+    fd = try_lock(lock)
+    if fd is None:
+        return  # outro fetcher está promovendo (ou baixando inteiro)
+    try:
+        partial = media_index.get_partial(media_id, variant)
+        if not partial or not all(has_chunk(partial["bitmap"], i)
+                                  for i in range(chunk_count(partial["size"], partial["chunk_size"]))):
+            return
+        path = partial["path"]
+        ext, ct = _sniff_ext_ct(path, partial["content_type"])
+        entry = media_index.put(media_id, variant,
+                                src_path=path,
+                                ext=ext or '.bin',
+                                content_hash=_file_sha256(path),
+                                content_type=ct,
+                                etag=partial["etag"],
+                                last_modified=partial["last_modified"],
+                                source_url=partial["source_url"],
+                                created_at=partial["created_at"])
+        media_index.remove_partial(media_id, variant, keep_file=True)
+        media_evictor.record_write(media_id, variant)
+        logger.info(f"Download parcial completo, promovido: {media_id}/{variant} -> {entry['path']}")
+    finally:
+        unlock(fd, lock)
+
+
+def _fetch_conditional(media_id: str, variant: str, src: str, entry: dict | None, tee: bool = False,
+                       sparse: bool = False):
+    """
+    Busca src enviando os validadores guardados (se houver arquivo em cache).
+    304 só renova o TTL (mtime) do arquivo existente; 200 regrava o arquivo
+    (ou, com tee, devolve um _TeeDownload que grava enquanto serve; com sparse
+    e sem cópia em cache, um _SparseMedia que baixa só os trechos pedidos).
+    """
+    headers = _conditional_headers(entry) if entry else {}
+    if sparse and not headers:
+        return _start_sparse(media_id, variant, src)
+    logger.info(f"Baixando mídia: {src[:50]}... (condicional={bool(headers)})")
+    cdn = get(src, timeout=20, stream=True, headers=headers or None)
+    if cdn.status_code == 304:
+        cdn.close()
+        media_index.touch(media_id, variant, time.time())
+        logger.info(f"Revalidado (304), TTL renovado: {entry['path']}")
+        return entry["path"], entry["content_type"]
+    if tee:
+        download = _TeeDownload(media_id, variant, cdn, src)
+        return download, download.content_type
+    return _store_download(media_id, variant, cdn, src)
+
+
+def _is_within_stale_window(entry: dict) -> bool:
+    age = time.time() - entry["validated_at"]
+    cfg = current_app.config
+    return age <= cfg['MEDIA_CACHE_TTL_SECONDS'] + cfg['CACHE_STALE_IF_ERROR_SECONDS']
+
+
+def _lock_deadline() -> float:
+    """
+    Prazo único das esperas de um request (travas da mídia e do derivado, tee em
+    andamento): somadas, não passam de MEDIA_DOWNLOAD_LOCK_TIMEOUT_SECONDS.
+    """
+    return time.monotonic() + current_app.config['MEDIA_DOWNLOAD_LOCK_TIMEOUT_SECONDS']
+
+
+def _acquire_download_lock(media_id: str, variant: str, deadline: float) -> tuple[int | None, str]:
+    """
+    flock exclusivo por (media_id, variant) num .lock do subdiretório: coordena
+    threads, workers gunicorn e o warmup. fd None se o prazo (_lock_deadline)
+    esgotar (segue sem a trava em vez de falhar o request).
+    """
+    path = lock_path(current_app.config['MEDIA_CACHE_DIR'], media_id, variant)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    waited = False
+    while (fd := try_lock(path)) is None:
+        if time.monotonic() >= deadline:
+            logger.warning(f"Timeout esperando download de {media_id}/{variant}, seguindo sem trava")
+            _download_stats["lock_timeouts"] += 1
+            break
+        waited = True
+        time.sleep(0.05)
+    if waited:
+        _download_stats["waited"] += 1
+    return fd, path
+
+
+def _release_download_lock(fd: int | None, path: str):
+    if fd is not None:
+        unlock(fd, path)  # o .lock sai junto: ids inventados não deixam arquivo para trás
+
+
+def _ensure_media(media_id: str, variant: str, explicit_src: str | None, tee: bool, sparse: bool = False,
+                  deadline: float | None = None):
+    if not explicit_src:
+        # conta a demanda uma vez por request (a segunda chamada do media_proxy traz o src)
+        media_evictor.record_access(media_id, variant)
+    entry = _lookup_entry(media_id, variant)
+    if entry and _is_cache_fresh(entry):
+        logger.info(f"Cache fresco encontrado: {entry['path']}")
+        media_index.record_hit(media_id, variant)
+        return entry["path"], entry["content_type"]
+
+    if (sparse or tee) and entry is None:
+        # sem trava: um seek não espera o download inteiro (tee) que outro request está fazendo; e a
+        # volta ao byte 0 (bytes=0-, que seria tee) completa o parcial em vez de rebaixar tudo
+        partial = media_index.get_partial(media_id, variant)
+        if partial:
+            return _SparseMedia(media_id, variant, partial), partial["content_type"]
+    if sparse and entry is None:
+        return _refresh_media(media_id, variant, explicit_src, None, sparse=True)
+
+    failure = media_failure(media_id, variant)
+    if failure:
+        # falha recente: nem cria/espera a trava (ids inválidos de cliente não geram .lock)
+        logger.info(f"Cache negativo: {media_id}/{variant} falhou recentemente ({failure['error_class']})")
+        path, ct = '', ''
+    else:
+        path, ct = _refresh_locked(media_id, variant, explicit_src, tee, deadline or _lock_deadline())
+
+    if not path and entry and _is_within_stale_window(entry):
+        # stale-if-error: origem fora do ar / circuito aberto, serve o expirado
+        logger.warning(f"Falha ao atualizar {media_id}/{variant}, servindo cópia expirada: {entry['path']}")
+        return entry["path"], entry["content_type"]
+    return path, ct
+
+
+def _refresh_locked(media_id: str, variant: str, explicit_src: str | None, tee: bool, deadline: float,
+                    follow: bool = True):
+    fd, lock = _acquire_download_lock(media_id, variant, deadline)
+    try:
+        # outro fetcher (thread, worker ou warmup) pode ter baixado enquanto esperávamos
+        entry = _lookup_entry(media_id, variant)
+        if entry and _is_cache_fresh(entry):
+            _download_stats["coalesced"] += 1
+            logger.info(f"Baixado por outro fetcher enquanto esperava: {entry['path']}")
+            return entry["path"], entry["content_type"]
+        download = _live_download(media_id, variant) if follow else None
+        if download is None:
+            # a trava só cobre o início: o tee se registra no índice e a solta antes do primeiro byte
+            return _refresh_media(media_id, variant, explicit_src, entry, tee=tee)
+        if tee:
+            try:
+                follower = _FollowDownload(media_id, variant, download)
+            except FileNotFoundError:
+                pass  # o líder terminou entre a consulta e a abertura: consulta de novo abaixo
+            else:
+                _download_stats["followed"] += 1
+                return follower, follower.content_type
+    finally:
+        _release_download_lock(fd, lock)
+    _wait_download(media_id, variant, deadline)
+    entry = _lookup_entry(media_id, variant)
+    if entry and _is_cache_fresh(entry):
+        _download_stats["coalesced"] += 1
+        return entry["path"], entry["content_type"]
+    return _refresh_locked(media_id, variant, explicit_src, tee, deadline, follow=False)
+
+
 def ensure_media_cached(media_id: str, variant: str = "media", explicit_src: str | None = None) -> tuple[str, str]:
     logger.info(f"ensure_media_cached chamado: media_id={media_id}, variant={variant}")
+    return _ensure_media(media_id, variant, explicit_src, tee=False)
+
+
+def _tee_allowed() -> bool:
+    # com Range só dá para repassar o stream do CDN se o pedido começa do byte 0
+    rng = request.headers.get("Range", "").replace(" ", "")
+    return current_app.config['MEDIA_TEE_ENABLED'] and rng in ("", "bytes=0-")
+
+
+def _sparse_allowed() -> bool:
+    # seek (Range que o tee não atende): busca só os trechos pedidos
+    return current_app.config['MEDIA_SPARSE_ENABLED'] and bool(request.headers.get("Range")) and not _tee_allowed()
+
+
+def media_response(media_id: str, variant: str = "media", explicit_src: str | None = None) -> Response | None:
+    """
+    Resposta do media_proxy: do cache (streaming + Range) ou, num miss, em modo
+    tee direto do CDN enquanto grava. None se não foi possível obter a mídia.
+    """
+    logger.info(f"media_response chamado: media_id={media_id}, variant={variant}")
+    if not explicit_src:
+        hot = _hot_hit(media_id, variant)
+        if hot is not None:
+            return _serve_hot(hot)
+    path, ct = _ensure_media(media_id, variant, explicit_src, tee=_tee_allowed(), sparse=_sparse_allowed())
+    if isinstance(path, (_TeeDownload, _FollowDownload)):
+        return path.response()
+    if isinstance(path, _SparseMedia):
+        resp = path.response()
+        if resp is not None:
+            return resp
+        # promovido a blob (ou descartado) entre a consulta e a abertura
+        entry = _lookup_entry(media_id, variant)
+        path, ct = (entry["path"], entry["content_type"]) if entry else ('', '')
+    if not path:
+        return None
+    return _serve_cached(media_id, variant, path, ct)
+
+
+def _hot_hit(media_id: str, variant: str) -> dict | None:
+    """Entrada da camada quente dentro do TTL: o request não toca em arquivo nem no índice."""
+    hot = hot_media.get(media_id, variant)
+    if hot is None or not _is_cache_fresh(hot):
+        return None
+    if hot["generation"] != media_index.generation():
+        # drop/clear depois da promoção (talvez em outro worker): a entrada pode não existir mais
+        hot_media.forget(media_id, variant)
+        return None
+    media_evictor.record_access(media_id, variant)
+    media_index.record_hit(media_id, variant)  # acumulado em memória, gravado em lote
+    return hot
+
+
+def _serve_hot(hot: dict) -> Response:
+    # mesmo caminho do disco (304, Range, multipart), lendo dos bytes em memória
+    return _serve_open_file(io.BytesIO(hot["body"]), hot["path"], hot["content_type"],
+                            stat=(len(hot["body"]), hot["mtime"]), etag=hot["etag"])
+
+
+def _serve_cached(media_id: str, variant: str, path: str, ct: str) -> Response | None:
+    """Serve o arquivo do cache; se couber na camada quente, promove e serve da memória. None se sumiu."""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        # arquivo removido por fora (limpeza manual): esquece a linha, a próxima busca baixa de novo
+        logger.error(f"Arquivo não encontrado: {path}")
+        media_index.remove(media_id, variant)
+        hot_media.forget(media_id, variant)
+        return None
+    st = os.fstat(f.fileno())
+    if hot_media.admits(st.st_size):
+        generation = media_index.generation()  # antes da consulta: um drop no meio não fica para trás
+        entry = _lookup_entry(media_id, variant)
+        # só o que está fresco (stale-if-error não sobe) e ainda é o arquivo atual da chave
+        if entry and entry["path"] == path and _is_cache_fresh(entry):
+            with f:
+                body = f.read()
+            hot = hot_media.put(media_id, variant, body=body,
+                                content_type=_guess_content_type(path, ct),
+                                etag=_content_etag(path), mtime=int(st.st_mtime),
+                                validated_at=entry["validated_at"], path=path, generation=generation)
+            return _serve_hot(hot)
+    return _serve_open_file(f, path, ct, stat=(st.st_size, int(st.st_mtime)))
+
+
+def derivative_response(media_id: str, variant: str, width: int) -> Response | None:
+    """
+    media_proxy?w=: versão reduzida (largura configurada mais próxima) no formato
+    que o Accept aceita, gerada no pool de processos a partir do original em
+    cache e guardada como mais uma variante da mídia (<variant>-w<largura>-<fmt>).
+    None se não se aplica (sem Pillow, vídeo, falha): o chamador serve o original.
+    """
+    if not media_derivatives.enabled():
+        return None
+    target = media_derivatives.pick_width(width)
+    if not target:
+        return None
+    fmt = media_derivatives.negotiate_format(request.headers.get("Accept", ""))
+    dvariant = media_derivatives.derivative_variant(variant, target, fmt)
+    hot = _hot_hit(media_id, dvariant)
+    if hot is not None:
+        resp = _serve_hot(hot)
+        resp.headers["Vary"] = "Accept"
+        return resp
+    media_evictor.record_access(media_id, dvariant)
+
+    entry = _lookup_entry(media_id, dvariant)
+    if entry and _is_cache_fresh(entry):
+        media_index.record_hit(media_id, dvariant)
+    else:
+        refreshed = _refresh_derivative(media_id, variant, dvariant, target, fmt, entry)
+        if refreshed:
+            entry = refreshed
+        elif not (entry and _is_within_stale_window(entry)):
+            return None
+
+    resp = _serve_cached(media_id, dvariant, entry["path"], entry["content_type"])
+    if resp is None:
+        return None
+    resp.headers["Vary"] = "Accept"  # o formato depende do Accept do cliente
+    return resp
+
+
+def _refresh_derivative(media_id: str, variant: str, dvariant: str, width: int, fmt: str,
+                        entry: dict | None) -> dict | None:
+    """Derivado ausente ou expirado: confere o original (revalidado/baixado se preciso) e regera se ele mudou."""
+    if variant == "media":
+        try:
+            if (get_media_info(media_id).get("media_type") or "").upper() == "VIDEO":
+                return None  # não baixa o vídeo inteiro para descobrir que não é imagem
+        except Exception:
+            pass
+    deadline = _lock_deadline()  # vale para a trava do original e a do derivado
+    base_path, base_ct = _ensure_media(media_id, variant, None, tee=False, deadline=deadline)
+    base = _lookup_entry(media_id, variant)
+    if not base_path or not base or not (base_ct or "").startswith("image/"):
+        return None
+    source = f"derived:{variant}:{base['content_hash']}"
+    if entry and entry["source_url"] == source:
+        media_index.touch(media_id, dvariant, time.time())  # original igual: o derivado continua valendo
+        return entry
+
+    fd, lock = _acquire_download_lock(media_id, dvariant, deadline)
+    try:
+        entry = _lookup_entry(media_id, dvariant)
+        if entry and entry["source_url"] == source:
+            _download_stats["coalesced"] += 1
+            return entry
+        return _render_derivative(media_id, dvariant, base_path, width, fmt, source)
+    finally:
+        _release_download_lock(fd, lock)
+
+
+def _render_derivative(media_id: str, dvariant: str, base_path: str, width: int, fmt: str,
+                       source: str) -> dict | None:
+    fd, tmp_path = tempfile.mkstemp(dir=shard_dir(current_app.config['MEDIA_CACHE_DIR'], media_id),
+                                    prefix=f"{media_id}.{dvariant}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        size = media_derivatives.render(base_path, tmp_path, width, fmt)
+        entry = media_index.put(media_id, dvariant,
+                                src_path=tmp_path,
+                                ext=f".{fmt}",
+                                content_hash=_file_sha256(tmp_path),
+                                content_type=media_derivatives.CONTENT_TYPES[fmt],
+                                source_url=source)
+    except Exception as e:
+        logger.error(f"Erro ao gerar derivado {media_id}/{dvariant}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    hot_media.forget(media_id, dvariant)
+    media_evictor.record_write(media_id, dvariant)
+    logger.info(f"Derivado gerado: {media_id}/{dvariant} ({size[0]}x{size[1]}, {entry['size']} bytes)")
+    return entry
 
-    file_path, meta_path = _cache_paths(media_id, variant)
-    if os.path.exists(file_path) and _is_cache_fresh(file_path):
-        ct = _read_meta(meta_path)
-        logger.info(f"Cache fresco encontrado: {file_path}")
-        return file_path, ct
+
+def media_failure(media_id: str, variant: str = "media") -> dict | None:
+    """Falha recente (cache negativo) para a mídia/variante, se houver."""
+    return negative_cache.lookup("media", f"{media_id}:{variant}")
+
+
+def _source_url(info: dict, variant: str) -> str | None:
+    if variant == "thumb":
+        return info.get("thumbnail_url") or info.get("media_url")
+    return info.get("media_url") or info.get("thumbnail_url")
+
+
+def _refresh_media(media_id: str, variant: str, explicit_src: str | None,
+                   entry: dict | None, tee: bool = False, sparse: bool = False):
+    failure = media_failure(media_id, variant)
+    if failure:
+        logger.info(f"Cache negativo: {media_id}/{variant} falhou recentemente ({failure['error_class']})")
+        return '', ''
+
+    # Expirado: tenta revalidar na URL de origem guardada, sem consultar o Graph
+    # (se a assinatura da URL ainda vale: depois do "oe" o CDN só responde 403)
+    if (not explicit_src and entry
+            and entry.get("source_url") and _conditional_headers(entry)
+            and (entry.get("url_expires") or float("inf")) > time.time()):
+        try:
+            return _fetch_conditional(media_id, variant, entry["source_url"], entry, tee=tee)
+        except CircuitOpenError as e:
+            # CDN fora: URL nova não adianta; o chamador serve a cópia expirada (stale-if-error)
+            logger.warning(f"Revalidação de {media_id}/{variant} adiada: {e}")
+            return '', ''
+        except Exception as e:
+            # URLs do CDN são assinadas e expiram; cai para a busca de uma URL nova
+            logger.info(f"Revalidação na URL guardada falhou ({e}), buscando URL nova")
 
     if explicit_src:
         src = explicit_src
         logger.info(f"Usando src explícito: {src[:50]}...")
     else:
         try:
-            info = ig_get(media_id, fields="media_type,media_url,thumbnail_url")
+            info = get_media_info(media_id)
             logger.info(f"Info do Instagram: {info}")
         except Exception as e:
             logger.error(f"Erro ao buscar info do Instagram: {e}")
+            error_class = classify_error(e)
+            if error_class:
+                negative_cache.remember("media", f"{media_id}:{variant}", error_class, str(e))
             return '', ''
 
-        if variant == "thumb":
-            src = info.get("thumbnail_url") or info.get("media_url")
-        else:
-            src = info.get("media_url") or info.get("thumbnail_url")
+        src = _source_url(info, variant)
 
     if not src:
         logger.warning(f"Nenhuma URL disponível para {media_id}")
+        negative_cache.remember("media", f"{media_id}:{variant}", NOT_FOUND, "sem URL de mídia")
         return '', ''
 
     try:
-        logger.info(f"Baixando mídia: {src[:50]}...")
-        cdn = get(src, timeout=20, stream=True)
-        ct_header = cdn.headers.get('Content-Type', 'application/octet-stream')
-        logger.info(f"Content-Type recebido: {ct_header}")
-
-        file_path, meta_path = _cache_paths(media_id, variant, ct_header)
-        saved = _save_stream_to_file(cdn, file_path, current_app.config['MEDIA_CACHE_MAX_BYTES'])
-
-        if not saved:
-            logger.error(f"Falha ao salvar: {file_path}")
-            return '', ''
-
-        # Sniff + corrigir extensão e Content-Type
-        desired_ext, sniff_ct = _sniff_ext_ct(saved, ct_header)
-        logger.info(f"Detectado: ext={desired_ext}, ct={sniff_ct}")
-
-        fixed_path = _ensure_correct_extension(saved, desired_ext)
-        final_ct = sniff_ct or ct_header or 'application/octet-stream'
-
-        _write_meta(meta_path, final_ct)
-        os.utime(fixed_path, None)
-        logger.info(f"Mídia cacheada com sucesso: {fixed_path}")
-        return fixed_path, final_ct
+        return _fetch_conditional(media_id, variant, src, entry, tee=tee, sparse=sparse)
+    except CircuitOpenError as e:
+        # a URL não tem culpa: mantém o índice para quando o circuito fechar
+        logger.warning(f"Download de {media_id}/{variant} adiado: {e}")
+        return '', ''
     except Exception as e:
-        logger.error(f"Erro ao fazer cache de mídia: {e}", exc_info=True)
+        error_class = classify_error(e)
+        # 403/404 numa URL vinda do índice pode ser só assinatura expirada: não lembra,
+        # a próxima tentativa busca URL nova; tamanho e timeout não dependem da URL
+        if error_class and (explicit_src or error_class in (OVERSIZE, TIMEOUT)):
+            negative_cache.remember("media", f"{media_id}:{variant}", error_class, str(e))
+        logger.error(f"Erro ao fazer cache de mídia: {e}", exc_info=error_class is None)
+        if not explicit_src:
+            # a URL do índice pode ter expirado; a próxima tentativa consulta o Graph
+            forget_media_urls(media_id)
         return '', ''
 
 
@@ -227,100 +1199,339 @@ def _guess_content_type(path: str, provided: str | None) -> str:
     return guessed or "application/octet-stream"
 
 
-def serve_file_with_range(path: str, content_type: str | None = None):
-    logger.info(f"serve_file_with_range: {path}, ct={content_type}")
+# Leituras em blocos: memória constante por conexão, independente do tamanho do arquivo
+_STREAM_CHUNK = 64 * 1024
+# Acima disso o header Range é ignorado e o arquivo vai inteiro (evita abuso com milhares de partes)
+_MAX_RANGES = 16
+_RANGE_SPEC = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
 
-    if not os.path.exists(path):
-        logger.error(f"Arquivo não encontrado: {path}")
-        abort(404)
 
-    file_size = os.path.getsize(path)
-    range_header = request.headers.get("Range", "")
-    ct = _guess_content_type(path, content_type)
-
-    logger.info(f"Servindo: {path}, size={file_size}, ct={ct}, range={range_header}")
-
-    if not range_header:
-        try:
-            with open(path, "rb") as f:
-                data = f.read()
-            resp = Response(data, status=200, mimetype=ct)
-            resp.headers["Content-Length"] = str(file_size)
-            resp.headers["Accept-Ranges"] = "bytes"
-            resp.headers["Cache-Control"] = "public, max-age=3600"
-            return resp
-        except Exception as e:
-            logger.error(f"Erro ao ler arquivo: {e}")
-            abort(500)
-
-    m = re.match(r"bytes=(\d*)-(\d*)$", range_header.strip())
-    if not m:
-        resp = Response(status=416)
-        resp.headers["Content-Range"] = f"bytes */{file_size}"
-        return resp
-
-    start_s, end_s = m.groups()
-
-    try:
+def _parse_ranges(header: str, file_size: int) -> list[tuple[int, int]] | None:
+    """
+    Intervalos (start, end) satisfazíveis, ordenados e com sobreposições unidas.
+    [] = nenhum satisfazível (416); None = header inválido.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(","):
+        m = _RANGE_SPEC.match(part)
+        if not m:
+            return None
+        start_s, end_s = m.groups()
         if start_s == "" and end_s == "":
-            raise ValueError("empty range")
-
+            return None
         if start_s == "":  # bytes=-N
             suffix_len = int(end_s)
-            if suffix_len <= 0:
-                raise ValueError("invalid suffix length")
-            start = max(file_size - suffix_len, 0)
-            end = file_size - 1
+            if suffix_len <= 0 or file_size == 0:
+                continue
+            ranges.append((max(file_size - suffix_len, 0), file_size - 1))
         else:
             start = int(start_s)
+            if end_s != "" and int(end_s) < start:
+                return None
             if start >= file_size:
-                resp = Response(status=416)
-                resp.headers["Content-Range"] = f"bytes */{file_size}"
-                return resp
+                continue
             end = int(end_s) if end_s != "" else file_size - 1
+            ranges.append((start, min(end, file_size - 1)))
+
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
 
-        end = min(end, file_size - 1)
-        if start > end or start < 0:
-            raise ValueError("invalid range order")
 
-        length = end - start + 1
-    except Exception as e:
-        logger.error(f"Erro ao processar range: {e}")
-        resp = Response(status=416)
-        resp.headers["Content-Range"] = f"bytes */{file_size}"
-        return resp
+def _read_chunks(f, start: int, length: int):
+    f.seek(start)
+    remaining = length
+    while remaining > 0:
+        chunk = f.read(min(_STREAM_CHUNK, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
 
+def _iter_range(f, start: int, length: int):
     try:
-        with open(path, "rb") as f:
-            f.seek(start)
-            chunk = f.read(length)
+        yield from _read_chunks(f, start, length)
+    finally:
+        f.close()
+
+
+def _iter_multipart(f, parts: list[tuple[bytes, int, int]], closing: bytes):
+    try:
+        for header, start, length in parts:
+            yield header
+            yield from _read_chunks(f, start, length)
+        yield closing
+    finally:
+        f.close()
+
 
-        resp = Response(chunk, status=206, mimetype=ct)
+def _stream_body(f, start: int, length: int, file_size: int):
+    """
+    Corpo de f[start:start+length] sem carregar em memória. Usa wsgi.file_wrapper
+    (sendfile no gunicorn) quando o trecho vai até o fim do arquivo, ou no gunicorn,
+    que respeita posição do arquivo + Content-Length; senão, gerador em blocos.
+    """
+    environ = request.environ
+    if start + length == file_size or environ.get("SERVER_SOFTWARE", "").startswith("gunicorn"):
+        f.seek(start)
+        return wrap_file(environ, f, buffer_size=_STREAM_CHUNK)
+    return _iter_range(f, start, length)
+
+
+_BLOB_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _content_etag(path: str) -> str | None:
+    """ETag forte do blob: o nome é o sha256 do conteúdo (igual em todos os workers/pods)."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem[:32] if _BLOB_NAME.match(stem) else None
+
+
+def _not_modified(etag: str | None, mtime: int) -> bool:
+    # If-None-Match tem precedência; If-Modified-Since só vale sem ele (RFC 9110 13.2.2)
+    if request.headers.get("If-None-Match"):
+        return etag is not None and request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    return since is not None and mtime <= since.timestamp()
+
+
+def _if_range_matches(etag: str | None, mtime: int) -> bool:
+    """Sem If-Range, ou com validador igual ao atual: vale o Range. Senão, o arquivo mudou: vai inteiro."""
+    header = request.headers.get("If-Range", "").strip()
+    if not header:
+        return True
+    if_range = request.if_range
+    if if_range.date is not None:
+        return int(if_range.date.timestamp()) == mtime
+    # comparação forte: ETag fraco nunca casa
+    return etag is not None and not header.startswith("W/") and if_range.etag == etag
+
+
+def _set_validators(resp: Response, etag: str | None, mtime: int):
+    if etag:
+        resp.set_etag(etag)
+    resp.last_modified = mtime
+    resp.headers["Cache-Control"] = "public, max-age=3600"
+
+
+def _range_not_satisfiable(file_size: int) -> Response:
+    resp = Response(status=416)
+    resp.headers["Content-Range"] = f"bytes */{file_size}"
+    return resp
+
+
+def serve_file_with_range(path: str, content_type: str | None = None):
+    logger.info(f"serve_file_with_range: {path}, ct={content_type}")
+
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        logger.error(f"Arquivo não encontrado: {path}")
+        abort(404)
+
+    return _serve_open_file(f, path, content_type)
+
+
+def _serve_open_file(f, path: str, content_type: str | None,
+                     stat: tuple[int, int] | None = None, etag: str | None = None) -> Response:
+    # tamanho do arquivo aberto: um os.replace concorrente não muda o que servimos
+    if stat is None:
+        st = os.fstat(f.fileno())
+        stat = (st.st_size, int(st.st_mtime))
+    file_size, mtime = stat
+    etag = etag or _content_etag(path)
+    if _not_modified(etag, mtime):
+        f.close()
+        resp = Response(status=304)
+        _set_validators(resp, etag, mtime)
+        logger.info(f"Não modificado (304): {path}")
+        return resp
+    range_header = request.headers.get("Range", "") if _if_range_matches(etag, mtime) else ""
+    ct = _guess_content_type(path, content_type)
+
+    logger.info(f"Servindo: {path}, size={file_size}, ct={ct}, range={range_header}")
+
+    ranges = _parse_ranges(range_header, file_size) if range_header else None
+    if range_header and ranges is None:
+        logger.error(f"Range inválido: {range_header}")
+        f.close()
+        return _range_not_satisfiable(file_size)
+    if ranges == []:
+        f.close()
+        return _range_not_satisfiable(file_size)
+    if ranges and len(ranges) > _MAX_RANGES:
+        logger.warning(f"Range com {len(ranges)} partes, servindo arquivo inteiro")
+        ranges = None
+
+    if not ranges:
+        resp = Response(_stream_body(f, 0, file_size, file_size), status=200, mimetype=ct, direct_passthrough=True)
+        resp.headers["Content-Length"] = str(file_size)
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        length = end - start + 1
+        resp = Response(_stream_body(f, start, length, file_size), status=206, mimetype=ct, direct_passthrough=True)
         resp.headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
-        resp.headers["Accept-Ranges"] = "bytes"
         resp.headers["Content-Length"] = str(length)
-        resp.headers["Cache-Control"] = "public, max-age=3600"
         logger.info(f"Range enviado: {start}-{end}/{file_size}")
-        return resp
-    except Exception as e:
-        logger.error(f"Erro ao servir range: {e}")
-        abort(500)
+    else:
+        boundary = uuid.uuid4().hex
+        parts = [((f"\r\n--{boundary}\r\nContent-Type: {ct}\r\n"
+                   f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n").encode("latin-1"),
+                  start, end - start + 1)
+                 for start, end in ranges]
+        closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+        resp = Response(_iter_multipart(f, parts, closing), status=206, direct_passthrough=True,
+                        content_type=f"multipart/byteranges; boundary={boundary}")
+        resp.headers["Content-Length"] = str(sum(len(h) + n for h, _, n in parts) + len(closing))
+        logger.info(f"Multi-range enviado: {len(ranges)} partes de {file_size} bytes")
+
+    resp.headers["Accept-Ranges"] = "bytes"
+    _set_validators(resp, etag, mtime)
+    return resp
 
 
 # ---------- limpeza total ----------
 def clear_media_cache_all():
     d = current_app.config['MEDIA_CACHE_DIR']
+    negative_cache.clear()
+    media_evictor.reset()
     if not d or not os.path.isdir(d):
         logger.warning(f"Cache dir não existe ou não é diretório: {d}")
         return {"removed": 0}
+    media_index.clear()
+    hot_media.clear()
     removed = 0
+    for root, _dirs, files in os.walk(d):
+        if root == d:
+            continue  # na raiz fica só o banco do índice
+        for name in files:
+            try:
+                os.remove(os.path.join(root, name))
+                removed += 1
+            except Exception as e:
+                logger.error(f"Erro ao remover {name}: {e}")
+    logger.info(f"Cache limpo: {removed} arquivos removidos")
+    return {"removed": removed}
+
+
+def media_cache_stats() -> dict:
+    return {**media_index.stats(), "downloads": dict(_download_stats),
+            "eviction": media_evictor.stats(), "hot": hot_media.stats()}
+
+
+# ---------- índice no boot ----------
+def _migrate_flat_layout(d: str) -> int:
+    """Move arquivos do layout antigo (tudo na raiz de MEDIA_CACHE_DIR) para os subdiretórios."""
+    moved = 0
     for name in os.listdir(d):
+        src = os.path.join(d, name)
+        if not os.path.isfile(src) or name.endswith(".tmp") or name.startswith(INDEX_DB_NAME):
+            continue
+        media_id = name.split(".", 1)[0]
+        if not media_id:
+            continue
+        shard = shard_dir(d, media_id)
         try:
-            path = os.path.join(d, name)
-            os.remove(path)
-            removed += 1
-            logger.info(f"Removido: {name}")
+            os.makedirs(shard, exist_ok=True)
+            os.replace(src, os.path.join(shard, name))
+            moved += 1
+        except FileNotFoundError:
+            pass  # outro worker migrou primeiro
         except Exception as e:
-            logger.error(f"Erro ao remover {name}: {e}")
-    logger.info(f"Cache limpo: {removed} arquivos removidos")
-    return {"removed": removed}
\ No newline at end of file
+            logger.error(f"Erro ao migrar {name}: {e}")
+    return moved
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_STREAM_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _rebuild_index(d: str) -> tuple[int, int, int]:
+    """
+    Confere o índice com o disco: arquivos por chave de versões anteriores
+    (<shard>/<media_id>.<variant>.<ext>) viram blobs, importando o .meta antigo
+    se houver; linhas sem blob saem e blobs sem referência são apagados.
+    Devolve (importados, linhas removidas, blobs órfãos).
+    """
+    imported = 0
+    blobs_root = os.path.join(d, BLOBS_DIR)
+    for root, dirs, files in os.walk(d):
+        if root == d:
+            dirs[:] = [x for x in dirs if os.path.join(root, x) != blobs_root]
+            continue
+        for name in files:
+            if name.endswith(".part"):
+                media_id, _, variant = name[:-len(".part")].partition(".")
+                if media_index.get_partial(media_id, variant) is None:
+                    os.remove(os.path.join(root, name))  # download parcial sem linha no índice
+                continue
+            parsed = parse_cache_name(name)
+            if not parsed:
+                continue
+            media_id, variant, ext = parsed
+            path = os.path.join(root, name)
+            meta_path = os.path.join(root, f"{media_id}.{variant}.meta")
+            try:
+                st = os.stat(path)
+                entry = media_index.get(media_id, variant) or {}
+                meta = _read_legacy_meta(meta_path) if os.path.exists(meta_path) else entry
+                media_index.put(media_id, variant,
+                                src_path=path,
+                                ext=ext or '.bin',
+                                content_hash=_file_sha256(path),
+                                content_type=meta.get("content_type") or 'application/octet-stream',
+                                etag=meta.get("etag"),
+                                last_modified=meta.get("last_modified"),
+                                source_url=meta.get("source_url"),
+                                validated_at=entry.get("validated_at") or st.st_mtime,
+                                created_at=entry.get("created_at") or st.st_mtime)
+                imported += 1
+            except FileNotFoundError:
+                continue  # outro worker importou primeiro
+            try:
+                os.remove(meta_path)
+            except FileNotFoundError:
+                pass
+    return (imported, *media_index.reconcile())
+
+
+def init_media_cache(app):
+    """Cria o diretório, migra layouts antigos e reconcilia o índice SQLite com o disco."""
+    d = app.config['MEDIA_CACHE_DIR']
+    os.makedirs(d, exist_ok=True)
+    moved = _migrate_flat_layout(d)
+    if moved:
+        logger.info(f"Cache de mídia migrado para subdiretórios: {moved} arquivos")
+
+    media_index.open(d)
+    imported, dropped, orphans = _rebuild_index(d)
+    logger.info(f"Índice do cache de mídia: {len(media_index)} chaves "
+                f"({imported} importadas do layout antigo, {dropped} sem blob removidas, "
+                f"{orphans} blobs órfãos apagados)")
+
+    lock_timeout = app.config['MEDIA_DOWNLOAD_LOCK_TIMEOUT_SECONDS']
+    if lock_timeout >= app.config['GUNICORN_TIMEOUT'] / 2:
+        app.config['MEDIA_DOWNLOAD_LOCK_TIMEOUT_SECONDS'] = app.config['GUNICORN_TIMEOUT'] / 3
+        logger.warning(f"MEDIA_DOWNLOAD_LOCK_TIMEOUT_SECONDS={lock_timeout} perto do --timeout do gunicorn "
+                       f"({app.config['GUNICORN_TIMEOUT']}s), usando {app.config['MEDIA_DOWNLOAD_LOCK_TIMEOUT_SECONDS']:.0f}s")
+
+    if app.config['MEDIA_DERIVATIVES_ENABLED'] and media_derivatives.Image is None:
+        logger.warning("MEDIA_DERIVATIVES_ENABLED=1 mas o Pillow não está instalado: "
+                       "sem srcset no /posts e o ?w= serve o original")
+    if app.config['MEDIA_PLACEHOLDERS_ENABLED'] and media_derivatives.Image is None:
+        logger.warning("MEDIA_PLACEHOLDERS_ENABLED=1 mas o Pillow não está instalado: "
+                       "placeholder/dominantColor ficam null no /posts")
+
+    media_evictor.configure(app.config)
@@ -0,0 +1,141 @@
+import io
+import os
+import base64
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+
+try:
+    from PIL import Image, ImageOps, features  # opcional: sem Pillow, o media_proxy serve só os originais
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+_SAVE_OPTIONS = {
+    "avif": {"format": "AVIF", "speed": 8},
+    "webp": {"format": "WEBP", "method": 4},
+    "jpeg": {"format": "JPEG", "optimize": True, "progressive": True},
+}
+
+# Pool de processos para a codificação (CPU pesada fora do GIL dos workers gunicorn)
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return Image is not None and current_app.config['MEDIA_DERIVATIVES_ENABLED']
+
+
+def widths() -> list[int]:
+    return sorted({int(w) for w in current_app.config['MEDIA_DERIVATIVE_WIDTHS'].split(",") if w.strip().isdigit()})
+
+
+def placeholders_enabled() -> bool:
+    return Image is not None and current_app.config['MEDIA_PLACEHOLDERS_ENABLED']
+
+
+def formats() -> list[str]:
+    """Formatos configurados que o Pillow instalado sabe gravar; JPEG sempre fica como último recurso."""
+    configured = [f.strip().lower() for f in current_app.config['MEDIA_DERIVATIVE_FORMATS'].split(",")]
+    return [f for f in configured if f in ("avif", "webp") and features.check(f)] + ["jpeg"]
+
+
+def pick_width(requested: int) -> int | None:
+    """Menor largura configurada que cobre o pedido (ou a maior, se o pedido passar de todas)."""
+    options = widths()
+    if not options or requested <= 0:
+        return None
+    return next((w for w in options if w >= requested), options[-1])
+
+
+def negotiate_format(accept: str) -> str:
+    """Primeiro formato (na ordem de MEDIA_DERIVATIVE_FORMATS) que o Accept do cliente aceita."""
+    accepted = set()
+    for part in accept.split(","):
+        name, _, params = part.strip().partition(";")
+        try:
+            q = float(params.split("q=", 1)[1]) if "q=" in params else 1.0
+        except ValueError:
+            q = 1.0
+        if q > 0:
+            accepted.add(name.strip().lower())
+    for fmt in formats():
+        if CONTENT_TYPES[fmt] in accepted:
+            return fmt
+    return "jpeg"
+
+
+def derivative_variant(base_variant: str, width: int, fmt: str) -> str:
+    """Chave no índice ao lado de media/thumb: 'thumb-w320-webp' (sem ponto, como as demais variantes)."""
+    return f"{base_variant}-w{width}-{fmt}"
+
+
+def _render(src: str, dst: str, width: int, fmt: str, quality: int) -> tuple[int, int]:
+    # roda no processo do pool: só recebe/devolve tipos simples
+    with Image.open(src) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.width > width:
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+        if fmt == "jpeg" or img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB" if fmt == "jpeg" or "A" not in img.getbands() else "RGBA")
+        img.save(dst, quality=quality, **_SAVE_OPTIONS[fmt])
+        return img.width, img.height
+
+
+def _placeholder(src: str, width: int) -> tuple[str, str]:
+    # roda no processo do pool: LQIP em data URI + cor dominante (#rrggbb)
+    with Image.open(src) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        # cor mais frequente numa paleta de 5 (a média puxaria para um cinza que não está na foto)
+        small = img.resize((64, 64))
+        quantized = small.quantize(colors=5)
+        index = max(quantized.getcolors(), key=lambda c: c[0])[1]
+        r, g, b = quantized.getpalette()[index * 3:index * 3 + 3]
+        lqip = img.resize((width, max(1, round(img.height * width / img.width))), Image.BILINEAR)
+        fmt = "webp" if features.check("webp") else "jpeg"
+        buf = io.BytesIO()
+        lqip.save(buf, format=fmt.upper(), quality=30)
+    return f"data:image/{fmt};base64,{base64.b64encode(buf.getvalue()).decode('ascii')}", f"#{r:02x}{g:02x}{b:02x}"
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool, _pool_pid
+    with _pool_lock:
+        # pool herdado de um fork (gunicorn --preload) não tem os processos filhos
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(
+                max_workers=current_app.config['MEDIA_DERIVATIVE_WORKERS'],
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+            _pool_pid = os.getpid()
+            logger.info(f"Pool de derivados iniciado ({current_app.config['MEDIA_DERIVATIVE_WORKERS']} processos)")
+        return _pool
+
+
+def _run(fn, *args):
+    global _pool
+    pool = _get_pool()
+    try:
+        return pool.submit(fn, *args).result(timeout=current_app.config['MEDIA_DERIVATIVE_TIMEOUT_SECONDS'])
+    except BrokenProcessPool:
+        # processo do pool morreu (OOM, imagem patológica): o próximo uso cria outro
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise
+
+
+def render(src: str, dst: str, width: int, fmt: str) -> tuple[int, int]:
+    """Reduz src para a largura (sem ampliar) e grava dst no formato; devolve as dimensões finais."""
+    return _run(_render, src, dst, width, fmt, current_app.config['MEDIA_DERIVATIVE_QUALITY'])
+
+
+def placeholder(src: str) -> tuple[str, str]:
+    """(data URI de poucas centenas de bytes, cor dominante) para o primeiro paint do widget."""
+    return _run(_placeholder, src, current_app.config['MEDIA_PLACEHOLDER_WIDTH'])
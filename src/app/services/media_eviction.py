@@ -0,0 +1,245 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from .media_index import media_index, try_lock, unlock
+from .media_hot import hot_media
+
+logger = logging.getLogger(__name__)
+
+LRU = "lru"
+TINYLFU = "tinylfu"
+
+# .tmp mais velho que isso é sobra de download interrompido (worker morto no meio)
+_ORPHAN_TMP_SECONDS = 3600
+
+
+class FrequencySketch:
+    """
+    Count-Min sketch com contadores de 4 bits (teto 15) e envelhecimento:
+    a cada `sample` incrementos todos os contadores caem pela metade, para
+    que popularidade antiga não valha para sempre (TinyLFU).
+    """
+
+    def __init__(self, width: int = 4096, depth: int = 4):
+        self._mask = width - 1  # width precisa ser potência de 2
+        self._rows = [bytearray(width) for _ in range(depth)]
+        self._sample = width * 10
+        self._additions = 0
+
+    def _slots(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=4 * len(self._rows)).digest()
+        for i, row in enumerate(self._rows):
+            yield row, int.from_bytes(digest[i * 4:(i + 1) * 4], "little") & self._mask
+
+    def increment(self, key: str):
+        for row, idx in self._slots(key):
+            if row[idx] < 15:
+                row[idx] += 1
+        self._additions += 1
+        if self._additions >= self._sample:
+            self._rows = [bytearray(b >> 1 for b in row) for row in self._rows]
+            self._additions //= 2
+
+    def frequency(self, key: str) -> int:
+        return min(row[idx] for row, idx in self._slots(key))
+
+
+class MediaEvictor:
+    """
+    Mantém MEDIA_CACHE_DIR dentro de MEDIA_CACHE_DISK_BUDGET_BYTES, downloads em
+    andamento incluídos: cada slot de download (MEDIA_CACHE_DOWNLOAD_SLOTS) reserva
+    MEDIA_CACHE_MAX_BYTES, e o conteúdo já gravado fica abaixo de orçamento - reserva.
+
+    Requests só registram acessos/escritas (O(1)); a varredura do disco e as
+    remoções rodam numa thread de fundo, acordada a cada escrita e a cada
+    MEDIA_CACHE_EVICTION_INTERVAL_SECONDS (pega também o que o outro worker gravou).
+
+    Política "lru": remove pelo acesso mais antigo.
+    Política "tinylfu": arquivos gravados desde a última varredura ficam em
+    observação; com o orçamento estourado, cada um só fica se for mais
+    frequente que a vítima LRU, senão ele mesmo sai (acessos únicos não
+    expulsam thumbnails populares).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._sketch = FrequencySketch()
+        self._last_access: dict[str, float] = {}
+        self._probation: set[str] = set()
+        self._cfg = {"dir": None, "budget": 0, "reserve": 0, "policy": TINYLFU, "target_ratio": 0.9,
+                     "interval": 60.0}
+        self._stats = {"runs": 0, "evicted_files": 0, "evicted_bytes": 0, "rejected": 0, "disk_bytes": 0,
+                       "in_flight_bytes": 0}
+
+    def configure(self, cfg):
+        policy = cfg['MEDIA_CACHE_EVICTION_POLICY']
+        if policy not in (LRU, TINYLFU):
+            logger.warning(f"MEDIA_CACHE_EVICTION_POLICY inválida ({policy}), usando {TINYLFU}")
+            policy = TINYLFU
+        reserve = cfg['MEDIA_CACHE_DOWNLOAD_SLOTS'] * cfg['MEDIA_CACHE_MAX_BYTES']
+        if cfg['MEDIA_CACHE_DISK_BUDGET_BYTES'] > 0 and reserve >= cfg['MEDIA_CACHE_DISK_BUDGET_BYTES']:
+            logger.warning(f"Reserva de downloads ({reserve} bytes) não cabe no orçamento de disco "
+                           f"({cfg['MEDIA_CACHE_DISK_BUDGET_BYTES']} bytes): o cache de mídia não vai reter nada")
+        self._cfg = {
+            "dir": cfg['MEDIA_CACHE_DIR'],
+            "budget": cfg['MEDIA_CACHE_DISK_BUDGET_BYTES'],
+            "reserve": reserve,
+            "policy": policy,
+            "target_ratio": cfg['MEDIA_CACHE_EVICTION_TARGET_RATIO'],
+            "interval": cfg['MEDIA_CACHE_EVICTION_INTERVAL_SECONDS'],
+        }
+
+    def _ensure_thread(self):
+        # iniciada sob demanda: cada worker gunicorn (fork) precisa da sua
+        if self._cfg["budget"] <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="media-evictor", daemon=True)
+            self._thread.start()
+
+    def record_access(self, media_id: str, variant: str):
+        key = f"{media_id}:{variant}"
+        with self._lock:
+            self._sketch.increment(key)
+            self._last_access[key] = time.time()
+        self._ensure_thread()
+
+    def record_write(self, media_id: str, variant: str):
+        key = f"{media_id}:{variant}"
+        with self._lock:
+            self._probation.add(key)
+            self._last_access[key] = time.time()
+        self._ensure_thread()
+        self._wake.set()
+
+    def reset(self):
+        with self._lock:
+            self._last_access.clear()
+            self._probation.clear()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self._cfg["interval"])
+            self._wake.clear()
+            try:
+                self.enforce()
+            except Exception as e:
+                logger.error(f"Erro na evicção do cache de mídia: {e}")
+
+    def _scan(self, d: str) -> tuple[int, int]:
+        """
+        (bytes já gravados: blobs, parciais, índice, legado; bytes de .tmp em andamento).
+        Apaga .tmp órfãos e .lock que ninguém está segurando (sobra de worker morto).
+        """
+        total = in_flight = 0
+        for root, _dirs, names in os.walk(d):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith(".lock"):
+                    fd = try_lock(path)
+                    if fd is not None:
+                        unlock(fd, path)
+                    continue
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith(".tmp") and time.time() - st.st_mtime > _ORPHAN_TMP_SECONDS:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                size = min(st.st_size, st.st_blocks * 512)  # .part esparso: só o já gravado
+                if name.endswith(".tmp"):
+                    in_flight += size  # já coberto pela reserva dos slots de download
+                else:
+                    total += size
+        return total, in_flight
+
+    def _evict(self, key: str) -> int:
+        """Remove a chave do índice; só libera bytes se era a última referência ao blob."""
+        media_id, _, variant = key.partition(":")
+        freed = sum(row["freed"] for row in media_index.remove(media_id, variant))
+        hot_media.forget(media_id, variant)
+        with self._lock:
+            self._last_access.pop(key, None)
+        self._stats["evicted_files"] += 1
+        self._stats["evicted_bytes"] += freed
+        return freed
+
+    def enforce(self):
+        cfg = self._cfg
+        if not cfg["dir"] or cfg["budget"] <= 0:
+            return
+        total, in_flight = self._scan(cfg["dir"])
+        self._stats["runs"] += 1
+        self._stats["in_flight_bytes"] = in_flight
+        limit = max(cfg["budget"] - cfg["reserve"], 0)
+        files = media_index.entries()
+        with self._lock:
+            probation = self._probation & files.keys()
+            self._probation = set()
+            last_access = dict(self._last_access)
+            for key in [k for k in self._last_access if k not in files]:
+                self._last_access.pop(key, None)
+        if total <= limit:
+            self._stats["disk_bytes"] = total
+            return
+
+        target = limit * cfg["target_ratio"]
+        before = total
+        # acessos de todos os workers (índice compartilhado) + os ainda não gravados deste
+        for key, item in files.items():
+            last_access[key] = max(item["last_access"] or 0.0, last_access.get(key, 0.0))
+        lru = sorted(files, key=lambda k: last_access[k])
+
+        if cfg["policy"] == TINYLFU and probation:
+            victims = iter([k for k in lru if k not in probation])
+            # candidato mais recente primeiro: é o que tem menos histórico
+            for cand in sorted(probation, key=lambda k: last_access.get(k, 0), reverse=True):
+                if total <= target:
+                    break
+                victim = next(victims, None)
+                if victim is None:
+                    break
+                with self._lock:
+                    admit = self._sketch.frequency(cand) > self._sketch.frequency(victim)
+                if admit:
+                    files.pop(victim)
+                    total -= self._evict(victim)
+                else:
+                    files.pop(cand)
+                    total -= self._evict(cand)
+                    self._stats["rejected"] += 1
+                    victims = iter([victim] + list(victims))  # a vítima não saiu, continua na fila
+
+        if cfg["policy"] == TINYLFU:
+            # o que ainda faltar sai pelo menos frequente (desempate pelo LRU)
+            with self._lock:
+                freq = {k: self._sketch.frequency(k) for k in files}
+            lru = sorted(files, key=lambda k: (freq[k], last_access[k]))
+
+        for key in lru:
+            if total <= target:
+                break
+            files.pop(key)
+            total -= self._evict(key)
+
+        self._stats["disk_bytes"] = total
+        logger.info(f"Evicção ({cfg['policy']}): {before} -> {total} bytes "
+                    f"(orçamento {cfg['budget']}, reserva de downloads {cfg['reserve']})")
+
+    def stats(self) -> dict:
+        return {**self._stats, "policy": self._cfg["policy"], "budget_bytes": self._cfg["budget"],
+                "reserved_bytes": self._cfg["reserve"],
+                "tracked_keys": len(self._last_access)}
+
+
+media_evictor = MediaEvictor()
@@ -0,0 +1,83 @@
+import logging
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+class HotMediaTier:
+    """
+    Camada quente do cache de mídia, em memória e por worker: bytes + content
+    type + validadores de objetos pequenos (até MEDIA_HOT_MAX_OBJECT_BYTES),
+    limitada em MEDIA_HOT_MAX_BYTES no total, com LRU. Um hit aqui não abre
+    arquivo nem consulta o índice (só compara a geração, relida no máximo uma
+    vez por segundo, para enxergar drop/clear feitos em outro worker).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[str, str], dict] = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def admits(self, size: int) -> bool:
+        cfg = current_app.config
+        return 0 < size <= min(cfg['MEDIA_HOT_MAX_OBJECT_BYTES'], cfg['MEDIA_HOT_MAX_BYTES'])
+
+    def get(self, media_id: str, variant: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get((media_id, variant))
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end((media_id, variant))
+            self._hits += 1
+            return entry
+
+    def put(self, media_id: str, variant: str, *, body: bytes, content_type: str, etag: str | None,
+            mtime: int, validated_at: float, path: str, generation: int) -> dict | None:
+        if not self.admits(len(body)):
+            return None
+        budget = current_app.config['MEDIA_HOT_MAX_BYTES']
+        with self._lock:
+            old = self._entries.pop((media_id, variant), None)
+            if old is not None:
+                self._bytes -= len(old["body"])
+            entry = self._entries[(media_id, variant)] = {
+                "body": body,
+                "content_type": content_type,
+                "etag": etag,
+                "mtime": mtime,
+                "validated_at": validated_at,
+                "path": path,
+                "generation": generation,
+            }
+            self._bytes += len(body)
+            while self._bytes > budget:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted["body"])
+        return entry
+
+    def forget(self, media_id: str, variant: str | None = None):
+        with self._lock:
+            keys = ([(media_id, variant)] if variant is not None
+                    else [k for k in self._entries if k[0] == media_id])
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._bytes -= len(entry["body"])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes,
+                    "hits": self._hits, "misses": self._misses}
+
+
+hot_media = HotMediaTier()
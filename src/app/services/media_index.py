@@ -0,0 +1,541 @@
+import os
+import time
+import fcntl
+import hashlib
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+INDEX_DB_NAME = "media-index.sqlite3"
+BLOBS_DIR = "blobs"
+
+_COLUMNS = ("media_id", "variant", "path", "size", "content_type", "etag", "last_modified",
+            "source_url", "url_expires", "content_hash", "created_at", "validated_at",
+            "last_access", "hits")
+
+_PARTIAL_COLUMNS = ("media_id", "variant", "path", "size", "chunk_size", "bitmap", "content_type",
+                    "etag", "last_modified", "source_url", "created_at", "last_access")
+
+# hits/last_access são acumulados em memória e gravados em lote (não escreve no SQLite a cada hit)
+_ACCESS_FLUSH_SECONDS = 5.0
+_ACCESS_FLUSH_MAX = 200
+
+# a geração (contador de drop/clear) é relida do SQLite no máximo a cada intervalo, não a cada hit
+_GENERATION_CHECK_SECONDS = 1.0
+
+
+def shard_dir(cache_dir: str, media_id: str) -> str:
+    """Subdiretório do media_id: <cache_dir>/ab, com ab vindo do hash do id (256 subdiretórios)."""
+    h = hashlib.md5(media_id.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, h[:2])
+
+
+def blob_path(cache_dir: str, content_hash: str, ext: str) -> str:
+    """Blob endereçado pelo conteúdo: <cache_dir>/blobs/ab/<sha256><ext>."""
+    return os.path.join(cache_dir, BLOBS_DIR, content_hash[:2], f"{content_hash}{ext}")
+
+
+def parse_cache_name(name: str) -> tuple[str, str, str] | None:
+    """'<media_id>.<variant><.ext>' -> (media_id, variant, ext); None para .meta/.tmp/.lock/.part/outros."""
+    if name.endswith((".meta", ".tmp", ".lock", ".part")) or name.startswith("."):
+        return None
+    parts = name.split(".", 2)
+    if len(parts) < 2 or not parts[0] or not parts[1]:
+        return None
+    ext = f".{parts[2]}" if len(parts) == 3 else ""
+    return parts[0], parts[1], ext
+
+
+def partial_path(cache_dir: str, media_id: str, variant: str) -> str:
+    """Arquivo esparso de um download parcial: <shard>/<media_id>.<variant>.part."""
+    return os.path.join(shard_dir(cache_dir, media_id), f"{media_id}.{variant}.part")
+
+
+def lock_path(cache_dir: str, media_id: str, variant: str) -> str:
+    """Trava de download/promoção da chave: <shard>/<media_id>.<variant>.lock."""
+    return os.path.join(shard_dir(cache_dir, media_id), f"{media_id}.{variant}.lock")
+
+
+def try_lock(path: str) -> int | None:
+    """
+    flock exclusivo não bloqueante em path; fd travado, ou None se outro processo
+    já tem a trava. O dono apaga o .lock ao liberar (unlock): se o arquivo travado
+    não é mais o que está no diretório, a trava não exclui ninguém e é refeita.
+    """
+    while True:
+        fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        try:
+            current = os.stat(path).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            current = False
+        if current:
+            return fd
+        os.close(fd)
+
+
+def unlock(fd: int, path: str):
+    """Apaga o .lock (ainda travado, para ninguém herdar um arquivo órfão) e libera a trava."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def chunk_count(size: int, chunk_size: int) -> int:
+    return (size + chunk_size - 1) // chunk_size
+
+
+def has_chunk(bitmap: bytes, i: int) -> bool:
+    return bool(bitmap[i >> 3] & (1 << (i & 7)))
+
+
+def allocated_size(path: str) -> int:
+    """Bytes ocupados no disco: num arquivo esparso, só os trechos já gravados."""
+    st = os.stat(path)
+    return min(st.st_size, st.st_blocks * 512)
+
+
+def url_expiry(url: str | None) -> float | None:
+    """Validade de URL assinada do CDN do Instagram (parâmetro oe, timestamp em hex)."""
+    if not url:
+        return None
+    oe = parse_qs(urlparse(url).query).get("oe")
+    try:
+        return float(int(oe[0], 16)) if oe else None
+    except ValueError:
+        return None
+
+
+class MediaIndex:
+    """
+    Metadados do cache de mídia num SQLite (WAL) dentro de MEDIA_CACHE_DIR,
+    compartilhado pelos workers do pod: (media_id, variant) -> path, size,
+    content_type, validadores da origem, source_url, url_expires, content_hash,
+    created_at, validated_at (base do TTL), last_access e hits.
+
+    Os bytes ficam em blobs endereçados pelo sha256 (tabela blobs, com contagem
+    de referências): chaves com o mesmo conteúdo (thumb == media, filhos de
+    carrossel repostados) apontam para o mesmo arquivo. Ligar e soltar blobs
+    acontece dentro de BEGIN IMMEDIATE, serializado entre os workers.
+
+    Vídeos grandes pedidos com Range ficam em downloads parciais (tabela
+    partials): arquivo esparso do tamanho final + bitmap dos trechos
+    (chunk_size) já gravados; completo, vira blob e linha em media.
+
+    Um hit é uma leitura pela chave primária; a tabela é reconstruída a partir
+    do disco no boot (init_media_cache).
+
+    drop/clear incrementam a geração (tabela meta): a camada quente de cada
+    worker guarda a geração em que promoveu a entrada e a descarta quando ela
+    muda, mesmo que a invalidação tenha vindo de outro worker.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.cache_dir: str | None = None
+        self.path: str | None = None
+        self._pending: dict[tuple[str, str], list] = {}
+        self._last_flush = time.monotonic()
+        self._generation = 0
+        self._generation_checked = float("-inf")
+
+    def open(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, INDEX_DB_NAME)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS media ("
+            " media_id TEXT NOT NULL, variant TEXT NOT NULL, path TEXT NOT NULL,"
+            " size INTEGER NOT NULL, content_type TEXT NOT NULL, etag TEXT, last_modified TEXT,"
+            " source_url TEXT, url_expires REAL, content_hash TEXT,"
+            " created_at REAL NOT NULL, validated_at REAL NOT NULL,"
+            " last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (media_id, variant))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            " hash TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL,"
+            " refs INTEGER NOT NULL, placeholder TEXT, color TEXT)"
+        )
+        # bancos criados antes dos placeholders
+        blob_columns = {row[1] for row in conn.execute("PRAGMA table_info(blobs)")}
+        for column in ("placeholder", "color"):
+            if column not in blob_columns:
+                try:
+                    conn.execute(f"ALTER TABLE blobs ADD COLUMN {column} TEXT")
+                except sqlite3.OperationalError:
+                    pass  # o outro worker migrou primeiro
+        conn.execute("CREATE INDEX IF NOT EXISTS media_hash ON media(content_hash)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS partials ("
+            " media_id TEXT NOT NULL, variant TEXT NOT NULL, path TEXT NOT NULL,"
+            " size INTEGER NOT NULL, chunk_size INTEGER NOT NULL, bitmap BLOB NOT NULL,"
+            " content_type TEXT NOT NULL, etag TEXT, last_modified TEXT, source_url TEXT,"
+            " created_at REAL NOT NULL, last_access REAL NOT NULL,"
+            " PRIMARY KEY (media_id, variant))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS downloads ("
+            " media_id TEXT NOT NULL, variant TEXT NOT NULL, path TEXT NOT NULL,"
+            " length INTEGER, content_type TEXT NOT NULL, started_at REAL NOT NULL,"
+            " PRIMARY KEY (media_id, variant))"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # conexão herdada de um fork (gunicorn --preload) não pode ser reutilizada
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write_txn(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _release_blob(self, conn, content_hash: str | None) -> int:
+        """Solta uma referência; sem referências, remove o blob. Devolve os bytes liberados."""
+        if not content_hash:
+            return 0
+        conn.execute("UPDATE blobs SET refs = refs - 1 WHERE hash = ?", (content_hash,))
+        row = conn.execute("SELECT path, size, refs FROM blobs WHERE hash = ?", (content_hash,)).fetchone()
+        if row is None or row[2] > 0:
+            return 0
+        conn.execute("DELETE FROM blobs WHERE hash = ?", (content_hash,))
+        try:
+            os.remove(os.path.join(self.cache_dir, row[0]))
+        except FileNotFoundError:
+            pass
+        return row[1]
+
+    def _row(self, row) -> dict | None:
+        if row is None:
+            return None
+        entry = dict(zip(_COLUMNS, row))
+        entry["path"] = os.path.join(self.cache_dir, entry["path"])
+        return entry
+
+    def get(self, media_id: str, variant: str) -> dict | None:
+        row = self._conn().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM media WHERE media_id = ? AND variant = ?",
+            (media_id, variant)).fetchone()
+        return self._row(row)
+
+    def put(self, media_id: str, variant: str, *, src_path: str, ext: str, content_hash: str,
+            content_type: str, etag: str | None = None, last_modified: str | None = None,
+            source_url: str | None = None, validated_at: float | None = None,
+            created_at: float | None = None) -> dict:
+        """
+        Liga (media_id, variant) ao blob do conteúdo. src_path (.tmp completo) vira
+        o blob se ele ainda não existe; se já existe, é descartado (deduplicado).
+        O blob anterior da chave perde uma referência. hits/last_access são mantidos.
+        """
+        now = time.time()
+        size = os.path.getsize(src_path)
+        with self._write_txn() as conn:
+            blob = conn.execute("SELECT path FROM blobs WHERE hash = ?", (content_hash,)).fetchone()
+            if blob and os.path.exists(os.path.join(self.cache_dir, blob[0])):
+                rel = blob[0]
+                os.remove(src_path)
+            else:
+                target = blob_path(self.cache_dir, content_hash, ext)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(src_path, target)
+                rel = os.path.relpath(target, self.cache_dir)
+                conn.execute("INSERT INTO blobs (hash, path, size, refs) VALUES (?, ?, ?, 0)"
+                             " ON CONFLICT (hash) DO UPDATE SET path = excluded.path, size = excluded.size",
+                             (content_hash, rel, size))
+
+            old = conn.execute("SELECT content_hash FROM media WHERE media_id = ? AND variant = ?",
+                               (media_id, variant)).fetchone()
+            conn.execute(
+                "INSERT INTO media (media_id, variant, path, size, content_type, etag, last_modified,"
+                " source_url, url_expires, content_hash, created_at, validated_at, last_access, hits)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)"
+                " ON CONFLICT (media_id, variant) DO UPDATE SET"
+                " path = excluded.path, size = excluded.size, content_type = excluded.content_type,"
+                " etag = excluded.etag, last_modified = excluded.last_modified,"
+                " source_url = excluded.source_url, url_expires = excluded.url_expires,"
+                " content_hash = excluded.content_hash, created_at = excluded.created_at,"
+                " validated_at = excluded.validated_at",
+                (media_id, variant, rel, size, content_type or 'application/octet-stream', etag,
+                 last_modified, source_url, url_expiry(source_url), content_hash,
+                 created_at or now, validated_at or now, now))
+            if not old or old[0] != content_hash:
+                conn.execute("UPDATE blobs SET refs = refs + 1 WHERE hash = ?", (content_hash,))
+                self._release_blob(conn, old[0] if old else None)
+        return self.get(media_id, variant)
+
+    def get_placeholder(self, content_hash: str) -> tuple[str, str] | None:
+        row = self._conn().execute("SELECT placeholder, color FROM blobs WHERE hash = ? AND placeholder IS NOT NULL",
+                                   (content_hash,)).fetchone()
+        return tuple(row) if row else None
+
+    def set_placeholder(self, content_hash: str, placeholder: str, color: str):
+        """Placeholder é do conteúdo: fica no blob e vale para todas as chaves que apontam para ele."""
+        self._conn().execute("UPDATE blobs SET placeholder = ?, color = ? WHERE hash = ?",
+                             (placeholder, color, content_hash))
+
+    def placeholders(self, media_ids: list[str]) -> dict[tuple[str, str], tuple[str, str]]:
+        """(media_id, variant) -> (placeholder, cor) das mídias em cache que já têm placeholder."""
+        found = {}
+        ids = list(dict.fromkeys(media_ids))
+        for i in range(0, len(ids), 500):  # limite de parâmetros do SQLite
+            batch = ids[i:i + 500]
+            rows = self._conn().execute(
+                "SELECT m.media_id, m.variant, b.placeholder, b.color FROM media m"
+                " JOIN blobs b ON b.hash = m.content_hash"
+                f" WHERE m.media_id IN ({', '.join('?' * len(batch))}) AND b.placeholder IS NOT NULL",
+                batch).fetchall()
+            found.update({(mid, variant): (ph, color) for mid, variant, ph, color in rows})
+        return found
+
+    def touch(self, media_id: str, variant: str, validated_at: float):
+        """304 da origem: renova só o TTL."""
+        self._conn().execute("UPDATE media SET validated_at = ? WHERE media_id = ? AND variant = ?",
+                             (validated_at, media_id, variant))
+
+    def record_hit(self, media_id: str, variant: str):
+        with self._lock:
+            pending = self._pending.setdefault((media_id, variant), [0, 0.0])
+            pending[0] += 1
+            pending[1] = time.time()
+            due = (len(self._pending) >= _ACCESS_FLUSH_MAX
+                   or time.monotonic() - self._last_flush >= _ACCESS_FLUSH_SECONDS)
+        if due:
+            self.flush_access()
+
+    def flush_access(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            self._conn().executemany(
+                "UPDATE media SET hits = hits + ?, last_access = MAX(last_access, ?)"
+                " WHERE media_id = ? AND variant = ?",
+                [(hits, ts, mid, variant) for (mid, variant), (hits, ts) in pending.items()])
+        except sqlite3.Error as e:
+            logger.warning(f"Falha ao gravar acessos do cache de mídia: {e}")
+
+    def get_partial(self, media_id: str, variant: str) -> dict | None:
+        row = self._conn().execute(
+            f"SELECT {', '.join(_PARTIAL_COLUMNS)} FROM partials WHERE media_id = ? AND variant = ?",
+            (media_id, variant)).fetchone()
+        if row is None:
+            return None
+        partial = dict(zip(_PARTIAL_COLUMNS, row))
+        partial["path"] = os.path.join(self.cache_dir, partial["path"])
+        return partial
+
+    def put_partial(self, media_id: str, variant: str, *, path: str, size: int, chunk_size: int,
+                    content_type: str, etag: str | None = None, last_modified: str | None = None,
+                    source_url: str | None = None) -> dict:
+        """Registra o download parcial (se outro worker já registrou, vale o dele)."""
+        now = time.time()
+        self._conn().execute(
+            f"INSERT INTO partials ({', '.join(_PARTIAL_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (media_id, variant) DO NOTHING",
+            (media_id, variant, os.path.relpath(path, self.cache_dir), size, chunk_size,
+             bytes(chunk_count(size, chunk_size) // 8 + 1), content_type, etag, last_modified,
+             source_url, now, now))
+        return self.get_partial(media_id, variant)
+
+    def mark_chunks(self, media_id: str, variant: str, first: int, last: int) -> bytes | None:
+        """Marca os trechos first..last como gravados; devolve o bitmap (None se o parcial sumiu)."""
+        with self._write_txn() as conn:
+            row = conn.execute("SELECT bitmap FROM partials WHERE media_id = ? AND variant = ?",
+                               (media_id, variant)).fetchone()
+            if row is None:
+                return None
+            bitmap = bytearray(row[0])
+            for i in range(first, last + 1):
+                bitmap[i >> 3] |= 1 << (i & 7)
+            conn.execute("UPDATE partials SET bitmap = ?, last_access = ? WHERE media_id = ? AND variant = ?",
+                         (bytes(bitmap), time.time(), media_id, variant))
+        return bytes(bitmap)
+
+    def touch_partial(self, media_id: str, variant: str, *, source_url: str | None = None):
+        if source_url:
+            self._conn().execute("UPDATE partials SET last_access = ?, source_url = ?"
+                                 " WHERE media_id = ? AND variant = ?",
+                                 (time.time(), source_url, media_id, variant))
+        else:
+            self._conn().execute("UPDATE partials SET last_access = ? WHERE media_id = ? AND variant = ?",
+                                 (time.time(), media_id, variant))
+
+    def _drop_partials(self, conn, where: str, args: tuple, keep_file: bool = False) -> list[dict]:
+        rows = conn.execute(f"SELECT media_id, variant, path FROM partials WHERE {where}", args).fetchall()
+        conn.execute(f"DELETE FROM partials WHERE {where}", args)
+        dropped = []
+        for mid, variant, rel in rows:
+            path = os.path.join(self.cache_dir, rel)
+            freed = 0
+            if not keep_file:
+                try:
+                    freed = allocated_size(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            dropped.append({"media_id": mid, "variant": variant, "path": path, "partial": True, "freed": freed})
+        return dropped
+
+    def remove_partial(self, media_id: str, variant: str, keep_file: bool = False) -> int:
+        """Descarta o download parcial (keep_file: o arquivo já virou blob). Devolve os bytes liberados."""
+        with self._write_txn() as conn:
+            dropped = self._drop_partials(conn, "media_id = ? AND variant = ?", (media_id, variant), keep_file)
+        return sum(p["freed"] for p in dropped)
+
+    def begin_download(self, media_id: str, variant: str, *, path: str, length: int | None,
+                       content_type: str):
+        """Registra o .tmp de um download tee em andamento (outros requests leem dele enquanto cresce)."""
+        self._conn().execute(
+            "INSERT OR REPLACE INTO downloads (media_id, variant, path, length, content_type, started_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (media_id, variant, os.path.relpath(path, self.cache_dir), length, content_type, time.time()))
+
+    def get_download(self, media_id: str, variant: str) -> dict | None:
+        row = self._conn().execute(
+            "SELECT path, length, content_type, started_at FROM downloads WHERE media_id = ? AND variant = ?",
+            (media_id, variant)).fetchone()
+        if row is None:
+            return None
+        return {"media_id": media_id, "variant": variant, "path": os.path.join(self.cache_dir, row[0]),
+                "length": row[1], "content_type": row[2], "started_at": row[3]}
+
+    def end_download(self, media_id: str, variant: str, path: str):
+        """Tira o registro (só se ainda é o deste .tmp: outro líder pode ter assumido a chave)."""
+        self._conn().execute("DELETE FROM downloads WHERE media_id = ? AND variant = ? AND path = ?",
+                             (media_id, variant, os.path.relpath(path, self.cache_dir)))
+
+    def generation(self) -> int:
+        """Geração atual das invalidações (drop/clear de qualquer worker), com até _GENERATION_CHECK_SECONDS de atraso."""
+        now = time.monotonic()
+        if now - self._generation_checked >= _GENERATION_CHECK_SECONDS:
+            row = self._conn().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+            self._generation = row[0] if row else 0
+            self._generation_checked = now
+        return self._generation
+
+    def _bump_generation(self, conn):
+        conn.execute("INSERT INTO meta (key, value) VALUES ('generation', 1)"
+                     " ON CONFLICT (key) DO UPDATE SET value = value + 1")
+        self._generation_checked = float("-inf")  # este worker enxerga a própria invalidação já no próximo hit
+
+    def remove(self, media_id: str, variant: str | None = None, invalidate: bool = False) -> list[dict]:
+        """
+        Remove as chaves (e downloads parciais) e solta seus blobs; cada linha
+        devolvida traz "freed" (bytes liberados no disco). invalidate (drop
+        explícito, não evicção): incrementa a geração, derrubando as camadas
+        quentes de todos os workers.
+        """
+        if variant:
+            where, args = "media_id = ? AND variant = ?", (media_id, variant)
+        else:
+            where, args = "media_id = ?", (media_id,)
+        with self._write_txn() as conn:
+            rows = [self._row(r) for r in conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM media WHERE {where}", args).fetchall()]
+            conn.execute(f"DELETE FROM media WHERE {where}", args)
+            for entry in rows:
+                entry["freed"] = self._release_blob(conn, entry["content_hash"])
+            rows += self._drop_partials(conn, where, args)
+            if invalidate:
+                self._bump_generation(conn)
+        return rows
+
+    def reconcile(self) -> tuple[int, int]:
+        """
+        Boot: remove linhas cujo blob (ou arquivo parcial) sumiu do disco, recalcula
+        as referências e apaga blobs sem nenhuma chave. Devolve (linhas removidas,
+        blobs órfãos removidos).
+        """
+        with self._write_txn() as conn:
+            missing = [(mid, variant) for mid, variant, path in
+                       conn.execute("SELECT media_id, variant, path FROM media").fetchall()
+                       if not os.path.exists(os.path.join(self.cache_dir, path))]
+            conn.executemany("DELETE FROM media WHERE media_id = ? AND variant = ?", missing)
+            missing_partials = [(mid, variant) for mid, variant, path in
+                                conn.execute("SELECT media_id, variant, path FROM partials").fetchall()
+                                if not os.path.exists(os.path.join(self.cache_dir, path))]
+            conn.executemany("DELETE FROM partials WHERE media_id = ? AND variant = ?", missing_partials)
+            conn.execute("UPDATE blobs SET refs = (SELECT COUNT(*) FROM media WHERE content_hash = blobs.hash)")
+            known = {path for (path,) in conn.execute("SELECT path FROM blobs WHERE refs > 0").fetchall()}
+            conn.execute("DELETE FROM blobs WHERE refs <= 0")
+            orphans = 0
+            for root, _dirs, files in os.walk(os.path.join(self.cache_dir, BLOBS_DIR)):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if name.endswith(".tmp") or os.path.relpath(path, self.cache_dir) in known:
+                        continue
+                    os.remove(path)
+                    orphans += 1
+        return len(missing) + len(missing_partials), orphans
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+        with self._write_txn() as conn:
+            conn.execute("DELETE FROM media")
+            conn.execute("DELETE FROM blobs")
+            conn.execute("DELETE FROM partials")
+            self._bump_generation(conn)
+
+    def entries(self) -> dict[str, dict]:
+        """
+        Chave -> {size, content_hash, last_access} de todas as chaves (varredura do
+        evictor); downloads parciais entram com os bytes dos trechos já gravados.
+        """
+        self.flush_access()
+        conn = self._conn()
+        rows = conn.execute("SELECT media_id, variant, size, content_hash, last_access FROM media").fetchall()
+        entries = {f"{mid}:{variant}": {"size": size, "content_hash": h, "last_access": ts}
+                   for mid, variant, size, h, ts in rows}
+        for mid, variant, chunk_size, bitmap, ts in conn.execute(
+                "SELECT media_id, variant, chunk_size, bitmap, last_access FROM partials").fetchall():
+            present = sum(bin(b).count("1") for b in bitmap)
+            entries.setdefault(f"{mid}:{variant}", {"size": present * chunk_size, "content_hash": None,
+                                                    "last_access": ts})
+        return entries
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        entries, logical, hits = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM media").fetchone()
+        blobs, stored = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        partials = conn.execute("SELECT COUNT(*) FROM partials").fetchone()[0]
+        # logical = soma por chave; stored = o que de fato ocupa disco depois da deduplicação
+        return {"entries": entries, "bytes": logical, "hits": hits,
+                "blobs": blobs, "stored_bytes": stored, "dedup_saved_bytes": logical - stored,
+                "partials": partials}
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM media").fetchone()[0]
+
+
+media_index = MediaIndex()
@@ -0,0 +1,121 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+import requests
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Classes de erro com TTL próprio (ver NEGATIVE_TTL_* na config)
+NOT_FOUND = "not_found"
+PERMISSION = "permission"
+OVERSIZE = "oversize"
+TIMEOUT = "timeout"
+
+_TTL_SETTINGS = {
+    NOT_FOUND: 'NEGATIVE_TTL_NOT_FOUND',
+    PERMISSION: 'NEGATIVE_TTL_PERMISSION',
+    OVERSIZE: 'NEGATIVE_TTL_OVERSIZE',
+    TIMEOUT: 'NEGATIVE_TTL_TIMEOUT',
+}
+
+# Códigos de erro do Graph: 100 = objeto inexistente/sem suporte; 10, 190, 200-299 = permissão/token
+_GRAPH_NOT_FOUND_CODES = {100, 803}
+_GRAPH_PERMISSION_CODES = {10, 190} | set(range(200, 300))
+
+
+class MediaTooLarge(Exception):
+    """Mídia maior que MEDIA_CACHE_MAX_BYTES."""
+
+
+class KnownFailure(Exception):
+    """Falha recente respondida pelo cache negativo, sem tocar no upstream."""
+
+    def __init__(self, error_class: str, detail: str = ""):
+        super().__init__(f"Falha recente ({error_class}): {detail}" if detail else f"Falha recente ({error_class})")
+        self.error_class = error_class
+
+
+def classify_error(exc: Exception) -> str | None:
+    """Classe de erro cacheável, ou None para erros que não devem ser lembrados (5xx, circuito, etc.)."""
+    if isinstance(exc, KnownFailure):
+        return exc.error_class
+    if isinstance(exc, MediaTooLarge):
+        return OVERSIZE
+    if isinstance(exc, requests.Timeout):
+        return TIMEOUT
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        if status in (404, 410):
+            return NOT_FOUND
+        if status in (401, 403):
+            return PERMISSION
+        if status == 400:
+            try:
+                code = (exc.response.json().get("error") or {}).get("code")
+            except Exception:
+                code = None
+            if code in _GRAPH_NOT_FOUND_CODES:
+                return NOT_FOUND
+            if code in _GRAPH_PERMISSION_CODES:
+                return PERMISSION
+    return None
+
+
+class NegativeCache:
+    """Falhas recentes por (escopo, chave) com TTL por classe de erro; limitado em entradas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[str, str], dict] = OrderedDict()
+        self._hits = 0
+
+    def remember(self, scope: str, key: str, error_class: str, detail: str = ""):
+        cfg = current_app.config
+        ttl = cfg[_TTL_SETTINGS[error_class]]
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries.pop((scope, key), None)
+            self._entries[(scope, key)] = {
+                "error_class": error_class,
+                "detail": detail[:200],
+                "expires": time.time() + ttl,
+            }
+            while len(self._entries) > cfg['NEGATIVE_CACHE_MAX_ENTRIES']:
+                self._entries.popitem(last=False)
+        logger.info(f"Cache negativo: {scope}/{key} -> {error_class} por {ttl}s")
+
+    def lookup(self, scope: str, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get((scope, key))
+            if entry is None:
+                return None
+            if entry["expires"] <= time.time():
+                self._entries.pop((scope, key), None)
+                return None
+            self._hits += 1
+            return entry
+
+    def forget(self, scope: str, key: str | None = None, prefix: str | None = None):
+        with self._lock:
+            if key is not None:
+                self._entries.pop((scope, key), None)
+            if prefix is not None:
+                for k in [k for k in self._entries if k[0] == scope and k[1].startswith(prefix)]:
+                    self._entries.pop(k, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_class = {}
+            for entry in self._entries.values():
+                by_class[entry["error_class"]] = by_class.get(entry["error_class"], 0) + 1
+            return {"entries": len(self._entries), "hits": self._hits, "by_class": by_class}
+
+
+negative_cache = NegativeCache()
@@ -0,0 +1,148 @@
+import json
+import time
+import logging
+import threading
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Códigos de erro do Graph que indicam limite de uso atingido
+_RATE_LIMIT_ERROR_CODES = {4, 17, 32, 613, 80002}
+# Depois desse tempo sem headers novos o último uso informado deixa de valer
+_USAGE_STALE_SECONDS = 300
+
+
+class GraphRateLimited(Exception):
+    """Graph pediu para esperar mais do que aceitamos bloquear um worker."""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"Graph API em pausa por rate limit ({retry_in:.0f}s restantes)")
+        self.retry_in = retry_in
+
+
+def _parse_usage_header(raw: str | None) -> tuple[float, float]:
+    """
+    Retorna (maior percentual de uso, segundos até recuperar acesso) de um
+    header X-App-Usage / X-Business-Use-Case-Usage.
+    """
+    if not raw:
+        return 0.0, 0.0
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return 0.0, 0.0
+
+    # X-App-Usage: {"call_count": 28, "total_time": 25, "total_cputime": 25}
+    # X-Business-Use-Case-Usage: {"<id>": [{"type": ..., "call_count": ..., "estimated_time_to_regain_access": min}]}
+    buckets = []
+    if isinstance(data, dict) and any(isinstance(v, list) for v in data.values()):
+        for entries in data.values():
+            buckets.extend(e for e in (entries or []) if isinstance(e, dict))
+    elif isinstance(data, dict):
+        buckets.append(data)
+
+    pct, regain = 0.0, 0.0
+    for b in buckets:
+        for k in ("call_count", "total_time", "total_cputime"):
+            try:
+                pct = max(pct, float(b.get(k) or 0))
+            except (TypeError, ValueError):
+                pass
+        try:
+            regain = max(regain, float(b.get("estimated_time_to_regain_access") or 0) * 60)
+        except (TypeError, ValueError):
+            pass
+    return pct, regain
+
+
+class GraphRateGovernor:
+    """
+    Throttle por processo em volta das chamadas ao Graph.
+    Acompanha o uso informado pelo próprio Graph e atrasa (ou pausa) os
+    chamadores à medida que a cota se aproxima do limite.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usage_pct = 0.0
+        self._usage_ts = 0.0
+        self._paused_until = 0.0
+        self._throttled = 0
+        self._rejected = 0
+
+    def _delay_for(self, usage: float, cfg) -> float:
+        slow, pause = cfg['GRAPH_USAGE_SLOWDOWN_PCT'], cfg['GRAPH_USAGE_PAUSE_PCT']
+        if usage < slow:
+            return 0.0
+        # cresce de forma quadrática entre slowdown e pause
+        frac = min((usage - slow) / max(pause - slow, 1), 1.0)
+        return cfg['GRAPH_MAX_THROTTLE_DELAY_SECONDS'] * frac * frac
+
+    def before_call(self):
+        cfg = current_app.config
+        now = time.time()
+        with self._lock:
+            usage = self._usage_pct if now - self._usage_ts <= _USAGE_STALE_SECONDS else 0.0
+            # durante a pausa ninguém passa; depois dela as chamadas seguem
+            # com o atraso máximo até um header novo mostrar o uso real
+            wait = max(self._paused_until - now, self._delay_for(usage, cfg))
+
+        if wait <= 0:
+            return
+        if wait > cfg['GRAPH_MAX_WAIT_SECONDS']:
+            with self._lock:
+                self._rejected += 1
+            logger.warning(f"Graph pausado por rate limit, falhando rápido ({wait:.1f}s restantes)")
+            raise GraphRateLimited(wait)
+        with self._lock:
+            self._throttled += 1
+        logger.info(f"Throttle Graph: uso={usage:.0f}%, aguardando {wait:.2f}s")
+        time.sleep(wait)
+
+    def observe(self, response):
+        if response is None:
+            return
+        headers = response.headers
+        app_pct, app_regain = _parse_usage_header(headers.get('X-App-Usage'))
+        buc_pct, buc_regain = _parse_usage_header(headers.get('X-Business-Use-Case-Usage'))
+        pause = max(app_regain, buc_regain)
+
+        retry_after = headers.get('Retry-After')
+        if retry_after:
+            try:
+                pause = max(pause, float(retry_after))
+            except ValueError:
+                pass
+
+        cfg = current_app.config
+        if response.status_code >= 400:
+            try:
+                code = (response.json().get("error") or {}).get("code")
+            except Exception:
+                code = None
+            if code in _RATE_LIMIT_ERROR_CODES or response.status_code == 429:
+                pause = max(pause, cfg['GRAPH_RATE_LIMIT_PAUSE_SECONDS'])
+
+        now = time.time()
+        with self._lock:
+            if 'X-App-Usage' in headers or 'X-Business-Use-Case-Usage' in headers:
+                self._usage_pct = max(app_pct, buc_pct)
+                self._usage_ts = now
+                if self._usage_pct >= cfg['GRAPH_USAGE_PAUSE_PCT']:
+                    pause = max(pause, cfg['GRAPH_RATE_LIMIT_PAUSE_SECONDS'])
+            if pause:
+                self._paused_until = max(self._paused_until, now + pause)
+                logger.warning(f"Graph pediu pausa de {pause:.0f}s (uso={self._usage_pct:.0f}%)")
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {
+                "usage_pct": self._usage_pct if now - self._usage_ts <= _USAGE_STALE_SECONDS else 0.0,
+                "paused_for_seconds": round(max(self._paused_until - now, 0.0), 1),
+                "throttled_calls": self._throttled,
+                "rejected_calls": self._rejected,
+            }
+
+
+graph_governor = GraphRateGovernor()
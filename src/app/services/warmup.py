@@ -1,8 +1,8 @@
 import time
 import logging
 from flask import current_app
-from .instagram import ig_get_url
-from .media_cache import ensure_media_cached, drop_media_cache
+from .instagram import ig_get_url, queue_lookups, remember_media_urls, lookup_media_urls
+from .media_cache import ensure_media_cached, drop_media_cache, backfill_placeholder
 
 logger = logging.getLogger(__name__)
 
@@ -10,7 +10,7 @@ logger = logging.getLogger(__name__)
 def collect_media_ids(limit_posts: int = 20) -> list[str]:
     s = current_app.config
     ids, got = [], 0
-    fields = "id,media_type,children{id,media_type}"
+    fields = "id,media_type,media_url,thumbnail_url,children{id,media_type,media_url,thumbnail_url}"
     url = f"{s['GRAPH_API_URL']}/{s['USER_ID']}/media?fields={fields}&limit=25&access_token={s['ACCESS_TOKEN']}"
 
     logger.info(f"Coletando media IDs (limite: {limit_posts})")
@@ -19,6 +19,7 @@ def collect_media_ids(limit_posts: int = 20) -> list[str]:
         while url and got < limit_posts:
             logger.info(f"Buscando página: {url[:80]}...")
             data = ig_get_url(url)
+            remember_media_urls(data.get("data", []))
 
             for post in data.get("data", []):
                 if got >= limit_posts:
@@ -57,6 +58,8 @@ def warmup(limit_posts: int = 20, force: bool = False):
     logger.info(f"Iniciando warmup: limit_posts={limit_posts}, force={force}")
 
     mids = collect_media_ids(limit_posts)
+    # ids que não vieram com URL no field expansion são resolvidos em lotes no primeiro ig_get
+    queue_lookups([mid for mid in mids if not lookup_media_urls(mid)])
     ok = sk = fa = 0
     details = []
 
@@ -68,6 +71,12 @@ def warmup(limit_posts: int = 20, force: bool = False):
                 drop_media_cache(mid)
 
             file_path, ct = ensure_media_cached(mid)
+            if ct.startswith("video/"):
+                # a capa é o que o grid mostra (e de onde sai o placeholder do /posts)
+                ensure_media_cached(mid, "thumb")
+                backfill_placeholder(mid, "thumb")
+            elif file_path:
+                backfill_placeholder(mid)
             if file_path:
                 ok += 1
                 details.append({"id": mid, "status": "cached", "path": file_path})
@@ -0,0 +1,4 @@
+import os
+
+# app.config exige API_BASE_URL já no import do pacote
+os.environ.setdefault("API_BASE_URL", "http://localhost:8000")
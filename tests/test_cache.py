@@ -0,0 +1,99 @@
+import math
+import random
+
+import pytest
+from flask import Flask
+
+from app.services import cache
+from app.services.cache import _xfetch_due
+from app.services.cache_backends import MemoryCache
+
+ITEM = {"ts": 1000.0, "delta": 2.0, "data": "v"}  # expira em 1060 com TTL de 60s
+ONE = 1 - math.exp(-1)  # random() que faz -ln(1 - r) == 1
+
+
+@pytest.fixture
+def now(monkeypatch):
+    clock = {"t": 1000.0}
+    monkeypatch.setattr(cache.time, "time", lambda: clock["t"])
+    return clock
+
+
+@pytest.fixture
+def roll(monkeypatch):
+    value = {"r": ONE}
+    monkeypatch.setattr(cache.random, "random", lambda: value["r"])
+    return value
+
+
+@pytest.mark.parametrize("beta, delta", [(0, 2.0), (1.0, 0), (1.0, None)])
+def test_no_beta_or_no_delta_never_recomputes_early(now, roll, beta, delta):
+    now["t"] = 1059.9
+    roll["r"] = 0.999999
+    assert not _xfetch_due({**ITEM, "delta": delta}, 60, beta)
+
+
+def test_recomputes_once_delta_times_beta_from_expiry(now, roll):
+    now["t"] = 1058.0
+    assert _xfetch_due(ITEM, 60, 1.0)
+    now["t"] = 1057.9
+    assert not _xfetch_due(ITEM, 60, 1.0)
+
+
+@pytest.mark.parametrize("delta, beta", [(10.0, 1.0), (2.0, 5.0)])
+def test_expensive_values_or_higher_beta_recompute_earlier(now, roll, delta, beta):
+    now["t"] = 1050.0
+    assert not _xfetch_due(ITEM, 60, 1.0)
+    assert _xfetch_due({**ITEM, "delta": delta}, 60, beta)
+
+
+def test_zero_roll_only_recomputes_at_expiry(now, roll):
+    roll["r"] = 0.0
+    now["t"] = 1059.99
+    assert not _xfetch_due(ITEM, 60, 1.0)
+    now["t"] = 1060.0
+    assert _xfetch_due(ITEM, 60, 1.0)
+
+
+@pytest.mark.parametrize("gap", [1.0, 2.0, 6.0])
+def test_probability_decays_exponentially_with_distance_to_expiry(now, monkeypatch, gap):
+    # P(recálculo) = exp(-(expiry - now) / (delta * beta))
+    rng = random.Random(42)
+    monkeypatch.setattr(cache.random, "random", rng.random)
+    now["t"] = 1060.0 - gap
+    hits = sum(_xfetch_due(ITEM, 60, 1.0) for _ in range(20000))
+    assert hits / 20000 == pytest.approx(math.exp(-gap / 2.0), abs=0.015)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    app = Flask(__name__)
+    app.config.update(CACHE_XFETCH_BETA=1.0, CACHE_DURATION_SECONDS=60, CACHE_STALE_IF_ERROR_SECONDS=600)
+    store = MemoryCache(1 << 20)
+    monkeypatch.setattr(cache, "_store", store)
+    with app.app_context():
+        yield store
+
+
+def test_get_from_cache_treats_an_early_recompute_as_a_miss(store, now, roll):
+    cache.set_in_cache("posts", ["a"], 60, compute_seconds=2.0)
+    now["t"] = 1050.0
+    assert cache.get_from_cache("posts", 60) == ["a"]
+    now["t"] = 1058.5
+    assert cache.get_from_cache("posts", 60) is None
+    # o valor continua disponível como stale até o fim da retenção
+    assert cache.get_stale_from_cache("posts", 600) == ["a"]
+    assert store.stats()["hits"] == 1 and store.stats()["misses"] == 1
+
+
+def test_get_or_revalidate_refreshes_early_in_background(store, now, roll, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(cache, "_schedule_refresh", lambda key, loader, ttl: scheduled.append(key))
+    cache.set_in_cache("feed", ["a"], 300, compute_seconds=2.0)
+
+    now["t"] = 1050.0
+    assert cache.get_or_revalidate("feed", 60, 300, lambda: ["b"]) == ["a"]
+    assert scheduled == []
+    now["t"] = 1058.5
+    assert cache.get_or_revalidate("feed", 60, 300, lambda: ["b"]) == ["a"]
+    assert scheduled == ["feed"]
@@ -0,0 +1,184 @@
+import fnmatch
+import socketserver
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from app.services.cache_backends import RedisCache, SqliteCache, _dumps, _loads
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    """Subconjunto do protocolo Redis usado pelo RedisCache (GET/SET PX/DEL/SCAN)."""
+
+    def _bulk(self, value: bytes) -> bytes:
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def handle(self):
+        db = self.server.db
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                size = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(size + 2)[:-2])
+            self.server.commands.append(args)
+            cmd = args[0].upper()
+            if cmd == b"GET":
+                value, expires = db.get(args[1], (None, 0))
+                if value is not None and expires <= time.time():
+                    db.pop(args[1], None)
+                    value = None
+                self.wfile.write(b"$-1\r\n" if value is None else self._bulk(value))
+            elif cmd == b"SET":
+                assert args[3].upper() == b"PX"
+                db[args[1]] = (args[2], time.time() + int(args[4]) / 1000)
+                self.wfile.write(b"+OK\r\n")
+            elif cmd == b"DEL":
+                self.wfile.write(b":%d\r\n" % sum(db.pop(k, None) is not None for k in args[1:]))
+            elif cmd == b"SCAN":
+                pattern = args[3].decode()
+                keys = [k for k in db if fnmatch.fnmatchcase(k.decode(), pattern)]
+                self.wfile.write(b"*2\r\n" + self._bulk(b"0") + b"*%d\r\n" % len(keys)
+                                 + b"".join(self._bulk(k) for k in keys))
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+class _RespServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _RespHandler)
+        self.db = {}
+        self.commands = []
+
+
+@pytest.fixture
+def resp_server():
+    server = _RespServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def redis_cache(resp_server):
+    host, port = resp_server.server_address
+    return RedisCache(f"redis://{host}:{port}/0", prefix="test:")
+
+
+def _closed_port() -> int:
+    with socketserver.TCPServer(("127.0.0.1", 0), socketserver.BaseRequestHandler) as s:
+        return s.server_address[1]
+
+
+def test_serialization_roundtrip_and_version_mismatch():
+    entry = {"data": {"posts": ["x" * 2000]}, "ts": 1.0, "delta": 0.5}
+    blob = _dumps(entry)
+    assert len(blob) < 2000  # payload grande vai comprimido
+    assert _loads(blob) == entry
+    assert _loads(bytes([blob[0] + 1]) + blob[1:]) is None
+    assert _loads(b"") is None
+
+
+def test_redis_set_get_delete(redis_cache, resp_server):
+    redis_cache.set("posts", {"items": [1, 2, 3]}, 60, delta=0.2)
+    entry = redis_cache.get("posts")
+    assert entry["data"] == {"items": [1, 2, 3]}
+    assert entry["delta"] == 0.2
+    assert b"test:posts" in resp_server.db
+
+    set_cmd = next(c for c in resp_server.commands if c[0] == b"SET")
+    assert set_cmd[3:] == [b"PX", b"60000"]
+
+    redis_cache.delete("posts")
+    assert redis_cache.get("posts") is None
+
+
+def test_redis_entry_expires_on_server(redis_cache):
+    redis_cache.set("short", "v", 0.05)
+    assert redis_cache.get("short")["data"] == "v"
+    time.sleep(0.1)
+    assert redis_cache.get("short") is None
+
+
+def test_redis_clear_only_touches_prefix(redis_cache, resp_server):
+    resp_server.db[b"other:key"] = (b"keep", time.time() + 60)
+    redis_cache.set("a", 1, 60)
+    redis_cache.set("b", 2, 60)
+    redis_cache.clear()
+    assert redis_cache.get("a") is None and redis_cache.get("b") is None
+    assert b"other:key" in resp_server.db
+
+
+def test_redis_reconnects_after_server_restart(resp_server):
+    host, port = resp_server.server_address
+    cache = RedisCache(f"redis://{host}:{port}/0", prefix="test:")
+    cache.set("k", "v", 60)
+    # conexão derrubada pelo servidor: a próxima chamada reconecta sozinha
+    cache._client._sock.close()
+    assert cache.get("k")["data"] == "v"
+
+
+def test_redis_down_degrades_to_miss():
+    cache = RedisCache(f"redis://127.0.0.1:{_closed_port()}/0", timeout=0.2)
+    assert cache.get("k") is None
+    cache.set("k", "v", 60)
+    cache.delete("k")
+    cache.clear()
+
+
+def test_sqlite_roundtrip_expiry_and_clear(tmp_path):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite3"), max_bytes=1024 * 1024)
+    cache.set("profile", {"username": "u"}, 60, delta=0.1)
+    assert cache.get("profile")["data"] == {"username": "u"}
+
+    cache.set("expired", "v", -1)
+    assert cache.get("expired") is None
+
+    cache.clear()
+    assert cache.get("profile") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_sqlite_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    writer = SqliteCache(path, max_bytes=1024 * 1024)
+    reader = SqliteCache(path, max_bytes=1024 * 1024)
+    writer.set("posts", [1, 2], 60)
+    assert reader.get("posts")["data"] == [1, 2]
+
+
+def test_sqlite_evicts_least_recently_used(tmp_path):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite3"), max_bytes=3000, sweep_interval=0)
+    cache.set("old", "a" * 900, 60)
+    time.sleep(0.01)
+    cache.set("mid", "b" * 900, 60)
+    time.sleep(0.01)
+    assert cache.get("old") is not None  # acesso renova o atime
+    time.sleep(0.01)
+    cache.set("new", "c" * 900, 60)
+    cache.set("newer", "d" * 900, 60)
+    assert cache.get("mid") is None
+    assert cache.get("old") is not None
+    assert cache.stats()["bytes"] <= 3000
+
+
+def test_sqlite_errors_degrade_to_miss(tmp_path, monkeypatch):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite3"), max_bytes=1024 * 1024)
+
+    def broken():
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(cache, "_conn", broken)
+    assert cache.get("k") is None
+    cache.set("k", "v", 60)
+    cache.delete("k")
+    cache.clear()
+    assert "error" in cache.stats()
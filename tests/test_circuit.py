@@ -0,0 +1,126 @@
+import pytest
+import requests
+
+from app.services import circuit, http
+from app.services.circuit import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit.time, "time", clock)
+    return clock
+
+
+def _open(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.stats()["state"] == OPEN
+
+
+def test_closed_opens_after_threshold_consecutive_failures(clock):
+    breaker = CircuitBreaker("cdn", failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # sucesso zera a sequência
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.stats()["state"] == CLOSED
+    breaker.record_failure()
+    assert breaker.stats()["state"] == OPEN
+
+
+def test_open_rejects_until_reset_timeout(clock):
+    breaker = CircuitBreaker("cdn", failure_threshold=1, reset_timeout=30)
+    _open(breaker)
+    clock.now += 10
+    with pytest.raises(CircuitOpenError) as exc:
+        breaker.before_call()
+    assert exc.value.retry_in == pytest.approx(20)
+    assert breaker.stats()["rejected_calls"] == 1
+
+
+def test_half_open_allows_a_single_probe(clock):
+    breaker = CircuitBreaker("cdn", failure_threshold=1, reset_timeout=30)
+    _open(breaker)
+    clock.now += 30
+    breaker.before_call()
+    assert breaker.stats()["state"] == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_probe_success_closes_and_failure_reopens(clock):
+    breaker = CircuitBreaker("cdn", failure_threshold=1, reset_timeout=30)
+    _open(breaker)
+    clock.now += 30
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.stats()["state"] == OPEN
+
+    clock.now += 30
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.stats()["state"] == CLOSED
+    breaker.before_call()
+
+
+def test_lost_probe_is_released_after_probe_timeout(clock):
+    breaker = CircuitBreaker("cdn", failure_threshold=1, reset_timeout=30, probe_timeout=10)
+    _open(breaker)
+    clock.now += 30
+    breaker.before_call()  # teste que nunca registra resultado
+    clock.now += 5
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.now += 5
+    breaker.before_call()
+    assert breaker.stats()["state"] == HALF_OPEN
+
+
+class _FailingSession:
+    def __init__(self, exc):
+        self.exc = exc
+
+    def get(self, *args, **kwargs):
+        raise self.exc
+
+
+@pytest.mark.parametrize("exc", [requests.exceptions.ChunkedEncodingError("truncado"),
+                                 requests.exceptions.ContentDecodingError("gzip"),
+                                 requests.exceptions.TooManyRedirects("loop")])
+def test_get_records_any_request_error_as_failure(clock, monkeypatch, exc):
+    breaker = CircuitBreaker("cdn", failure_threshold=1, reset_timeout=30)
+    monkeypatch.setattr(http, "breaker_for", lambda upstream: breaker)
+    monkeypatch.setattr(http, "get_session", lambda: _FailingSession(exc))
+    _open(breaker)
+    clock.now += 30
+
+    with pytest.raises(type(exc)):
+        http.get("https://scontent.cdninstagram.com/x.jpg")
+    # o teste falhou: reabre (em vez de ficar half-open com o teste preso para sempre)
+    assert breaker.stats()["state"] == OPEN
+    clock.now += 30
+    breaker.before_call()
+
+
+def test_get_releases_probe_on_local_error(clock, monkeypatch):
+    breaker = CircuitBreaker("cdn", failure_threshold=1, reset_timeout=30)
+    monkeypatch.setattr(http, "breaker_for", lambda upstream: breaker)
+    monkeypatch.setattr(http, "get_session", lambda: _FailingSession(SystemExit(1)))
+    _open(breaker)
+    clock.now += 30
+
+    with pytest.raises(SystemExit):
+        http.get("https://scontent.cdninstagram.com/x.jpg")
+    assert breaker.stats()["state"] == HALF_OPEN
+    breaker.before_call()  # próxima chamada vira o novo teste
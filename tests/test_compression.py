@@ -0,0 +1,60 @@
+import gzip
+
+import pytest
+from flask import Flask
+
+from app.services.compression import encode_json_variants, negotiated_json_response
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+@pytest.fixture
+def variants(app):
+    with app.app_context():
+        return encode_json_variants({"posts": [{"id": str(i)} for i in range(50)]})
+
+
+def _respond(app, variants, **headers):
+    with app.test_request_context("/", headers=headers):
+        return negotiated_json_response(variants)
+
+
+def test_each_content_coding_gets_its_own_strong_etag(app, variants):
+    base = variants["etag"]
+    identity = _respond(app, variants)
+    gz = _respond(app, variants, **{"Accept-Encoding": "gzip"})
+
+    assert identity.headers["ETag"] == base and "Content-Encoding" not in identity.headers
+    assert gz.headers["ETag"] == base[:-1] + '-gzip"'
+    assert gzip.decompress(gz.get_data()) == identity.get_data()
+    if variants["br"] is not None:
+        br = _respond(app, variants, **{"Accept-Encoding": "gzip, br"})
+        assert br.headers["Content-Encoding"] == "br"
+        assert br.headers["ETag"] == base[:-1] + '-br"'
+    assert len({identity.headers["ETag"], gz.headers["ETag"]}) == 2
+
+
+def test_if_none_match_accepts_the_etag_of_any_coding(app, variants):
+    gz_etag = _respond(app, variants, **{"Accept-Encoding": "gzip"}).headers["ETag"]
+
+    # cliente trocou de Accept-Encoding (ou passou por um proxy que descomprime)
+    resp = _respond(app, variants, **{"If-None-Match": gz_etag})
+    assert resp.status_code == 304
+    assert resp.headers["ETag"] == variants["etag"]
+
+    resp = _respond(app, variants, **{"If-None-Match": f'W/{gz_etag}', "Accept-Encoding": "gzip"})
+    assert resp.status_code == 304
+
+
+def test_if_none_match_with_other_content_is_200(app, variants):
+    resp = _respond(app, variants, **{"If-None-Match": '"outro"', "Accept-Encoding": "gzip"})
+    assert resp.status_code == 200
+    assert resp.headers["Content-Length"] == str(len(variants["gzip"]))
+
+
+def test_zero_quality_disables_an_encoding(app, variants):
+    resp = _respond(app, variants, **{"Accept-Encoding": "br;q=0, gzip;q=0"})
+    assert "Content-Encoding" not in resp.headers
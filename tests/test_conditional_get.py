@@ -0,0 +1,85 @@
+import os
+
+import pytest
+from flask import Flask
+from werkzeug.http import http_date
+
+from app.services.media_cache import serve_file_with_range
+
+DATA = bytes(range(256)) * 4
+MTIME = 1_700_000_000
+ETAG = '"' + "ab" * 16 + '"'
+
+
+@pytest.fixture
+def blob(tmp_path):
+    path = tmp_path / ("ab" * 32 + ".jpg")
+    path.write_bytes(DATA)
+    os.utime(path, (MTIME, MTIME))
+    return str(path)
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+def _serve(app, blob, **headers):
+    with app.test_request_context("/", headers=headers):
+        resp = serve_file_with_range(blob, "image/jpeg")
+        body = b"".join(resp.response)
+        resp.close()
+        return resp, body
+
+
+def test_validators_come_from_the_blob(app, blob):
+    resp, _ = _serve(app, blob)
+    assert resp.headers["ETag"] == ETAG
+    assert resp.headers["Last-Modified"] == http_date(MTIME)
+
+
+def test_if_none_match_hit_is_304_without_body(app, blob):
+    resp, body = _serve(app, blob, **{"If-None-Match": f'"outro", {ETAG}'})
+    assert resp.status_code == 304 and body == b""
+    assert resp.headers["ETag"] == ETAG
+
+
+def test_if_none_match_uses_weak_comparison(app, blob):
+    resp, _ = _serve(app, blob, **{"If-None-Match": f"W/{ETAG}"})
+    assert resp.status_code == 304
+
+
+def test_if_modified_since(app, blob):
+    assert _serve(app, blob, **{"If-Modified-Since": http_date(MTIME)})[0].status_code == 304
+    assert _serve(app, blob, **{"If-Modified-Since": http_date(MTIME - 60)})[0].status_code == 200
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since(app, blob):
+    # ETag diferente: 200 mesmo com If-Modified-Since dizendo que não mudou
+    resp, body = _serve(app, blob, **{"If-None-Match": '"outro"', "If-Modified-Since": http_date(MTIME)})
+    assert resp.status_code == 200 and body == DATA
+    # ETag igual: 304 mesmo com If-Modified-Since antigo
+    resp, _ = _serve(app, blob, **{"If-None-Match": ETAG, "If-Modified-Since": http_date(MTIME - 60)})
+    assert resp.status_code == 304
+
+
+def test_if_range_with_matching_strong_etag_serves_the_range(app, blob):
+    resp, body = _serve(app, blob, Range="bytes=0-9", **{"If-Range": ETAG})
+    assert resp.status_code == 206 and body == DATA[:10]
+
+
+def test_if_range_with_other_etag_serves_the_whole_file(app, blob):
+    resp, body = _serve(app, blob, Range="bytes=0-9", **{"If-Range": '"outro"'})
+    assert resp.status_code == 200 and body == DATA
+
+
+def test_if_range_with_weak_etag_never_matches(app, blob):
+    resp, body = _serve(app, blob, Range="bytes=0-9", **{"If-Range": f"W/{ETAG}"})
+    assert resp.status_code == 200 and body == DATA
+
+
+def test_if_range_with_date(app, blob):
+    resp, body = _serve(app, blob, Range="bytes=0-9", **{"If-Range": http_date(MTIME)})
+    assert resp.status_code == 206 and body == DATA[:10]
+    resp, body = _serve(app, blob, Range="bytes=0-9", **{"If-Range": http_date(MTIME - 60)})
+    assert resp.status_code == 200 and body == DATA
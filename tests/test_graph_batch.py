@@ -0,0 +1,68 @@
+import pytest
+import requests
+
+from app.services import instagram
+
+
+def _http_error(status, code=None):
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = (b'{"error": {"code": %d}}' % code) if code is not None else b"{}"
+    return requests.HTTPError(f"{status}", response=resp)
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    """Graph falso: lote com algum id em `deleted` falha com 400/code 100; `fail_all` vale para tudo."""
+    state = {"calls": [], "deleted": set(), "fail_all": None}
+
+    def fake_request(path_or_id, fields, extra=None):
+        ids = extra["ids"].split(",") if extra else [path_or_id]
+        state["calls"].append(ids)
+        if state["fail_all"] is not None:
+            raise state["fail_all"]
+        if state["deleted"] & set(ids):
+            raise _http_error(400, code=100)
+        data = {mid: {"id": mid} for mid in ids}
+        return data if extra else data[path_or_id]
+
+    monkeypatch.setattr(instagram, "_ig_request", fake_request)
+    return state
+
+
+def test_batch_resolves_all_ids_in_one_call(graph):
+    result = instagram._fetch_batch(["1", "2", "3", "4"], "id")
+    assert result == {mid: {"id": mid} for mid in "1234"}
+    assert graph["calls"] == [["1", "2", "3", "4"]]
+
+
+def test_deleted_id_bisects_until_isolated(graph):
+    graph["deleted"] = {"3"}
+    result = instagram._fetch_batch(["1", "2", "3", "4"], "id")
+
+    assert result["1"] == {"id": "1"} and result["2"] == {"id": "2"} and result["4"] == {"id": "4"}
+    assert isinstance(result["3"], requests.HTTPError)
+    assert graph["calls"] == [["1", "2", "3", "4"], ["1", "2"], ["3", "4"], ["3"], ["4"]]
+
+
+@pytest.mark.parametrize("error", [
+    _http_error(400, code=190),  # token expirado
+    _http_error(403, code=10),  # permissão
+    _http_error(400, code=4),  # rate limit do app
+    _http_error(500),
+])
+def test_token_permission_and_rate_limit_errors_fail_the_whole_batch(graph, error):
+    graph["fail_all"] = error
+    ids = [str(i) for i in range(8)]
+
+    result = instagram._fetch_batch(ids, "id")
+
+    assert result == {mid: error for mid in ids}
+    assert len(graph["calls"]) == 1  # sem dividir: 1 chamada em vez de 2n - 1
+
+
+def test_id_missing_from_batch_response_is_a_lookup_error(graph, monkeypatch):
+    monkeypatch.setattr(instagram, "_ig_request", lambda path, fields, extra=None: {"1": {"id": "1"}})
+    result = instagram._fetch_batch(["1", "2"], "id")
+    assert result["1"] == {"id": "1"}
+    assert isinstance(result["2"], LookupError)
@@ -0,0 +1,71 @@
+import hashlib
+import os
+
+import pytest
+
+from app.services import media_eviction
+from app.services.media_eviction import MediaEvictor
+from app.services.media_index import MediaIndex
+
+MIB = 1024 * 1024
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    idx = MediaIndex()
+    idx.open(str(tmp_path))
+    monkeypatch.setattr(media_eviction, "media_index", idx)
+    return idx
+
+
+def _evictor(cache_dir, budget, slots=2, max_bytes=MIB):
+    evictor = MediaEvictor()
+    evictor.configure({
+        'MEDIA_CACHE_DIR': str(cache_dir),
+        'MEDIA_CACHE_DISK_BUDGET_BYTES': budget,
+        'MEDIA_CACHE_DOWNLOAD_SLOTS': slots,
+        'MEDIA_CACHE_MAX_BYTES': max_bytes,
+        'MEDIA_CACHE_EVICTION_POLICY': 'lru',
+        'MEDIA_CACHE_EVICTION_TARGET_RATIO': 0.9,
+        'MEDIA_CACHE_EVICTION_INTERVAL_SECONDS': 60,
+    })
+    return evictor
+
+
+def _cache(index, tmp_path, media_id, size):
+    data = os.urandom(size)
+    src = tmp_path / f"{media_id}.download.tmp"
+    src.write_bytes(data)
+    index.put(media_id, "media", src_path=str(src), ext=".jpg",
+              content_hash=hashlib.sha256(data).hexdigest(), content_type="image/jpeg")
+
+
+def test_settled_bytes_stay_below_budget_minus_download_reserve(index, tmp_path):
+    for i in range(4):
+        _cache(index, tmp_path, f"m{i}", MIB)
+    # download em andamento de outro worker: coberto pela reserva, não dispara evicção
+    in_flight = tmp_path / "m9.media.abc.tmp"
+    in_flight.write_bytes(os.urandom(MIB // 2))
+
+    evictor = _evictor(tmp_path, budget=5 * MIB)  # reserva 2 x 1 MiB -> 3 MiB para o conteúdo
+    evictor.enforce()
+
+    stats = evictor.stats()
+    assert stats["reserved_bytes"] == 2 * MIB
+    assert stats["in_flight_bytes"] == MIB // 2
+    assert stats["disk_bytes"] <= 3 * MIB * 0.9
+    assert len(index.entries()) == 2
+    assert in_flight.exists()
+    # pior caso: conteúdo gravado + todos os slots baixando um arquivo do tamanho máximo
+    assert stats["disk_bytes"] + stats["reserved_bytes"] <= 5 * MIB
+
+
+def test_in_flight_downloads_do_not_cause_eviction(index, tmp_path):
+    _cache(index, tmp_path, "m0", MIB)
+    (tmp_path / "m1.media.abc.tmp").write_bytes(os.urandom(2 * MIB))
+
+    evictor = _evictor(tmp_path, budget=4 * MIB)
+    evictor.enforce()
+
+    assert list(index.entries()) == ["m0:media"]
+    assert evictor.stats()["evicted_files"] == 0
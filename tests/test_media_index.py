@@ -0,0 +1,51 @@
+from app.services import media_index as media_index_module
+from app.services.media_index import MediaIndex
+
+
+def _two_workers(tmp_path, monkeypatch):
+    # sem atraso: cada chamada relê a geração do SQLite
+    monkeypatch.setattr(media_index_module, "_GENERATION_CHECK_SECONDS", 0.0)
+    first, second = MediaIndex(), MediaIndex()
+    first.open(str(tmp_path))
+    second.open(str(tmp_path))
+    return first, second
+
+
+def _put(index, tmp_path, media_id):
+    src = tmp_path / f"{media_id}.tmp"
+    src.write_bytes(media_id.encode())
+    index.put(media_id, "media", src_path=str(src), ext=".jpg", content_hash=f"{media_id:0>64}",
+              content_type="image/jpeg")
+
+
+def test_drop_and_clear_bump_generation_seen_by_other_worker(tmp_path, monkeypatch):
+    first, second = _two_workers(tmp_path, monkeypatch)
+    _put(first, tmp_path, "1")
+    _put(first, tmp_path, "2")
+    start = second.generation()
+
+    first.remove("1", invalidate=True)
+    assert second.generation() == start + 1
+
+    first.clear()
+    assert second.generation() == start + 2
+
+
+def test_eviction_remove_keeps_generation(tmp_path, monkeypatch):
+    first, second = _two_workers(tmp_path, monkeypatch)
+    _put(first, tmp_path, "1")
+    start = second.generation()
+
+    first.remove("1")  # evicção: as camadas quentes seguem válidas
+    assert second.generation() == start
+
+
+def test_generation_is_cached_between_checks(tmp_path):
+    first, second = MediaIndex(), MediaIndex()
+    first.open(str(tmp_path))
+    second.open(str(tmp_path))
+    start = second.generation()
+
+    first.clear()
+    assert first.generation() == start + 1  # a própria invalidação vale na hora
+    assert second.generation() == start  # o outro worker só relê depois do intervalo
@@ -0,0 +1,92 @@
+import os
+import time
+
+from flask import Flask
+
+from app.services import media_cache
+from app.services.media_eviction import MediaEvictor
+from app.services.media_index import MediaIndex, lock_path, try_lock, unlock
+
+
+def test_lock_is_exclusive_and_removed_on_unlock(tmp_path):
+    path = str(tmp_path / "123.media.lock")
+    fd = try_lock(path)
+    assert fd is not None
+    assert try_lock(path) is None
+    unlock(fd, path)
+    assert not os.path.exists(path)
+
+
+def test_lock_on_unlinked_file_is_retaken_on_current_file(tmp_path):
+    path = str(tmp_path / "123.media.lock")
+    holder = try_lock(path)
+    # outro fetcher abriu o arquivo antes do dono apagá-lo e liberar
+    waiter = os.open(path, os.O_RDWR)
+    unlock(holder, path)
+    try:
+        fd = try_lock(path)
+        assert fd is not None
+        assert os.path.exists(path)
+        assert os.fstat(fd).st_ino != os.fstat(waiter).st_ino
+        assert try_lock(path) is None
+        unlock(fd, path)
+    finally:
+        os.close(waiter)
+
+
+def test_evictor_sweeps_unheld_lock_files(tmp_path):
+    shard = tmp_path / "ab"
+    shard.mkdir()
+    stale = shard / "999.media.lock"
+    stale.touch()  # sobra de worker morto no meio de um download
+    held_path = str(shard / "123.media.lock")
+    held = try_lock(held_path)
+
+    MediaEvictor()._scan(str(tmp_path))
+
+    assert not stale.exists()
+    assert os.path.exists(held_path)
+    unlock(held, held_path)
+
+
+def test_download_registry_is_owned_by_its_tmp(tmp_path):
+    index = MediaIndex()
+    index.open(str(tmp_path))
+    first = str(tmp_path / "ab" / "123.media.jpg.x1.tmp")
+    second = str(tmp_path / "ab" / "123.media.jpg.x2.tmp")
+    index.begin_download("123", "media", path=first, length=10, content_type="image/jpeg")
+    download = index.get_download("123", "media")
+    assert (download["path"], download["length"], download["content_type"]) == (first, 10, "image/jpeg")
+
+    # o registro morto foi assumido por outro líder: o fim do antigo não apaga o novo
+    index.begin_download("123", "media", path=second, length=None, content_type="image/jpeg")
+    index.end_download("123", "media", first)
+    assert index.get_download("123", "media")["path"] == second
+    index.end_download("123", "media", second)
+    assert index.get_download("123", "media") is None
+
+
+def test_lock_and_download_waits_share_one_deadline(tmp_path, monkeypatch):
+    index = MediaIndex()
+    index.open(str(tmp_path))
+    monkeypatch.setattr(media_cache, "media_index", index)
+    monkeypatch.setattr(media_cache, "_refresh_media", lambda *a, **kw: ('', ''))
+    app = Flask(__name__)
+    app.config.update(MEDIA_CACHE_DIR=str(tmp_path), MEDIA_DOWNLOAD_LOCK_TIMEOUT_SECONDS=0.3,
+                      MEDIA_CACHE_TTL_SECONDS=3600)
+    # outro worker segura a trava e tem um tee em andamento que não termina
+    held_path = lock_path(str(tmp_path), "9", "media")
+    os.makedirs(os.path.dirname(held_path), exist_ok=True)
+    held = try_lock(held_path)
+    tmp = tmp_path / "9.media.jpg.x.tmp"
+    tmp.write_bytes(b"\xff\xd8")
+    index.begin_download("9", "media", path=str(tmp), length=100, content_type="image/jpeg")
+    try:
+        with app.app_context():
+            start = time.monotonic()
+            media_cache._refresh_locked("9", "media", None, False, media_cache._lock_deadline())
+            elapsed = time.monotonic() - start
+    finally:
+        unlock(held, held_path)
+    # trava (T) + download em andamento (T) + trava de novo (T) somavam 3T; agora o total é T
+    assert elapsed < 0.3 * 1.5
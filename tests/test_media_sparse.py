@@ -0,0 +1,160 @@
+import os
+import re
+
+import pytest
+from flask import Flask
+
+from app.services import media_cache
+from app.services.media_index import MediaIndex, chunk_count, has_chunk, partial_path
+
+CHUNK = 1024
+DATA = bytes(range(256)) * 16  # 4 KiB: 4 trechos de 1 KiB
+
+
+class FakeRangeCDN:
+    def __init__(self, start, end):
+        self.status_code = 206
+        self.body = DATA[start:end + 1]
+        self.headers = {"Content-Range": f"bytes {start}-{end}/{len(DATA)}", "Content-Type": "video/mp4"}
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def cdn_ranges(monkeypatch):
+    """Ranges pedidos ao CDN (None = sem Range, download inteiro)."""
+    calls = []
+
+    def fake_get(src, timeout=None, stream=False, headers=None):
+        rng = (headers or {}).get("Range")
+        calls.append(rng)
+        m = re.match(r"bytes=(\d+)-(\d+)$", rng or "")
+        assert m, f"download sem Range: {rng}"
+        return FakeRangeCDN(int(m.group(1)), min(int(m.group(2)), len(DATA) - 1))
+
+    monkeypatch.setattr(media_cache, "get", fake_get)
+    return calls
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    idx = MediaIndex()
+    idx.open(str(tmp_path))
+    monkeypatch.setattr(media_cache, "media_index", idx)
+    for name in ("record_write", "record_access"):
+        monkeypatch.setattr(media_cache.media_evictor, name, lambda *a: None)
+    return idx
+
+
+@pytest.fixture
+def app(tmp_path, index):
+    app = Flask(__name__)
+    app.config.update(MEDIA_CACHE_DIR=str(tmp_path), MEDIA_CACHE_MAX_BYTES=1 << 20,
+                      MEDIA_CACHE_TTL_SECONDS=3600, MEDIA_TEE_ENABLED=True, MEDIA_SPARSE_ENABLED=True,
+                      MEDIA_HOT_MAX_BYTES=0, MEDIA_HOT_MAX_OBJECT_BYTES=0, MEDIA_PLACEHOLDERS_ENABLED=False)
+    return app
+
+
+def _partial(app, index, media_id="7", chunks=()):
+    """Parcial de DATA com os trechos dados já gravados e marcados."""
+    path = partial_path(app.config['MEDIA_CACHE_DIR'], media_id, "media")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.truncate(len(DATA))
+        for i in chunks:
+            f.seek(i * CHUNK)
+            f.write(DATA[i * CHUNK:(i + 1) * CHUNK])
+    index.put_partial(media_id, "media", path=path, size=len(DATA), chunk_size=CHUNK,
+                      content_type="video/mp4", etag='"v1"', source_url="https://cdn/v.mp4")
+    for i in chunks:
+        index.mark_chunks(media_id, "media", i, i)
+    return path
+
+
+def _get(app, rng, media_id="7"):
+    with app.test_request_context("/", headers={"Range": rng} if rng else {}):
+        resp = media_cache.media_response(media_id, explicit_src="https://cdn/v.mp4")
+        body = b"".join(resp.response)
+        resp.close()
+        return resp, body
+
+
+def test_range_from_zero_fills_the_existing_partial(app, index, cdn_ranges):
+    _partial(app, index, chunks=(0, 3))
+
+    resp, body = _get(app, "bytes=0-")
+
+    assert resp.status_code == 206 and body == DATA
+    assert cdn_ranges == ["bytes=1024-3071"]  # só a lacuna, não o arquivo inteiro
+    assert index.get_partial("7", "media") is None
+    assert index.get("7", "media")["size"] == len(DATA)
+
+
+def test_bitmap_marks_chunks_across_byte_boundaries(app, index):
+    index.put_partial("9", "media", path=os.path.join(app.config['MEDIA_CACHE_DIR'], "9.part"),
+                      size=20 * CHUNK + 1, chunk_size=CHUNK, content_type="video/mp4")
+    assert chunk_count(20 * CHUNK + 1, CHUNK) == 21
+    assert len(index.get_partial("9", "media")["bitmap"]) == 3
+
+    index.mark_chunks("9", "media", 6, 9)
+    bitmap = index.mark_chunks("9", "media", 20, 20)
+
+    assert [i for i in range(21) if has_chunk(bitmap, i)] == [6, 7, 8, 9, 20]
+    assert index.get_partial("9", "media")["bitmap"] == bitmap
+    assert index.mark_chunks("ausente", "media", 0, 0) is None
+
+
+def test_range_inside_present_chunks_is_served_from_disk(app, index, cdn_ranges):
+    _partial(app, index, chunks=(0, 1))
+
+    resp, body = _get(app, "bytes=100-1500")
+
+    assert resp.status_code == 206 and body == DATA[100:1501]
+    assert cdn_ranges == []
+    assert index.get_partial("7", "media") is not None  # incompleto: continua parcial
+
+
+def test_only_the_gaps_are_fetched_and_adjacent_gaps_share_one_range(app, index, cdn_ranges):
+    _partial(app, index, chunks=(1,))
+
+    resp, body = _get(app, "bytes=0-4095")
+
+    assert body == DATA
+    assert cdn_ranges == ["bytes=0-1023", "bytes=2048-4095"]
+
+
+def test_fetch_completes_the_last_needed_chunk(app, index, cdn_ranges):
+    _partial(app, index)
+
+    resp, body = _get(app, "bytes=10-1500")
+
+    assert body == DATA[10:1501]
+    assert cdn_ranges == ["bytes=0-2047"]  # alinhado ao trecho: o próximo request acha 0 e 1 prontos
+    bitmap = index.get_partial("7", "media")["bitmap"]
+    assert [i for i in range(4) if has_chunk(bitmap, i)] == [0, 1]
+    with open(index.get_partial("7", "media")["path"], "rb") as f:
+        assert f.read(2 * CHUNK) == DATA[:2 * CHUNK]
+
+
+def test_filling_the_last_gap_promotes_the_partial_to_a_blob(app, index, cdn_ranges):
+    path = _partial(app, index, chunks=(0, 1, 2))
+
+    resp, body = _get(app, "bytes=-100")
+
+    assert body == DATA[-100:]
+    assert cdn_ranges == ["bytes=3072-4095"]
+    assert index.get_partial("7", "media") is None
+    assert not os.path.exists(path)
+    entry = index.get("7", "media")
+    with open(entry["path"], "rb") as f:
+        assert f.read() == DATA
+
+    # promovido: o próximo request sai do blob, sem CDN
+    resp, body = _get(app, None)
+    assert resp.status_code == 200 and body == DATA
+    assert cdn_ranges == ["bytes=3072-4095"]
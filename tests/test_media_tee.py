@@ -0,0 +1,85 @@
+import time
+
+import pytest
+from flask import Flask
+
+from app.services import media_cache
+from app.services.media_index import MediaIndex
+
+BODY = b"\xFF\xD8\xFF" + bytes(range(256)) * 1024
+
+
+class FakeCDN:
+    """Resposta do CDN em streaming: chunks de 64 KiB (corte em truncate_at, se dado)."""
+
+    def __init__(self, body=BODY, truncate_at=None):
+        self.body = body
+        self.sent = body[:truncate_at] if truncate_at is not None else body
+        self.headers = {"Content-Type": "image/jpeg", "Content-Length": str(len(body))}
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.sent), chunk_size):
+            yield self.sent[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    index = MediaIndex()
+    index.open(str(tmp_path))
+    monkeypatch.setattr(media_cache, "media_index", index)
+    monkeypatch.setattr(media_cache.media_evictor, "record_write", lambda *a: None)
+    app = Flask(__name__)
+    app.config.update(MEDIA_CACHE_DIR=str(tmp_path), MEDIA_CACHE_MAX_BYTES=len(BODY) * 2,
+                      MEDIA_PLACEHOLDERS_ENABLED=False)
+    with app.test_request_context("/", headers={"Range": "bytes=0-"}):
+        yield app
+
+
+def _wait_published(media_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if media_cache.media_index.get_download(media_id, "media") is None:
+            return media_cache._lookup_entry(media_id, "media")
+        time.sleep(0.01)
+    raise AssertionError("download não terminou")
+
+
+def test_client_disconnect_keeps_downloading_and_publishes(app):
+    cdn = FakeCDN()
+    tee = media_cache._TeeDownload("1", "media", cdn, "https://cdn/x.jpg")
+    resp = tee.response()
+    body = iter(resp.response)
+    assert next(body)  # o <video preload="metadata"> lê o começo e fecha
+    resp.close()
+
+    entry = _wait_published("1")
+    assert entry is not None and entry["size"] == len(BODY)
+    with open(entry["path"], "rb") as f:
+        assert f.read() == BODY
+    assert cdn.closed
+
+
+def test_truncated_download_is_discarded_after_disconnect(app):
+    cdn = FakeCDN(truncate_at=100_000)
+    tee = media_cache._TeeDownload("2", "media", cdn, "https://cdn/x.jpg")
+    resp = tee.response()
+    next(iter(resp.response))
+    resp.close()
+
+    assert _wait_published("2") is None
+
+
+def test_oversize_download_is_discarded_after_disconnect(app):
+    app.config["MEDIA_CACHE_MAX_BYTES"] = 100_000
+    cdn = FakeCDN()
+    cdn.headers.pop("Content-Length")  # sem tamanho declarado: só o contador pega
+    tee = media_cache._TeeDownload("3", "media", cdn, "https://cdn/x.jpg")
+    resp = tee.response()
+    next(iter(resp.response))
+    resp.close()
+
+    assert _wait_published("3") is None
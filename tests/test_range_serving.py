@@ -0,0 +1,97 @@
+import pytest
+from flask import Flask
+
+from app.services.media_cache import _parse_ranges, serve_file_with_range, _MAX_RANGES
+
+DATA = bytes(range(256)) * 40  # 10240 bytes
+
+
+@pytest.fixture
+def blob(tmp_path):
+    path = tmp_path / ("ab" * 32 + ".mp4")
+    path.write_bytes(DATA)
+    return str(path)
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+def _serve(app, blob, **headers):
+    with app.test_request_context("/", headers=headers):
+        resp = serve_file_with_range(blob, "video/mp4")
+        body = b"".join(resp.response)
+        resp.close()
+        return resp, body
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", [(0, 99)]),
+    ("bytes=500-", [(500, 10239)]),
+    ("bytes=-100", [(10140, 10239)]),
+    ("bytes=-99999", [(0, 10239)]),  # sufixo maior que o arquivo: o arquivo inteiro
+    ("bytes=9000-99999", [(9000, 10239)]),
+    ("bytes=200-299, 0-99", [(0, 99), (200, 299)]),  # ordenados
+    ("bytes=0-99,50-149,150-199", [(0, 199)]),  # sobrepostos e adjacentes unidos
+    ("bytes=-10,0-9", [(0, 9), (10230, 10239)]),
+])
+def test_parse_ranges_sorts_merges_and_clamps(header, expected):
+    assert _parse_ranges(header, len(DATA)) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=10240-", "bytes=-0", "bytes=20000-30000"])
+def test_parse_ranges_unsatisfiable(header):
+    assert _parse_ranges(header, len(DATA)) == []
+
+
+@pytest.mark.parametrize("header", ["items=0-1", "bytes=", "bytes=5-1", "bytes=a-b", "bytes=-"])
+def test_parse_ranges_invalid(header):
+    assert _parse_ranges(header, len(DATA)) is None
+
+
+def test_single_range_is_206_with_content_range(app, blob):
+    resp, body = _serve(app, blob, Range="bytes=100-199")
+    assert resp.status_code == 206
+    assert resp.headers["Content-Range"] == f"bytes 100-199/{len(DATA)}"
+    assert resp.headers["Content-Length"] == "100"
+    assert body == DATA[100:200]
+
+
+def test_suffix_range(app, blob):
+    resp, body = _serve(app, blob, Range="bytes=-16")
+    assert resp.status_code == 206 and body == DATA[-16:]
+
+
+@pytest.mark.parametrize("header", ["bytes=20000-", "bytes=5-1"])
+def test_unsatisfiable_or_invalid_range_is_416(app, blob, header):
+    resp, _ = _serve(app, blob, Range=header)
+    assert resp.status_code == 416
+    assert resp.headers["Content-Range"] == f"bytes */{len(DATA)}"
+
+
+def test_multipart_content_length_is_exact(app, blob):
+    resp, body = _serve(app, blob, Range="bytes=0-9,100-109,-5")
+    assert resp.status_code == 206
+    assert resp.mimetype == "multipart/byteranges"
+    assert int(resp.headers["Content-Length"]) == len(body)
+    boundary = resp.mimetype_params["boundary"]
+    parts = body.split(f"--{boundary}".encode())
+    assert parts[-1] == b"--\r\n"
+    assert parts[1].endswith(DATA[0:10] + b"\r\n")
+    assert b"Content-Range: bytes 100-109/10240\r\n\r\n" + DATA[100:110] in parts[2]
+    assert parts[3].endswith(DATA[-5:] + b"\r\n")
+
+
+def test_more_than_max_ranges_serves_the_whole_file(app, blob):
+    spec = ",".join(f"{i * 100}-{i * 100 + 9}" for i in range(_MAX_RANGES + 1))
+    resp, body = _serve(app, blob, Range=f"bytes={spec}")
+    assert resp.status_code == 200
+    assert resp.headers["Content-Length"] == str(len(DATA))
+    assert body == DATA
+
+
+def test_no_range_is_200_with_accept_ranges(app, blob):
+    resp, body = _serve(app, blob)
+    assert resp.status_code == 200 and body == DATA
+    assert resp.headers["Accept-Ranges"] == "bytes"
@@ -0,0 +1,115 @@
+import json
+
+import pytest
+import requests
+from flask import Flask
+
+from app.services import ratelimit
+from app.services.ratelimit import GraphRateGovernor, GraphRateLimited, _parse_usage_header
+
+CONFIG = dict(GRAPH_USAGE_SLOWDOWN_PCT=75.0, GRAPH_USAGE_PAUSE_PCT=95.0, GRAPH_MAX_THROTTLE_DELAY_SECONDS=2.0,
+              GRAPH_RATE_LIMIT_PAUSE_SECONDS=300.0, GRAPH_MAX_WAIT_SECONDS=5.0)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "time", clock.time)
+    monkeypatch.setattr(ratelimit.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture(autouse=True)
+def app_context():
+    app = Flask(__name__)
+    app.config.update(CONFIG)
+    with app.app_context():
+        yield
+
+
+def _response(status=200, headers=None, error_code=None):
+    resp = requests.Response()
+    resp.status_code = status
+    resp.headers.update(headers or {})
+    resp._content = json.dumps({"error": {"code": error_code}} if error_code else {}).encode()
+    return resp
+
+
+def test_parse_app_usage_takes_the_highest_percentage():
+    assert _parse_usage_header('{"call_count": 28, "total_time": 61, "total_cputime": 12}') == (61.0, 0.0)
+
+
+def test_parse_business_usage_over_all_buckets_in_seconds():
+    raw = json.dumps({"1784": [{"type": "instagram", "call_count": 40, "estimated_time_to_regain_access": 0}],
+                      "1785": [{"type": "ads", "total_time": 97, "estimated_time_to_regain_access": 3}]})
+    assert _parse_usage_header(raw) == (97.0, 180.0)
+
+
+@pytest.mark.parametrize("raw", [None, "", "não é json", "[1, 2]", '{"call_count": "x"}'])
+def test_parse_garbage_is_no_usage(raw):
+    assert _parse_usage_header(raw) == (0.0, 0.0)
+
+
+@pytest.mark.parametrize("usage, expected", [(0, 0.0), (74.9, 0.0), (75, 0.0), (85, 0.5), (95, 2.0), (120, 2.0)])
+def test_delay_grows_quadratically_between_slowdown_and_pause(usage, expected):
+    assert GraphRateGovernor()._delay_for(usage, CONFIG) == pytest.approx(expected)
+
+
+def test_usage_header_slows_down_the_next_call(clock):
+    governor = GraphRateGovernor()
+    governor.observe(_response(headers={"X-App-Usage": '{"call_count": 85}'}))
+    governor.before_call()
+    assert clock.slept == [pytest.approx(0.5)]
+    assert governor.stats()["throttled_calls"] == 1
+
+
+def test_stale_usage_stops_throttling(clock):
+    governor = GraphRateGovernor()
+    governor.observe(_response(headers={"X-App-Usage": '{"call_count": 85}'}))
+    clock.now += ratelimit._USAGE_STALE_SECONDS + 1
+    governor.before_call()
+    assert clock.slept == []
+
+
+def test_usage_at_pause_threshold_pauses_and_fails_fast(clock):
+    governor = GraphRateGovernor()
+    governor.observe(_response(headers={"X-App-Usage": '{"call_count": 96}'}))
+    with pytest.raises(GraphRateLimited) as exc:
+        governor.before_call()
+    assert exc.value.retry_in == pytest.approx(300)
+    assert clock.slept == []
+
+
+def test_rate_limit_error_code_pauses(clock):
+    governor = GraphRateGovernor()
+    governor.observe(_response(400, error_code=4))
+    assert governor.stats()["paused_for_seconds"] == 300
+
+
+def test_short_retry_after_waits_instead_of_failing(clock):
+    governor = GraphRateGovernor()
+    governor.observe(_response(503, headers={"Retry-After": "3"}))
+    governor.before_call()
+    assert clock.slept == [pytest.approx(3)]
+    governor.before_call()  # pausa cumprida
+    assert len(clock.slept) == 1
+
+
+def test_regain_access_estimate_extends_the_pause(clock):
+    governor = GraphRateGovernor()
+    raw = json.dumps({"1784": [{"call_count": 50, "estimated_time_to_regain_access": 10}]})
+    governor.observe(_response(headers={"X-Business-Use-Case-Usage": raw}))
+    assert governor.stats()["paused_for_seconds"] == 600